@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
 from __future__ import division, print_function, absolute_import
-from freqdemod.demodulate import Signal
+from freqdemod.demodulate import Signal, SignalBatch
 from freqdemod.hdf5.hdf5_util import h5ls
 from freqdemod.tests import main as test
\ No newline at end of file
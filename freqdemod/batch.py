@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# batch.py
+
+"""
+
+Work up many signal files in parallel.  Each input ``.h5`` file is loaded
+into its own *Signal* with ``Signal.load_hdf5`` (or
+``Signal.load_hdf5_general``), put through a *recipe* -- a list of
+``(method, kwargs)`` pairs naming *Signal* workup methods -- and saved,
+either next to its siblings in an output directory with ``Signal.save`` or
+as one group per input file in a single consolidated output file.  The
+files are spread over a ``concurrent.futures.ProcessPoolExecutor``.
+
+Example::
+
+    from freqdemod import batch
+
+    recipe = [('time_mask_binarate', {'mode': 'middle'}),
+              ('time_window_cyclicize', {'tw': 3E-3}),
+              ('fft', {}),
+              ('freq_filter_Hilbert_complex', {}),
+              ('freq_filter_bp', {'bw': 1.0}),
+              ('time_mask_rippleless', {'td': 15E-3}),
+              ('ifft', {}),
+              ('fit_phase', {'dt_chunk_target': 250E-6})]
+
+    report = batch.run('data/run-*.h5', recipe, output_file='fits.h5',
+                       workers=8, memory_budget=2*2**30)
+    print(report)
+
+The one-call ``('demodulate', {...})`` recipe needs far less memory than the
+staged recipe above.
+
+"""
+
+from __future__ import division, print_function, absolute_import
+import os
+import sys
+import glob
+import time
+import concurrent.futures
+import h5py
+import six
+from freqdemod.demodulate import Signal
+from freqdemod.hdf5.array_store import ArrayFile
+
+# Memory used by a staged workup, per signal point: the signal, the
+# complex spectrum and analytic signal, filters, phase, amplitude,
+# and the temporary copies made along the way
+
+BYTES_PER_SAMPLE = 256
+
+class BatchReport(object):
+
+    """
+    The outcome of a batch run.
+
+    :param int n_files: number of input files
+    :param int n_ok: number of files worked up successfully
+    :param int n_samples: total number of signal points worked up
+    :param float elapsed: wall-clock time [s]
+    :param list failures: ``(filename, message)`` pairs
+    :param list outputs: the output file, or group in the consolidated
+        file, written for each successful input file
+    """
+
+    def __init__(self, n_files):
+        self.n_files = n_files
+        self.n_ok = 0
+        self.n_samples = 0
+        self.elapsed = 0.0
+        self.failures = []
+        self.outputs = []
+
+    @property
+    def files_per_s(self):
+        return self.n_ok/self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def samples_per_s(self):
+        return self.n_samples/self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        lines = ["Worked up {0} of {1} files ({2} points)"
+                 " in {3:.1f} s:".format(self.n_ok, self.n_files,
+                                         self.n_samples, self.elapsed),
+                 "{0:.2f} files/s, {1:.3g} samples/s.".format(
+                     self.files_per_s, self.samples_per_s)]
+        if len(self.failures) > 0:
+            lines.append("{0} failures:".format(len(self.failures)))
+            for filename, message in self.failures:
+                lines.append("    {0}: {1}".format(filename, message))
+        return "\n".join(lines)
+
+def _signal_points(filename, load_kwargs):
+    """The number of points in the signal dataset of ``filename``."""
+
+    with h5py.File(filename, 'r') as fh:
+        return fh[load_kwargs.get('s_dataset', 'y')].size
+
+def _workup_file(filename, recipe, loader, load_kwargs, store, save, dest):
+    """
+    Load, work up, and save one file.  With ``dest=None``, return the saved
+    datasets in an ``ArrayFile`` for the parent process to write.
+    """
+
+    S = Signal(store=store)
+    try:
+        getattr(S, loader)(filename, **load_kwargs)
+        n = S.f['y'].size
+
+        for method, kwargs in recipe:
+            getattr(S, method)(**kwargs)
+
+        if dest is None:
+            result = ArrayFile()
+            S.save(result, save)
+        else:
+            S.save(dest, save, overwrite=True)
+            result = dest
+    finally:
+        S.close()
+
+    return n, result
+
+def _group_name(filename, used):
+    """A unique group name in the consolidated file for ``filename``."""
+
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    name, k = stem, 1
+    while name in used:
+        name = "{0}_{1}".format(stem, k)
+        k = k + 1
+    used.add(name)
+    return name
+
+def run(inputs, recipe, output_dir=None, output_file=None, save='fit_phase',
+        workers=None, memory_budget=None, loader='load_hdf5',
+        load_kwargs=None, store='numpy', progress=True):
+
+    """
+    Work up every file matching ``inputs``.
+
+    :param inputs: a glob pattern, or a list of patterns and filenames
+    :param list recipe: ``(method, kwargs)`` pairs; each *Signal* method is
+        called in turn with its keyword arguments
+    :param str output_dir: save each file's workup to a file of the same
+        name in this directory, with ``Signal.save(..., save)``
+    :param str output_file: instead, save every file's workup to one group
+        per input file, named after the input file, in this file
+    :param save: what to save; see ``Signal.save`` (defaults to
+        ``'fit_phase'``)
+    :param int workers: number of worker processes; defaults to the number
+        of CPUs.  With ``workers=1`` the files are worked up one after
+        another in this process.
+    :param int memory_budget: the most memory [bytes] one worker may use.
+        Files estimated to need more, at ``BYTES_PER_SAMPLE`` bytes per
+        signal point, are not loaded and are reported as failures.
+    :param str loader: ``'load_hdf5'`` (default) or ``'load_hdf5_general'``
+    :param dict load_kwargs: keyword arguments for the loader
+    :param str store: the *Signal* store, ``'numpy'`` (default) or
+        ``'hdf5'``
+    :param bool progress: If True, print a line as each file finishes
+
+    Return a :class:`BatchReport`.
+    """
+
+    if (output_dir is None) == (output_file is None):
+        raise ValueError("Specify exactly one of output_dir or output_file")
+
+    if loader not in ('load_hdf5', 'load_hdf5_general'):
+        raise ValueError("Unrecognized loader '{0}'; use 'load_hdf5' or"
+                         " 'load_hdf5_general'".format(loader))
+
+    for method, kwargs in recipe:
+        if method.startswith('_') or not hasattr(Signal, method):
+            raise ValueError("Unrecognized workup step '{0}'".format(method))
+
+    load_kwargs = {} if load_kwargs is None else dict(load_kwargs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if isinstance(inputs, six.string_types):
+        inputs = [inputs]
+    filenames = []
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            filenames.extend(sorted(glob.glob(pattern)))
+        else:
+            filenames.append(pattern)
+
+    report = BatchReport(len(filenames))
+    start = time.time()
+
+    # Check the memory budget before handing the files out
+
+    jobs = []
+    for filename in filenames:
+        try:
+            if memory_budget is not None:
+                need = BYTES_PER_SAMPLE*_signal_points(filename, load_kwargs)
+                if need > memory_budget:
+                    raise MemoryError("needs ~{0} MB, over the budget of"
+                                      " {1} MB".format(need//2**20,
+                                                       memory_budget//2**20))
+            if output_dir is not None:
+                dest = os.path.join(output_dir, os.path.basename(filename))
+                if os.path.abspath(dest) == os.path.abspath(filename):
+                    raise ValueError("output would overwrite the input file")
+            else:
+                dest = None
+        except Exception as e:
+            report.failures.append((filename, "{0}: {1}".format(
+                type(e).__name__, e)))
+            continue
+        jobs.append((filename, dest))
+
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    f_out = h5py.File(output_file, 'w') if output_file is not None else None
+    used = set()
+
+    def finish(filename, outcome, error):
+        done = report.n_ok + len(report.failures) + 1
+        if error is None:
+            n, result = outcome
+            if f_out is not None:
+                name = _group_name(filename, used)
+                result.materialize(f_out.create_group(name))
+                result = output_file + ':/' + name
+            report.n_ok += 1
+            report.n_samples += n
+            report.outputs.append(result)
+            status = "ok"
+        else:
+            message = "{0}: {1}".format(type(error).__name__, error)
+            report.failures.append((filename, message))
+            status = "FAILED ({0})".format(message)
+        if progress == True:
+            elapsed = time.time() - start
+            print("[{0}/{1}] {2} {3}; {4:.2f} files/s".format(
+                done, report.n_files, filename, status,
+                report.n_ok/elapsed if elapsed > 0 else 0.0))
+            sys.stdout.flush()
+
+    try:
+        if workers <= 1:
+            for filename, dest in jobs:
+                try:
+                    outcome = _workup_file(filename, recipe, loader,
+                                           load_kwargs, store, save, dest)
+                except Exception as e:
+                    finish(filename, None, e)
+                else:
+                    finish(filename, outcome, None)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = dict((pool.submit(_workup_file, filename, recipe,
+                                            loader, load_kwargs, store,
+                                            save, dest), filename)
+                               for filename, dest in jobs)
+                for future in concurrent.futures.as_completed(futures):
+                    error = future.exception()
+                    finish(futures[future],
+                           future.result() if error is None else None, error)
+    finally:
+        if f_out is not None:
+            f_out.close()
+
+    report.elapsed = time.time() - start
+    return report
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache.py
+
+"""
+
+Least-recently-used caches for the arrays that are identical from one signal
+to the next when a stream of same-length signals is worked up: the
+cyclicizing window and the bandpass filter.  Each cache has a memory cap and
+counts its hits and misses ::
+
+    from freqdemod.cache import filter_cache, window_cache
+    filter_cache.info()     # {'hits': 9, 'misses': 1, 'size': 1, ...}
+    filter_cache.max_bytes = 64*2**20
+    filter_cache.clear()
+
+Cached arrays are marked read-only, since they are shared by every signal
+that uses them.
+
+"""
+
+from __future__ import division, print_function, absolute_import
+import threading
+from collections import OrderedDict
+
+class ArrayCache(object):
+
+    def __init__(self, max_bytes=256*2**20):
+        """
+        A least-recently-used cache of numpy arrays.
+
+        :param int max_bytes: the most memory the cached arrays may use;
+            the least recently used arrays are discarded to stay under it
+        """
+
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Return the array stored under ``key``.  If there is none, call
+        ``compute()`` to create it and store the result.
+        """
+
+        with self._lock:
+            if key in self._arrays:
+                self._arrays.move_to_end(key)
+                self.hits += 1
+                return self._arrays[key]
+            self.misses += 1
+
+        array = compute()
+        array.flags.writeable = False
+
+        with self._lock:
+            if key not in self._arrays and array.nbytes <= self.max_bytes:
+                self._arrays[key] = array
+                self.nbytes += array.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, old = self._arrays.popitem(last=False)
+                    self.nbytes -= old.nbytes
+
+        return array
+
+    def clear(self):
+        """Empty the cache and reset the hit and miss counters."""
+
+        with self._lock:
+            self._arrays.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hits, misses, number of arrays, and memory used."""
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._arrays),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self._arrays)
+
+filter_cache = ArrayCache()
+window_cache = ArrayCache(max_bytes=64*2**20)
@@ -57,22 +57,679 @@ import math
 import time
 import datetime
 import warnings
+import json
+import inspect
+import functools
+import concurrent.futures
 from lmfit import minimize, Parameters, fit_report
 from freqdemod.hdf5 import update_attrs
 from freqdemod.hdf5 import check_minimum_attrs
 from freqdemod.hdf5 import infer_missing_attrs
 from freqdemod.hdf5 import infer_labels
-from freqdemod.hdf5.hdf5_util import save_hdf5, h5ls
+from freqdemod.hdf5.hdf5_util import save_hdf5, h5ls, copy_item
+from freqdemod.hdf5.array_store import ArrayFile
 print_hdf5_item_structure = h5ls  # Alias for backward compatibility
 from freqdemod.util import timestamp_temp_filename
 from freqdemod.util import infer_timestep
+from freqdemod.util import next_fast_len, prev_fast_len
+from freqdemod import fftbackend
+from freqdemod.cache import filter_cache, window_cache
 from collections import OrderedDict
 import six
+from scipy.signal import firwin, upfirdn
 import matplotlib.pyplot as plt 
 
+def _binarate_bounds(n, mode, length="power of two", smooth=5):
+    """
+    Return ``(n_start, n_stop, n_pad)``: the range of indices of an
+    ``n``-point signal to keep, and the number of zeros to append, so that
+    the FFT length is a power of two or another fast length.  See
+    :meth:`Signal.time_mask_binarate` for the meaning of the parameters.
+    """
+
+    if length == "power of two":
+
+        # nearest power of 2 to n
+        n2 = int(math.pow(2,int(math.floor(math.log(n, 2)))))
+
+    elif length == "trim":
+
+        n2 = prev_fast_len(n, smooth)
+
+    elif length == "pad":
+
+        return 0, n, next_fast_len(n, smooth) - n
+
+    else:
+
+        raise ValueError("Unrecognized length '{0}'; use 'power of two',"
+                         " 'trim', or 'pad'".format(length))
+
+    if mode == "middle":
+
+        n_start = int(math.floor((n - n2)/2))
+        n_stop = int(n_start + n2)
+
+    elif mode == "start":
+
+        n_start = 0
+        n_stop = n2
+
+    elif mode == "end":
+
+        n_start = n-n2
+        n_stop = n
+
+    else:
+
+        raise ValueError("Unrecognized mode '{0}'; use 'start', 'middle',"
+                         " or 'end'".format(mode))
+
+    return n_start, n_stop, 0
+
+def _cyclicize_window(n, ww, n_pad=0):
+    """
+    An ``n``-point window rising and falling over ``ww`` points.  The last
+    ``n_pad`` points, the zero padding, are excluded from the window.  See
+    :meth:`Signal.time_window_cyclicize`.  The window is cached and returned
+    read-only.
+    """
+
+    def compute():
+        return np.concatenate([np.blackman(2*ww)[0:ww],
+                               np.ones(n-n_pad-2*ww),
+                               np.blackman(2*ww)[-ww:],
+                               np.zeros(n_pad)])
+
+    return window_cache.get(('cyclicize', n, ww, n_pad), compute)
+
+def _hilbert_filter(freq, layout=None, n_fft=None):
+    """
+    The complex Hilbert transform filter evaluated at ``freq``.  See
+    :meth:`Signal.freq_filter_Hilbert_complex`.  In the ``'rfft'`` layout
+    of an even-length signal, zero the +fs/2 bin, which the ``'fftshift'``
+    layout lists as -fs/2, so that the two layouts give the same analytic
+    signal.
+    """
+
+    filt = 0.0*(freq < 0) + 1.0*(freq == 0) + 2.0*(freq > 0)
+
+    if layout == 'rfft' and n_fft % 2 == 0:
+        filt[-1] = 0.0
+
+    return filt
+
+def _analytic_ifft(s, n_fft):
+    """
+    Inverse transform the Hilbert-filtered half spectrum ``s`` of an
+    ``n_fft``-point real signal.  The negative-frequency components of the
+    analytic signal are zero, so they are simply left empty.
+    """
+
+    full = np.zeros(s.shape[:-1] + (n_fft,), dtype=complex)
+    full[..., 0:s.shape[-1]] = s
+    return fftbackend.ifft(full)
+
+def _bandpass_template(m, df, bw, order, style):
+    """
+    The bandpass filter evaluated at offsets of ``-(m-1)`` to ``m-1``
+    frequency bins of width ``df`` from the center frequency.
+    """
+
+    freq = df*np.arange(-(m-1), m)
+    freq_scaled = freq/bw
+
+    if style == "brick wall":
+
+        bp = 1.0/(1.0+np.power(abs(freq_scaled),order))
+
+    elif style == "cosine":
+
+        # here we use a trick
+
+        bp = np.zeros(freq.shape)
+        sub_index = (freq >= -1.0*bw) & (freq <= bw)
+        sub_indices = np.arange(freq.size)[sub_index]
+        bp[sub_indices] = np.sin(np.linspace(0,np.pi,sub_indices.size))
+
+    elif style == "gaussian":
+
+        bp = np.exp(-1 * np.power(freq_scaled, 2.0))
+
+    else:
+
+        raise ValueError("Unrecognized filter style '{0}'".format(style))
+
+    return bp
+
+def _bandpass_filter(freq, i_c, bw, order, style):
+    """
+    The bandpass filter evaluated at the evenly spaced frequencies ``freq``
+    with center frequency ``freq[i_c]``.  See :meth:`Signal.freq_filter_bp`
+    for the meaning of ``bw``, ``order``, and ``style``.  If ``i_c`` is an
+    array of center bins, return one filter per center bin, stacked along
+    the last axis.
+
+    The filter depends on the center frequency only through the bin index
+    ``i_c``, so it is a slice of a cached template twice as long as ``freq``;
+    moving the center frequency by a whole number of bins reuses the
+    template.  The returned array is a read-only view.
+    """
+
+    m = freq.size
+    df = freq[1] - freq[0]
+    template = filter_cache.get(
+        ('bp', m, df, bw, order, style),
+        lambda: _bandpass_template(m, df, bw, order, style))
+
+    i_c = np.asarray(i_c)
+    if i_c.ndim == 0:
+        return template[m-1-i_c:2*m-1-i_c]
+    return template[(m-1-i_c)[..., np.newaxis] + np.arange(m)]
+
+def _lockin(y, dt, fc, h, decimate, block=2**20):
+    """
+    Mix the signal ``y`` down by the local oscillator frequency ``fc``
+    [kHz], low-pass filter it with the symmetric FIR filter ``h``, of length
+    ``2*decimate*K + 1``, and keep every ``decimate``-th point.  See
+    :meth:`Signal.lockin`.  If ``y`` is an (N, n) stack of signals, ``fc``
+    may hold one frequency per signal.
+
+    Output point ``j`` is centered on input point ``j*decimate``.  Only the
+    points whose filter spans lie entirely inside the signal are computed,
+    starting at ``j = K``, so there are no edge transients.  The signal is
+    mixed and filtered about ``block`` input points at a time with a
+    polyphase filter, ``scipy.signal.upfirdn``.  Return the complex
+    baseband signal, scaled by two so that its magnitude is the amplitude
+    of the oscillation, and the index of its first point.
+    """
+
+    D = decimate
+    K = (h.size - 1)//(2*D)
+    n = y.shape[-1]
+    j_first = K
+    n_out = max(0, (n - 1)//D - K - j_first + 1)
+    f_step = (1E3*np.asarray(fc)*dt)[..., np.newaxis]  # cycles per point
+
+    z = np.empty(y.shape[:-1] + (n_out,), dtype=complex)
+    L = max(1, block//D)
+    for j0 in range(j_first, j_first + n_out, L):
+        j1 = min(j0 + L, j_first + n_out)
+        k = np.arange(j0*D - D*K, (j1 - 1)*D + D*K + 1)
+        lo = np.exp(-2j*np.pi*np.mod(f_step*k, 1.0))
+        out = upfirdn(h, y[..., k[0]:k[-1] + 1]*lo, down=D, axis=-1)
+        z[..., j0 - j_first:j1 - j_first] = out[..., 2*K:2*K + j1 - j0]
+    z *= 2
+
+    return z, j_first
+
+def _fit_phase_chunks(x, y, dt, n_per_chunk):
+    """
+    Break the phase ``y`` *vs* time ``x`` data into chunks of
+    ``n_per_chunk`` points and fit each chunk to a line.  Return the time in
+    the middle of each chunk and the best-fit slope.  See
+    :meth:`Signal.fit_phase`.  If ``y`` is two dimensional, each row is
+    fit against the same time axis ``x``.
+    """
+
+    n_tot_chunk = int(y.shape[-1]/n_per_chunk)   # total number of chunks
+    n_total = n_per_chunk*n_tot_chunk            # (realizable) no. of phase points
+
+    # Reshape the phase data and 
+    #  zero the phase at start of each chunk
+
+    y_sub = y[..., 0:n_total].reshape(y.shape[:-1] + (n_tot_chunk,n_per_chunk))
+    y_sub_reset = y_sub - y_sub[..., 0:1]*np.ones(n_per_chunk)
+
+    # Reshape the time data
+    #  zero the time at start of each chunk
+
+    x_sub = x[0:n_total].reshape((n_tot_chunk,n_per_chunk))
+    x_sub_reset = x_sub - x_sub[:,:,np.newaxis][:,0,:]*np.ones(n_per_chunk)
+
+    # use linear least-squares fitting formulas
+    #  to calculate the best-fit slope
+
+    SX = dt*0.50*(n_per_chunk-1)*(n_per_chunk)
+    SXX = (dt)**2*(1/6.0)*(n_per_chunk)*(n_per_chunk-1)*(2*n_per_chunk-1)
+    SY = np.sum(y_sub_reset,axis=-1)
+    SXY = np.sum(x_sub_reset*y_sub_reset,axis=-1)
+    slope = (n_per_chunk*SXY-SX*SY)/(n_per_chunk*SXX-SX*SX)
+
+    # Tricky: the time we want is the time in the ~middle~ of each chunk
+    #
+    #     old: x_sub[:,0]
+    #     new: x_sub_middle = np.mean(x_sub[:,:],axis=1)
+
+    x_sub_middle = np.mean(x_sub[:,:],axis=1)
+
+    return x_sub_middle, slope
+
+def _phase_prefix_sums(y, m):
+    """
+    The prefix sums of the phase ``y`` used by :func:`_fit_phase_sliding`,
+    restarted every ``m`` points.
+
+    The sums :math:`S_y` and :math:`S_{xy}` of every chunk are differences
+    of the prefix sums of :math:`y_j` and :math:`j \\: y_j`.  Summed over
+    the whole record, those prefix sums grow with the record's length and
+    curvature until their differences are lost to round-off, so the record
+    is split into blocks of ``m`` points.  A straight line through the
+    first and last phase points is subtracted, and within each block the
+    prefix sums are taken of the phase relative to the block's first
+    point, against the index from the block's start.  A chunk of ``m``
+    points spans at most two blocks.  Return the prefix sums, each with
+    shape ``(..., n_blocks, m + 1)``, the detrended phase at the start of
+    each block, the detrended phase, and the slope of the line
+    [cyc/point].
+    """
+
+    n = y.shape[-1]
+    j = np.arange(n)
+
+    trend = (y[..., -1:] - y[..., 0:1])/(n - 1)
+    y_detrend = y - y[..., 0:1] - trend*j
+
+    # One block more than needed, so that the second block of the last
+    # chunk always exists
+
+    n_blocks = n//m + 1
+    u = np.zeros(y.shape[:-1] + (n_blocks*m,))
+    u[..., 0:n] = y_detrend
+    u = u.reshape(y.shape[:-1] + (n_blocks, m))
+    v = u[..., 0].copy()
+    u -= v[..., np.newaxis]
+
+    P = np.zeros(y.shape[:-1] + (n_blocks, m + 1))
+    Q = np.zeros(y.shape[:-1] + (n_blocks, m + 1))
+    np.cumsum(u, axis=-1, out=P[..., 1:])
+    np.cumsum(np.arange(m)*u, axis=-1, out=Q[..., 1:])
+
+    return P, Q, v, y_detrend, trend
+
+def _fit_phase_sliding(x, y, dt, n_per_chunk, n_hop):
+    """
+    Fit every window of ``n_per_chunk`` phase points, starting every
+    ``n_hop`` points, to a line.  Return the time in the middle of each
+    window and the best-fit slope.  See :meth:`Signal.fit_phase`.  The cost
+    does not depend on the window length or the hop.
+    """
+
+    m = n_per_chunk
+    P, Q, v, y_detrend, trend = _phase_prefix_sums(y, m)
+
+    n = y.shape[-1]
+    i = np.arange(0, n - m + 1, n_hop)    # window starts
+    b = i//m                              # block of each window start
+    r = i - b*m                           # offset of the start in its block
+    y_start = y_detrend[..., i]
+
+    # Sum y - y_start and (j - i) (y - y_start) over the points [l0, l1) of
+    # block bb, whose first point is d points after the window start
+
+    SY = 0.0
+    SXY = 0.0
+    for bb, l0, l1 in [(b, r, m), (b + 1, 0, r)]:
+        d = bb*m - i
+        c = l1 - l0
+        L = 0.5*(l0 + l1 - 1)*c
+        A = P[..., bb, l1] - P[..., bb, l0]
+        B = Q[..., bb, l1] - Q[..., bb, l0]
+        dv = v[..., bb] - y_start
+        SY = SY + A + c*dv
+        SXY = SXY + B + d*A + dv*(L + d*c)
+    SXY = dt*SXY
+
+    SX = dt*0.50*(m-1)*(m)
+    SXX = (dt)**2*(1/6.0)*(m)*(m-1)*(2*m-1)
+    slope = (m*SXY-SX*SY)/(m*SXX-SX*SX) + trend/dt
+
+    x_middle = 0.5*(x[i] + x[i + m - 1])
+
+    return x_middle, slope
+
+# The most points of traces fit at once by fit_exp_decay
+
+_EXP_FIT_BLOCK_POINTS = 2**19
+
+def _exp_decay_guess(x, y):
+    """
+    A closed-form estimate of the parameters of the decaying exponential
+    :math:`y = a_0 \\exp(-x/\\tau) + a_1` fit to the data ``y`` *vs*
+    ``x``.  If ``y`` is two dimensional, each row is estimated separately.
+    Return ``a0``, ``tau``, and ``a1``.
+
+    The decay obeys :math:`y' = -(y - a_1)/\\tau`, so, integrated,
+    :math:`y` is linear in its running integral :math:`S(x)` and in
+    :math:`x`, with the slopes :math:`-1/\\tau` and :math:`a_1/\\tau`.  A
+    linear least-squares fit gives :math:`\\tau`, and a second one, of
+    :math:`y` to :math:`\\exp(-x/\\tau)` and a constant, gives :math:`a_0`
+    and :math:`a_1`.  Where that fails -- a rising or flat trace -- fall
+    back on a line fit to :math:`\\log(y - \\min(y))`.
+    """
+
+    y = np.asarray(y, dtype=float)
+    shape = y.shape[:-1]
+    y = y.reshape((-1, y.shape[-1]))
+    T = x[-1] - x[0]
+    t = (x - x[0])/T                       # scaled time, 0 to 1
+    n = t.size
+
+    # The running integral, by the trapezoid rule
+
+    S = np.zeros_like(y)
+    np.cumsum(0.5*(y[:, 1:] + y[:, :-1])*np.diff(t), axis=-1, out=S[:, 1:])
+
+    # Fit y = c + A S + B t, with A = -1/tau in scaled time
+
+    MTM = np.empty((y.shape[0], 3, 3))
+    MTM[:, 0, 0] = n
+    MTM[:, 0, 1] = MTM[:, 1, 0] = S.sum(axis=-1)
+    MTM[:, 0, 2] = MTM[:, 2, 0] = t.sum()
+    MTM[:, 1, 1] = np.sum(S*S, axis=-1)
+    MTM[:, 1, 2] = MTM[:, 2, 1] = S.dot(t)
+    MTM[:, 2, 2] = t.dot(t)
+    MTy = np.stack([y.sum(axis=-1), np.sum(S*y, axis=-1), y.dot(t)], axis=-1)
+    with np.errstate(all='ignore'):
+        tau_s = -1/np.einsum('nij,nj->ni', np.linalg.pinv(MTM), MTy)[:, 1]
+
+    # Fall back on a line fit to the log of the trace above its minimum
+
+    bad = ~(np.isfinite(tau_s) & (tau_s > 0))
+    if np.any(bad):
+        y_min = y[bad].min(axis=-1, keepdims=True)
+        y_span = y[bad].max(axis=-1, keepdims=True) - y_min
+        z = np.log(y[bad] - y_min + 1E-3*y_span + np.finfo(float).tiny)
+        slope = (np.mean(t*z, axis=-1) - t.mean()*z.mean(axis=-1))/np.var(t)
+        tau_s[bad] = np.where(slope < 0, -1/slope, 1.0)
+
+    # Fit y = b exp(-t/tau) + a1, with b the amplitude at x[0]
+
+    e = np.exp(-t/tau_s[:, np.newaxis])
+    Se, See = e.sum(axis=-1), (e*e).sum(axis=-1)
+    Sy, Sey = y.sum(axis=-1), (e*y).sum(axis=-1)
+    det = n*See - Se*Se
+    b = (n*Sey - Se*Sy)/det
+    a1 = (See*Sy - Se*Sey)/det
+
+    tau = tau_s*T
+    a0 = b*np.exp(x[0]/tau)
+
+    return a0.reshape(shape), tau.reshape(shape), a1.reshape(shape)
+
+def _exp_decay_jacobian(params, x, y, y_stdev):
+    """
+    The Jacobian of the residual ``(a0*exp(-x/tau) + a1 - y)/y_stdev`` of
+    :meth:`Signal.fit_amplitude`, one row per parameter ``a0``, ``a1``,
+    ``tau``.
+    """
+
+    a0 = params['a0'].value
+    tau = params['tau'].value
+    e = np.exp(-x/tau)
+    J = np.array([e, np.ones_like(x), a0*e*x/tau**2])
+    rows = [['a0', 'a1', 'tau'].index(name) for name in params
+            if params[name].vary]
+    return J[rows]/y_stdev
+
+def fit_exp_decay(x, y, max_iter=100, tol=1E-10):
+    """
+    Fit every row of the (N, n) stack of traces ``y`` *vs* ``x`` to the
+    decaying exponential :math:`y = a_0 \\exp(-x/\\tau) + a_1`, all rows at
+    once, by a vectorized Levenberg-Marquardt iteration started from
+    :func:`_exp_decay_guess`.
+
+    :param np.array x: the time axis, shared by every trace
+    :param np.array y: the traces, one per row
+    :param int max_iter: the most iterations
+    :param float tol: stop iterating on a trace when a step changes its
+        sum of squared residuals by less than this fraction
+
+    The standard errors are those ``lmfit`` reports for
+    :meth:`Signal.fit_amplitude`'s fit: the square roots of the diagonal of
+    the inverse curvature matrix, scaled by the reduced chi-square.  Unlike
+    that fit, the amplitudes are not bounded below by zero.
+
+    The traces are fit in blocks of about ``_EXP_FIT_BLOCK_POINTS`` points,
+    which stay in the processor's cache from one iteration to the next.
+
+    Return an ``OrderedDict`` of the arrays ``tau``, ``tau_stderr``,
+    ``a0``, ``a0_stderr``, ``a1``, ``a1_stderr``, and ``converged``, one
+    element per trace, and the (N, n) best-fit traces.
+    """
+
+    y = np.asarray(y, dtype=float)
+    if y.ndim != 2:
+        raise ValueError("fit_exp_decay expects an (N, n) array of traces;"
+                         " got shape {0}".format(y.shape))
+
+    m = max(1, _EXP_FIT_BLOCK_POINTS//y.shape[1])
+    blocks = [_fit_exp_decay_block(x, y[k:k+m], max_iter, tol)
+              for k in range(0, y.shape[0], m)]
+
+    values = OrderedDict((key, np.concatenate([v[key] for v, _ in blocks]))
+                         for key in blocks[0][0])
+    y_calc = np.concatenate([y_calc for _, y_calc in blocks])
+
+    return values, y_calc
+
+def _fit_exp_decay_block(x, y, max_iter, tol):
+    """Fit the traces ``y``; see :func:`fit_exp_decay`."""
+
+
+    N, n = y.shape
+    T = x[-1] - x[0]
+    t = (x - x[0])/T
+
+    # Fit y = b exp(-k t) + a1 in scaled time, where b is the amplitude at
+    #  x[0] and k = T/tau; the parameters are of order one
+
+    a0, tau, a1 = _exp_decay_guess(x, y)
+    p = np.stack([a0*np.exp(-x[0]/tau), T/tau, a1], axis=-1)
+
+    T1 = np.stack([np.ones_like(t), t, t*t], axis=-1)   # powers of t
+
+    def residual(p, y):
+        """The residuals b e + a1 - y, and e = exp(-k t)"""
+        e = np.exp(-p[:, 1:2]*t)
+        r = p[:, 0:1]*e
+        r += p[:, 2:3]
+        r -= y
+        return r, e
+
+    def curvature(p, e):
+        """J^T J, from sums over t; the Jacobian rows are e, -b t e, 1"""
+        b = p[:, 0]
+        Se = e.dot(T1[:, 0:2])             # sums of e, t e
+        See = (e*e).dot(T1)                # sums of e^2, t e^2, t^2 e^2
+        JTJ = np.empty((p.shape[0], 3, 3))
+        JTJ[:, 0, 0] = See[:, 0]
+        JTJ[:, 0, 1] = JTJ[:, 1, 0] = -b*See[:, 1]
+        JTJ[:, 0, 2] = JTJ[:, 2, 0] = Se[:, 0]
+        JTJ[:, 1, 1] = b*b*See[:, 2]
+        JTJ[:, 1, 2] = JTJ[:, 2, 1] = -b*Se[:, 1]
+        JTJ[:, 2, 2] = n
+        return JTJ
+
+    def gradient(p, e, r):
+        """J^T r"""
+        Ser = (e*r).dot(T1[:, 0:2])
+        return np.stack([Ser[:, 0], -p[:, 0]*Ser[:, 1], r.sum(axis=-1)],
+                        axis=-1)
+
+    r, e = residual(p, y)
+    cost = np.einsum('nk,nk->n', r, r)
+    lam = np.full(N, 1E-3)
+    active = np.ones(N, dtype=bool)
+    converged = np.zeros(N, dtype=bool)
+
+    for it in range(max_iter):
+
+        # Work on views while every trace is active, copies afterwards
+
+        if active.all():
+            i = slice(None)
+        else:
+            i = np.nonzero(active)[0]
+            if i.size == 0:
+                break
+
+        # Solve the damped normal equations of every active trace
+
+        JTJ = curvature(p[i], e[i])
+        g = gradient(p[i], e[i], r[i])
+        A = JTJ.copy()
+        d = np.einsum('nii->ni', JTJ)
+        A[:, range(3), range(3)] += (lam[i, np.newaxis]*d
+                                     + 1E-12*d.max(axis=-1, keepdims=True))
+        step = -np.linalg.solve(A, g[..., np.newaxis])[..., 0]
+
+        # Keep the steps that lower the residual; damp the others more
+
+        p_new = p[i] + step
+        r_new, e_new = residual(p_new, y[i])
+        cost_new = np.einsum('nk,nk->n', r_new, r_new)
+        better = cost_new < cost[i]
+        small = np.abs(cost[i] - cost_new) <= tol*cost[i]
+
+        if isinstance(i, slice):
+            np.copyto(r, r_new, where=better[:, np.newaxis])
+            np.copyto(e, e_new, where=better[:, np.newaxis])
+            j = np.nonzero(better)[0]
+            i = np.arange(N)
+        else:
+            j = i[better]
+            r[j] = r_new[better]
+            e[j] = e_new[better]
+        p[j] = p_new[better]
+        cost[j] = cost_new[better]
+        lam[i] = np.where(better, lam[i]/10, lam[i]*10)
+
+        converged[i[small]] = True
+        active[i[small | (lam[i] > 1E10)]] = False
+
+    # Covariance of (b, k, a1), scaled by the reduced chi-square
+
+    C = np.linalg.pinv(curvature(p, e))*(cost/(n - 3))[:, np.newaxis, np.newaxis]
+
+    # Convert to (a0, tau, a1), propagating the covariance
+
+    b, k, a1 = p[:, 0], p[:, 1], p[:, 2]
+    tau = T/k
+    growth = np.exp(k*x[0]/T)
+    a0 = b*growth
+    G = np.zeros((N, 3, 3))
+    G[:, 0, 0] = growth                  # d a0 / d b
+    G[:, 0, 1] = b*growth*x[0]/T         # d a0 / d k
+    G[:, 1, 1] = -T/k**2                 # d tau / d k
+    G[:, 2, 2] = 1.0                     # d a1 / d a1
+    C = np.einsum('nij,njk,nlk->nil', G, C, G)
+    stderr = np.sqrt(np.einsum('nii->ni', C))
+    y_calc = y + r
+
+    values = OrderedDict([
+        ('tau', tau),
+        ('tau_stderr', stderr[:, 1]),
+        ('a0', a0),
+        ('a0_stderr', stderr[:, 0]),
+        ('a1', a1),
+        ('a1_stderr', stderr[:, 2]),
+        ('converged', converged)
+        ])
+
+    return values, y_calc
+
+# The workup graph.  For each *Signal* workup stage, in the order they are
+# run, the datasets and groups it creates and the stages whose output it
+# reads.  Re-running a stage with new parameters recomputes only the stages
+# downstream of it; see _workup_stage.
+
+_WORKUP_GRAPH = OrderedDict([
+    ('time_mask_binarate',
+        (['workup/time/mask/binarate', 'workup/time/x_binarated'],
+         [])),
+    ('time_window_cyclicize',
+        (['workup/time/window/cyclicize'],
+         ['time_mask_binarate'])),
+    ('fft',
+        (['workup/freq/freq', 'workup/freq/FT'],
+         ['time_mask_binarate', 'time_window_cyclicize'])),
+    ('freq_filter_Hilbert_complex',
+        (['workup/freq/filter/Hc'],
+         ['fft'])),
+    ('freq_filter_bp',
+        (['workup/freq/filter/bp'],
+         ['fft', 'freq_filter_Hilbert_complex'])),
+    ('time_mask_rippleless',
+        (['workup/time/mask/rippleless', 'workup/time/x_rippleless'],
+         ['time_mask_binarate'])),
+    ('ifft',
+        (['workup/time/z', 'workup/time/p', 'workup/time/a'],
+         ['time_mask_binarate', 'fft', 'freq_filter_Hilbert_complex',
+          'freq_filter_bp', 'time_mask_rippleless'])),
+    ('lockin',
+        (['workup/time/x_lockin', 'workup/time/z', 'workup/time/p',
+          'workup/time/a'],
+         ['freq_filter_bp'])),
+    ('pll',
+        (['workup/time/x_pll', 'workup/time/z', 'workup/time/p',
+          'workup/time/a', 'workup/fit/x', 'workup/fit/y'],
+         ['freq_filter_bp'])),
+    ('fit_phase',
+        (['workup/fit/x', 'workup/fit/y'],
+         ['ifft', 'lockin', 'pll'])),
+    ('fit_phase_multi',
+        (['workup/fit/multi'],
+         ['ifft', 'lockin', 'pll'])),
+    ('demodulate',
+        (['workup/fit/x', 'workup/fit/y'],
+         [])),
+    ('fit_amplitude',
+        (['workup/fit/exp'],
+         ['ifft', 'lockin', 'pll'])),
+    ('stability',
+        (['workup/stability'],
+         ['ifft', 'lockin', 'pll', 'fit_phase', 'demodulate'])),
+    ('sweep_bandpass',
+        (['workup/sweep'],
+         ['time_mask_binarate', 'fft', 'freq_filter_Hilbert_complex',
+          'time_mask_rippleless'])),
+    ])
+
+def _json_default(value):
+    """Encode the numpy arrays, scalars, and types in stage parameters."""
+
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return np.dtype(value).name
+
+def _workup_stage(method):
+    """
+    Make the *Signal* method ``method`` a stage of the workup graph,
+    ``_WORKUP_GRAPH``.  Every dataset the stage creates records the stage's
+    name, its parameters, and the datasets it read, in the ``stage``,
+    ``stage_params``, and ``stage_inputs`` attributes.  Calling the stage
+    again with the same parameters reuses its output.  Calling it with new
+    parameters replaces its output and recomputes, with their recorded
+    parameters, only the stages downstream of it that have been run.
+    """
+
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def stage(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = OrderedDict((key, value) for key, value
+                             in bound.arguments.items() if key != 'self')
+        return self._run_stage(method.__name__, method, params)
+
+    return stage
+
 class Signal(object):
 
-    def __init__(self, filename=None, mode='w-', driver='core', backing_store=False):
+    def __init__(self, filename=None, mode='w-', driver='core', backing_store=False,
+                 store='hdf5'):
         """
         Initialize the *Signal's* hdf5 data structure. Calling with no arguments
         results in an in-memory only object. To save the data to disk, provide
@@ -83,6 +740,15 @@ class Signal(object):
         :param str mode: file open mode (see h5py.File)
         :param str driver: hdf5 driver (see h5py.File)
         :param bool backing_store: If True, save the file to disk.
+        :param str store: ``'hdf5'`` (default) to keep the workup in an h5py
+            file, or ``'numpy'`` to keep the workup as numpy arrays plus
+            attribute dictionaries (see :mod:`freqdemod.hdf5.array_store`).
+            The ``'numpy'`` store avoids creating and copying an h5py dataset
+            at every workup step; it is written in HDF5 format only by
+            ``save()``, or by ``close()`` when ``backing_store=True``.
+            Reading a dataset of the ``'numpy'`` store, as in
+            ``s.f['y'][()]``, returns the stored array itself, not a copy,
+            so changing the result in place changes the workup.
         
         Add the following objects to the *Signal* object
         
@@ -96,10 +762,22 @@ class Signal(object):
             s = Signal()                                      # In-memory only
             s = Signal('not-saved.h5')                        # Still in-memory only
             s = Signal('save-to-disk.h5', backing_store=True) # Save to disk
+            s = Signal(store='numpy')                         # numpy arrays only
         """
         new_report = []
-                
-        if filename is not None:
+
+        if store == 'numpy':
+
+            if filename is None:
+                filename = timestamp_temp_filename('.h5')
+            self.f = ArrayFile(filename, mode=mode, backing_store=backing_store)
+
+        elif store != 'hdf5':
+
+            raise ValueError("Unrecognized store '{0}';"
+                             " use 'hdf5' or 'numpy'".format(store))
+
+        elif filename is not None:
             try:
                 self.f = h5py.File(filename, mode=mode, driver=driver, backing_store=backing_store)
             except IOError as e:
@@ -131,7 +809,10 @@ class Signal(object):
             ])
         
         update_attrs(self.f.attrs,attrs)
-        new_report.append("HDF5 file {0} created in core memory".format(filename))  
+        if store == 'numpy':
+            new_report.append("Array store {0} created in core memory".format(filename))
+        else:
+            new_report.append("HDF5 file {0} created in core memory".format(filename))  
             
         self.report = []
         self.report.append(" ".join(new_report))
@@ -154,10 +835,12 @@ class Signal(object):
         :param str report: a string summarizing in words what has
             been done to the signal 
         
+        The signal is copied, so changing ``s`` afterwards does not change
+        the *Signal*.
         """
-        s = np.atleast_1d(s)
+        s = np.array(s, ndmin=1)
 
-        self.f['x'] = dt * np.arange(s.size)
+        self.f['x'] = dt * np.arange(s.shape[-1])
         attrs = OrderedDict([
             ('name','t'),
             ('unit','s'),
@@ -311,6 +994,85 @@ class Signal(object):
         self.f = h5py.File(filename, 'r+')
         self.report = self.f.attrs['report'].split("\n")
 
+    def _stage_outputs(self, name):
+        """The datasets and groups in the file created by the workup stage
+        ``name``."""
+
+        return [path for path in _WORKUP_GRAPH[name][0]
+                if self.f.__contains__(path) == True
+                and self.f[path].attrs.get('stage') == name]
+
+    def _run_stage(self, name, method, params):
+        """Run the workup stage ``name``, ``method(self, **params)``,
+        reusing or recomputing its output as described in
+        :func:`_workup_stage`."""
+
+        outputs, inputs = _WORKUP_GRAPH[name]
+        key = json.dumps(params, default=_json_default)
+
+        done = self._stage_outputs(name)
+        if len(done) > 0 and all(self.f[path].attrs['stage_params'] == key
+                                 for path in done):
+
+            new_report = []
+            new_report.append("Reuse {0},".format(", ".join(done)))
+            new_report.append("computed by {0}()".format(name))
+            new_report.append("with the same parameters.")
+            self.report.append(" ".join(new_report))
+            return
+
+        # Find the stages downstream of this one that have been run, and
+        # their parameters, before deleting their output along with the
+        # output of this stage
+
+        affected = set([name])
+        downstream = []
+        for other, (_, other_inputs) in _WORKUP_GRAPH.items():
+            if len(affected.intersection(other_inputs)) > 0:
+                affected.add(other)
+                paths = self._stage_outputs(other)
+                if len(paths) > 0:
+                    downstream.append((other, json.loads(
+                        self.f[paths[0]].attrs['stage_params'],
+                        object_pairs_hook=OrderedDict)))
+
+        for other, _ in downstream:
+            for path in self._stage_outputs(other):
+                del self.f[path]
+        for path in outputs:
+            if self.f.__contains__(path) == True:
+                del self.f[path]
+
+        # Several stages write the same datasets; list each path once
+
+        read = list(OrderedDict.fromkeys(
+            path for other in inputs for path in _WORKUP_GRAPH[other][0]
+            if self.f.__contains__(path) == True))
+
+        result = method(self, **params)
+
+        for path in outputs:
+            if self.f.__contains__(path) == True:
+                attrs = self.f[path].attrs
+                attrs['stage'] = name
+                attrs['stage_params'] = key
+                attrs['stage_inputs'] = json.dumps(read)
+
+        # Bring the downstream stages up to date
+
+        if len(downstream) > 0:
+            new_report = []
+            new_report.append("Recompute")
+            new_report.append(", ".join(["{0}()".format(other)
+                                         for other, _ in downstream]))
+            new_report.append("with the new output of {0}().".format(name))
+            self.report.append(" ".join(new_report))
+
+        for other, other_params in downstream:
+            getattr(self, other)(**other_params)
+
+        return result
+
     def plot(self, ordinate, LaTeX=False, component='abs'):
         
         """ 
@@ -331,7 +1093,21 @@ class Signal(object):
         # Get the x and y axis. 
 
         y = self.f[ordinate]
-        x = self.f[y.attrs['abscissa']]
+        y_attrs = y.attrs
+        x = self.f[y_attrs['abscissa']]
+
+        # Masks are stored as index ranges; plot them as boolean arrays
+
+        if y_attrs.get('name') == 'mask':
+            y = self.mask_array(ordinate)
+
+        self._plot(x, y, y_attrs, LaTeX, component)
+
+    def _plot(self, x, y, y_attrs, LaTeX, component):
+        """
+        Plot the data ``y``, with the attributes ``y_attrs``, against the
+        abscissa dataset ``x``, and a histogram of ``y``; see ``plot()``.
+        """
 
         # Possibly use tex-formatted axes labels temporarily for this plot
         # and compute plot labels
@@ -342,15 +1118,15 @@ class Signal(object):
         
             plt.rcParams['text.usetex'] = True
             x_label_string = x.attrs['label_latex']
-            y_label_string = y.attrs['label_latex']
+            y_label_string = y_attrs['label_latex']
             
         elif LaTeX == False:
             
             plt.rcParams['text.usetex'] = False
             x_label_string = x.attrs['label']
-            y_label_string = y.attrs['label']
+            y_label_string = y_attrs['label']
 
-        title_string = "{0} vs. {1}".format(y.attrs['help'],x.attrs['help'])
+        title_string = "{0} vs. {1}".format(y_attrs['help'],x.attrs['help'])
 
         # Create the plot. If the y-axis is complex, then
         # plot the abs() of it. To use the abs() method, we need to force the 
@@ -399,7 +1175,7 @@ class Signal(object):
          
         # axes limits and labels
         
-        title_string = "{0} vs. {1}".format(y.attrs['help'], x.attrs['help'])
+        title_string = "{0} vs. {1}".format(y_attrs['help'], x.attrs['help'])
 
         axs[0].set_xlabel(x_label_string)
         axs[0].set_ylabel(y_label_string)
@@ -412,8 +1188,8 @@ class Signal(object):
         axs[1].hist(yhist, bins=256, orientation="horizontal")   
         axs[1].set_xlabel('counts')
 
-        msg1 = '{:0.3f} {:}'.format(yhist.mean(), y.attrs['unit'])
-        msg2 = '{:0.3f} {:}'.format(yhist.std(), y.attrs['unit'])
+        msg1 = '{:0.3f} {:}'.format(yhist.mean(), y_attrs['unit'])
+        msg2 = '{:0.3f} {:}'.format(yhist.std(), y_attrs['unit'])
 
         axs[1].text(0.90*counts.max(), 1.00*yhist.max(),
                     msg1 + '\n $\pm$ ' + msg2, 
@@ -433,66 +1209,101 @@ class Signal(object):
         plt.show()
         plt.rcParams['text.usetex'] = old_param  
         
-    def time_mask_binarate(self, mode):
+    def _mask_bounds(self, path):
+        """
+        The range ``(start, stop)`` of points kept by the mask at ``path``.
+        A boolean mask dataset, as written by earlier versions, is also
+        accepted.
+        """
+
+        m = self.f[path]
+        if 'start' in m.attrs:
+            return int(m.attrs['start']), int(m.attrs['stop'])
+
+        indices = np.flatnonzero(m[()])
+        return int(indices[0]), int(indices[-1]) + 1
+
+    def mask_array(self, path):
+        """
+        Return the mask at ``path``, for example
+        ``'workup/time/mask/binarate'``, as a ``np.array`` of boolean values
+        the length of the mask's abscissa.  The array can be plotted directly
+        -- ``True`` is converted to 1.0 and ``False`` is converted to 0 by the
+        ``matplotlib`` plotting function.
+        """
+
+        n_start, n_stop = self._mask_bounds(path)
+        n = self.f[self.f[path].attrs['abscissa']].shape[-1]
+        mask = np.zeros(n, dtype=bool)
+        mask[n_start:n_stop] = True
+        return mask
+
+    @_workup_stage
+    def time_mask_binarate(self, mode, length="power of two", smooth=5):
  
         """
-        Create a masking array of ``True``/``False`` values that can be used to
-        mask an array so that an array is a power of two in length, as required
-        to perform a Fast Fourier Transform.  
+        Create a mask that selects a range of the signal so that it is a
+        power of two in length, as required to perform a Fast Fourier
+        Transform.  
          
         :param str mode: "start", "middle", or "end" 
+        :param str length: "power of two" (default), "trim", or "pad"
+        :param int smooth: the largest prime factor allowed in the "trim"
+            or "pad" length (defaults to 5)
         
         With "start", the beginning of the array will be left intact and the 
         end truncated; with "middle", the array will be shortened
         symmetically from both ends; and with "end" the end of the array
         will be left intact while the beginning of the array will be chopped away.
-        
-        Create the mask in the following ``np.array``:
-        
-        :param bool self.f['workup/time/mask/binarate']: the mask; a ``np.array`` of boolean values
-        
-        This boolean array of ``True`` and ``False`` values can be plotted
-        directly -- ``True`` is converted to 1.0 and ``False`` is converted to
-        0 by the ``matplotlib`` plotting function.
+
+        Truncating to a power of two throws away up to half the data.  With
+        ``length="trim"``, the array is instead truncated to the largest
+        length whose prime factors are all ``smooth`` or less (a 5-smooth
+        length, by default).  Such lengths are nearly as fast to Fourier
+        transform as a power of two and are never more than a few percent
+        shorter than the signal.  With ``length="pad"``, no data is thrown
+        away: the mask keeps the entire signal, and ``fft()`` appends zeros
+        to bring it up to the next ``smooth``-smooth length.  The number of
+        zeros is stored in the ``n_pad`` attribute of the mask, the padded
+        time axis is stored in ``workup/time/x_binarated``, and ``mode`` is
+        ignored.
+        
+        The mask is always a contiguous range, so it is stored as the
+        empty group
+        
+        :param self.f['workup/time/mask/binarate']: the mask; the range kept
+            is ``start:stop`` in the group's attributes
+        
+        rather than as a full-length array of boolean values.  Use
+        ``mask_array()`` to create the boolean array, for plotting, and
+        ``plot()`` to plot it.
         """       
         
-        n = self.f['y'].size     # number of points, n, in the signal
-        indices = np.arange(n)   # np.array of indices
+        n = self.f['y'].shape[-1]  # number of points, n, in the signal
 
-        # nearest power of 2 to n
-        n2 = int(math.pow(2,int(math.floor(math.log(n, 2)))))
-        
+        n_start, n_stop, n_pad = _binarate_bounds(n, mode, length, smooth)
+        n2 = n_stop - n_start + n_pad
         
-        if mode == "middle":
-
-            n_start = int(math.floor((n - n2)/2))
-            n_stop = int(n_start + n2)
-            
-        elif mode == "start":
-            
-            n_start = 0
-            n_stop = n2    
-
-        elif mode == "end":
-
-            n_start = n-n2
-            n_stop = n            
-                                    
-        mask = (indices >= n_start) & (indices < n_stop)
-        
-        dset = self.f.create_dataset('workup/time/mask/binarate',data=mask)            
+        dset = self.f.create_group('workup/time/mask/binarate')            
         attrs = OrderedDict([
             ('name','mask'),
             ('unit','unitless'),
             ('label','masking function'),
             ('label_latex','masking function'),
             ('help','mask to make data a power of two in length'),
-            ('abscissa','x')
+            ('abscissa','x'),
+            ('start',n_start),
+            ('stop',n_stop),
+            ('n_pad',n_pad)
             ])
         update_attrs(dset.attrs,attrs)      
                            
-        x = self.f['x']
-        x_binarated = x[mask] 
+        x_binarated = self.f['x'][n_start:n_stop]
+
+        if n_pad > 0:
+            dt = self.f['x'].attrs['step']
+            x_binarated = np.concatenate([x_binarated,
+                x_binarated[-1] + dt*np.arange(1, n_pad+1)])
             
         dset = self.f.create_dataset('workup/time/x_binarated',data=x_binarated)            
         attrs = OrderedDict([
@@ -507,14 +1318,24 @@ class Signal(object):
         update_attrs(dset.attrs,attrs)                
                                     
         new_report = []
-        new_report.append("Make an array, workup/time/mask/binarate, to be used")
-        new_report.append("to truncate the signal to be {0}".format(n2))
-        new_report.append("points long (a power of two). The truncated array")
-        new_report.append("will start at point {0}".format(n_start))
-        new_report.append("and stop before point {0}.".format(n_stop))
+        new_report.append("Make a mask, workup/time/mask/binarate, to be used")
+        if length == "pad":
+            new_report.append("to zero pad the signal to be {0}".format(n2))
+            new_report.append("points long ({0}-smooth),".format(smooth))
+            new_report.append("by adding {0} zeros at the end.".format(n_pad))
+        else:
+            new_report.append("to truncate the signal to be {0}".format(n2))
+            if length == "trim":
+                new_report.append("points long ({0}-smooth).".format(smooth))
+            else:
+                new_report.append("points long (a power of two).")
+            new_report.append("The truncated array")
+            new_report.append("will start at point {0}".format(n_start))
+            new_report.append("and stop before point {0}.".format(n_stop))
         
         self.report.append(" ".join(new_report))  
 
+    @_workup_stage
     def time_window_cyclicize(self, tw):
         
         """
@@ -548,26 +1369,22 @@ class Signal(object):
         
         if self.f.__contains__('workup/time/mask/binarate') == True:
             
-            # You have to cast the HSF5 dataset to a np.array
-            # so you can use the array of True/False values as 
-            # array indices
-            
-            m = np.array(self.f['workup/time/mask/binarate'])        
-            n = np.count_nonzero(m)
+            n_start, n_stop = self._mask_bounds('workup/time/mask/binarate')
+            n_pad = self.f['workup/time/mask/binarate'].attrs.get('n_pad', 0)
+            n = n_stop - n_start + n_pad
             abscissa = 'workup/time/x_binarated'  
             
         else:
             
-            n = self.f['y'].size
+            n = self.f['y'].shape[-1]
+            n_pad = 0
             abscissa = 'x'
             
         dt = self.f['x'].attrs['step']          # time per point
         ww = int(math.ceil((1.0*tw)/(1.0*dt)))  # window width (points)
         tw_actual = ww*dt                       # actual window width (seconds)
 
-        w = np.concatenate([np.blackman(2*ww)[0:ww],
-                            np.ones(n-2*ww),
-                            np.blackman(2*ww)[-ww:]])
+        w = _cyclicize_window(n, ww, n_pad)
 
         dset = self.f.create_dataset('workup/time/window/cyclicize',data=w)            
         attrs = OrderedDict([
@@ -591,11 +1408,22 @@ class Signal(object):
         
         self.report.append(" ".join(new_report))        
  
-    def fft(self, psd=False):
+    @_workup_stage
+    def fft(self, psd=False, real=False):
 
         """
         Take a Fast Fourier transform of the windowed signal. If the signal
         has units of nm, then the FT will have units of nm/Hz.
+
+        :param bool psd: If True, store the single-sided power spectrum
+            instead of the Fourier transform.
+        :param bool real: If False (default), store the full spectrum with
+            fftshifted frequencies.  If True, use a real-input FFT and store
+            only the non-negative frequencies, which takes about half the
+            time and memory; ``ifft()`` then builds the analytic signal
+            directly from the half spectrum.  The layout is recorded in the
+            ``layout`` attribute of ``workup/freq/FT``, ``'fftshift'`` or
+            ``'rfft'``.
         
         """
          
@@ -603,34 +1431,51 @@ class Signal(object):
          
         start = time.time()         
         
-        # If a mask is defined then select out a subset of the signal to be FT'ed
-        # The signal array, s, should be a factor of two in length at this point        
-           
-        s = np.array(self.f['y'])   
+        # If a mask is defined then read only the masked range of the signal
+        # to be FT'ed.  The signal array, s, should be a factor of two in
+        # length at this point.  The slice is a view of an in-memory signal,
+        # and a hyperslab read of an HDF5 one.
 
         if self.f.__contains__('workup/time/mask/binarate') == True:
             
-            m = np.array(self.f['workup/time/mask/binarate'])
-            s = s[m]
+            n_start, n_stop = self._mask_bounds('workup/time/mask/binarate')
+            s = self.f['y'][..., n_start:n_stop]
+
+            n_pad = self.f['workup/time/mask/binarate'].attrs.get('n_pad', 0)
+            if n_pad > 0:
+                s = np.concatenate([s, np.zeros(s.shape[:-1] + (n_pad,),
+                                                dtype=s.dtype)], axis=-1)
+
+        else:
+
+            s = self.f['y'][()]
 
         # If the cyclicizing window is defined then apply it to the signal                
                                                       
         if self.f.__contains__('workup/time/window/cyclicize') == True:
             
-            w = np.array(self.f['workup/time/window/cyclicize'])
+            w = self.f['workup/time/window/cyclicize'][()]
             s = w*s
           
         # Take the Fourier transform      
                     
         dt = self.f['x'].attrs['step']
-          
-        freq = np.fft.fftshift(np.fft.fftfreq(s.size,dt))   
+        n = s.shape[-1]
+
+        if real == True:
+            layout = 'rfft'
+            freq = np.fft.rfftfreq(n,dt)
+            sFT = fftbackend.rfft(s)
+        else:
+            layout = 'fftshift'
+            freq = np.fft.fftshift(np.fft.fftfreq(n,dt))   
+            sFT = np.fft.fftshift(fftbackend.fft(s), axes=-1)
 
         name_orig = self.f['y'].attrs['name']
         unit_orig = self.f['y'].attrs['unit']
 
         if psd == False:                
-            sFT = dt * np.fft.fftshift(np.fft.fft(s))
+            sFT = dt * sFT
 
             sFTunit = '{0}/Hz'.format(unit_orig)
             sFTlabel = 'FT({0}) [{1}]'.format(name_orig,sFTunit)
@@ -638,17 +1483,21 @@ class Signal(object):
             sFThelp = 'Fourier transform of {0}(t)'.format(name_orig)
 
         elif psd == True:
-            sFT = (dt / len(s)) * np.power(abs(np.fft.fftshift(np.fft.fft(s))), 2.0)
+            sFT = (dt / n) * np.power(abs(sFT), 2.0)
 
             sFTunit = '{0}^2/Hz'.format(unit_orig)
             sFTlabel = 'PSD({0}) [{1}^2/Hz]'.format(name_orig,unit_orig)
             sFTlabel_latex = '$P_{{{0}}} \: [\mathrm{{{1}}}^2/\mathrm{{Hz}}]$'.format(name_orig,unit_orig)
             sFThelp = 'Power spectrum of {0}(t)'.format(name_orig)
 
-            # single-sided power s
-            mask = freq >= 0
+            # single-sided power s; in the real layout, drop the +fs/2 bin
+            # of an even-length signal, which fftfreq lists as -fs/2
+            if real == True:
+                mask = np.arange(freq.size) < (n + 1)//2
+            else:
+                mask = freq >= 0
             freq = freq[mask]
-            sFT = sFT[mask]
+            sFT = sFT[..., mask]
 
         # Save the data
         
@@ -672,7 +1521,9 @@ class Signal(object):
             ('label_latex',sFTlabel_latex),
             ('help',sFThelp),
             ('abscissa','workup/freq/freq'),
-            ('n_avg',1)
+            ('n_avg',1),
+            ('layout',layout),
+            ('n_fft',n)
             ])
         update_attrs(dset.attrs,attrs)           
            
@@ -687,6 +1538,7 @@ class Signal(object):
         new_report.append("to compute the FFT.") 
         self.report.append(" ".join(new_report))
 
+    @_workup_stage
     def freq_filter_Hilbert_complex(self):
         
         """
@@ -710,8 +1562,10 @@ class Signal(object):
         
         """
         
-        freq = self.f['workup/freq/freq'][:]
-        filt = 0.0*(freq < 0) + 1.0*(freq == 0) + 2.0*(freq > 0)
+        freq = self.f['workup/freq/freq'][()]
+        FT_attrs = self.f['workup/freq/FT'].attrs
+        filt = _hilbert_filter(freq, FT_attrs.get('layout'),
+                               FT_attrs.get('n_fft'))
         
         dset = self.f.create_dataset('workup/freq/filter/Hc',data=filt)            
         attrs = OrderedDict([
@@ -728,6 +1582,7 @@ class Signal(object):
         new_report.append("Create the complex Hilbert transform filter.")
         self.report.append(" ".join(new_report))
         
+    @_workup_stage
     def freq_filter_bp(self, bw, order=50, style="brick wall"):
         
         """
@@ -784,35 +1639,16 @@ class Signal(object):
         
         # The center frequency fc is the peak in the abs of the FT spectrum
         
-        freq = np.array(self.f['workup/freq/freq'][:])
-        Hc = np.array(self.f['workup/freq/filter/Hc'][:])
-        FTrh = Hc*abs(np.array(self.f['workup/freq/FT'][:]))
-        fc = freq[np.argmax(FTrh)]
+        freq = self.f['workup/freq/freq'][()]
+        Hc = self.f['workup/freq/filter/Hc'][()]
+        FTabs = abs(self.f['workup/freq/FT'][()])
+        FTrh = Hc*FTabs
+        i_c = np.argmax(FTrh, axis=-1)
+        fc = freq[i_c]
         
         # Compute the filter
                         
-        freq_scaled = (freq - fc)/bw
-
-        if style == "brick wall":
-
-            bp = 1.0/(1.0+np.power(abs(freq_scaled),order))
-
-        elif style == "cosine":
-
-            # here we use a trick
-
-            bp = np.zeros(freq.shape)
-            sub_index = (freq >= -1.0*bw + fc) & (freq <= bw + fc)
-            sub_indices = np.arange(freq.size)[sub_index]
-            bp[sub_indices] = np.sin(np.linspace(0,np.pi,sub_indices.size))
-
-        elif style == "gaussian":
-
-            bp = np.exp(-1 * np.power(freq_scaled, 2.0))
-
-        else:
-
-            print("**ERROR**: Unrecognized filter function")
+        bp = _bandpass_filter(freq, i_c, bw, order, style)
 
         dset = self.f.create_dataset('workup/freq/filter/bp',data=bp)            
         attrs = OrderedDict([
@@ -821,7 +1657,8 @@ class Signal(object):
             ('label','bp(f)'),
             ('label_latex','$\mathrm{bp}(f)$'),
             ('help','bandpass filter'),
-            ('abscissa','workup/freq/freq')
+            ('abscissa','workup/freq/freq'),
+            ('fc',fc)
             ])
         update_attrs(dset.attrs,attrs)          
         
@@ -829,19 +1666,30 @@ class Signal(object):
         #  using the method of moments -- this only gives the right answer
         #  because we have applied the nice bandpass filter first
         
-        FT_filt = Hc*bp*abs(self.f['workup/freq/FT'][:])
-        fc_improved = (freq*FT_filt).sum()/FT_filt.sum()
+        FT_filt = Hc*bp*FTabs
+        fc_improved = (freq*FT_filt).sum(axis=-1)/FT_filt.sum(axis=-1)
         
         new_report = []
-        new_report.append("Create a bandpass filter with center frequency")
-        new_report.append("= {0:.6f} kHz,".format(fc))
+        if np.ndim(fc) == 0:
+            new_report.append("Create a bandpass filter with center frequency")
+            new_report.append("= {0:.6f} kHz,".format(fc))
+        else:
+            new_report.append("Create {0} bandpass filters with".format(fc.size))
+            new_report.append("center frequencies from {0:.6f}".format(fc.min()))
+            new_report.append("to {0:.6f} kHz,".format(fc.max()))
         new_report.append("bandwidth = {0:.3f} kHz,".format(bw))
         new_report.append("and order = {0}.".format(order))
-        new_report.append("Best estimate of the resonance")
-        new_report.append("frequency = {0:.6f} kHz.".format(fc_improved))
+        if np.ndim(fc) == 0:
+            new_report.append("Best estimate of the resonance")
+            new_report.append("frequency = {0:.6f} kHz.".format(fc_improved))
+        else:
+            new_report.append("Best estimates of the resonance")
+            new_report.append("frequency range from {0:.6f}".format(fc_improved.min()))
+            new_report.append("to {0:.6f} kHz.".format(fc_improved.max()))
                 
         self.report.append(" ".join(new_report))
         
+    @_workup_stage
     def time_mask_rippleless(self, td): 
         
         """
@@ -871,11 +1719,18 @@ class Signal(object):
         Otherwise, the relevant time axis is::
         
             self.f['x'] 
+
+        If the signal was zero padded by ``time_mask_binarate(mode,
+        length="pad")``, then the padding is masked off along with the
+        trailing ripple.
         
         We will call this trimming mask::
         
             self.f['workup/time/mask/rippleless']
         
+        Like the binarate mask, it is a contiguous range, stored as the
+        ``start`` and ``stop`` attributes of an empty group.
+        
         We will apply this mask to either ``self.f['/workup/time/x_binarated']``
         or ``self.f['x']`` to yield a new time array for plotting phase (and 
         amplitude) data::
@@ -900,26 +1755,30 @@ class Signal(object):
         td_actual = ww*dt                       # actual dead time (seconds)        
            
         if self.f.__contains__('workup/time/mask/binarate') == True:
-            x = np.array(self.f['/workup/time/x_binarated'][:])
             abscissa = '/workup/time/x_binarated'
+            n_pad = self.f['workup/time/mask/binarate'].attrs.get('n_pad', 0)
 
         else:
-            x = np.array(self.f['x'][:])
             abscissa = 'x'
+            n_pad = 0
+            
+        # Zero padding carries no signal, so the trailing ripple is
+        # measured back from the end of the data instead
             
-        n = x.size
-        indices = np.arange(n)
-        mask = (indices >= ww) & (indices < n - ww)
-        x_rippleless = x[mask]
+        n = self.f[abscissa].shape[-1]
+        n_start, n_stop = ww, n - n_pad - ww
+        x_rippleless = self.f[abscissa][n_start:n_stop]
         
-        dset = self.f.create_dataset('workup/time/mask/rippleless',data=mask)            
+        dset = self.f.create_group('workup/time/mask/rippleless')            
         attrs = OrderedDict([
             ('name','mask'),
             ('unit','unitless'),
             ('label','masking function'),
             ('label_latex','masking function'),
             ('help','mask to remove leading and trailing ripple'),
-            ('abscissa',abscissa)
+            ('abscissa',abscissa),
+            ('start',n_start),
+            ('stop',n_stop)
             ])
         update_attrs(dset.attrs,attrs)
         
@@ -936,13 +1795,14 @@ class Signal(object):
         update_attrs(dset.attrs,attrs)              
                         
         new_report = []
-        new_report.append("Make an array, workup/time/mask/rippleless, to be")
+        new_report.append("Make a mask, workup/time/mask/rippleless, to be")
         new_report.append("used to remove leading and trailing ripple.  The")
         new_report.append("dead time is {0:.3f} us.".format(1E6*td_actual))
         
         self.report.append(" ".join(new_report))          
         
-    def ifft(self):
+    @_workup_stage
+    def ifft(self, outputs=('z', 'p', 'a'), dtype=np.float64, chunk=None):
         
         """
         If they are defined, 
@@ -955,26 +1815,60 @@ class Signal(object):
         
         * compute the inverse Fourier transform,
         
-        * if a trimming window is defined then trim the result
+        * if a trimming window is defined then trim the result; otherwise
+          drop the zeros padded on by ``time_mask_binarate(length="pad")``
          
+        and store the complex signal ``workup/time/z``, the phase
+        ``workup/time/p``, and the amplitude ``workup/time/a``, with
+
+        :param outputs: which of ``'z'``, ``'p'``, and ``'a'`` to store
+            (defaults to all three).  Leaving out ``'z'`` saves 16 bytes
+            per point.
+        :param dtype: the type of the stored phase and amplitude; defaults
+            to ``np.float64``.  With ``np.float32`` the phase keeps about
+            seven significant digits, so its absolute resolution in cycles
+            degrades on long records.
+        :param int chunk: compute the phase and amplitude this many points
+            at a time, to cap the memory used by temporary arrays; the
+            phase is unwrapped continuously across chunks.  If None
+            (default), all at once.
         
         """
+
+        if isinstance(outputs, six.string_types):
+            outputs = [outputs]
+        outputs = list(outputs)
+        for name in outputs:
+            if name not in ('z', 'p', 'a'):
+                raise ValueError("Unrecognized output '{0}'; use 'z', 'p',"
+                                 " or 'a'".format(name))
         
         # Divide the FT-ed data by the timestep to recover the 
-        # digital Fourier transformed data.  Carry out the 
-        # transforms.
+        # digital Fourier transformed data.  Apply the filters in place.
+        # Carry out the transforms.
         
-        s = self.f['workup/freq/FT'][:]/self.f['x'].attrs['step']
+        s = self.f['workup/freq/FT'][()]/self.f['x'].attrs['step']
 
         if self.f.__contains__('workup/freq/filter/Hc') == True:
-            s = s*self.f['workup/freq/filter/Hc']            
+            s *= self.f['workup/freq/filter/Hc'][()]
                                     
         if self.f.__contains__('workup/freq/filter/bp') == True:
-            s = s*self.f['workup/freq/filter/bp']
+            s *= self.f['workup/freq/filter/bp'][()]
             
-        # Compute the IFT    
+        # Compute the IFT.  With the real layout and no Hilbert filter, the
+        # result is the (real) filtered signal.
             
-        sIFT = np.fft.ifft(np.fft.ifftshift(s))
+        FT_attrs = self.f['workup/freq/FT'].attrs
+
+        if FT_attrs.get('layout') == 'rfft':
+            if self.f.__contains__('workup/freq/filter/Hc') == True:
+                sIFT = _analytic_ifft(s, FT_attrs['n_fft'])
+            else:
+                sIFT = fftbackend.irfft(s, FT_attrs['n_fft']).astype(complex)
+        else:
+            s = np.fft.ifftshift(s, axes=-1)
+            sIFT = fftbackend.ifft(s)
+        del s
         
         # Trim if a rippleless masking array is defined
         # Carefullly define what we should plot the complex
@@ -982,69 +1876,335 @@ class Signal(object):
         
         if self.f.__contains__('workup/time/mask/rippleless') == True:
             
-            mask = np.array(self.f['workup/time/mask/rippleless'])
-            sIFT = sIFT[mask]
+            n_start, n_stop = self._mask_bounds('workup/time/mask/rippleless')
+            sIFT = sIFT[..., n_start:n_stop]
             abscissa = 'workup/time/x_rippleless'
             
         else:
             
             if self.f.__contains__('workup/time/mask/binarate') == True:
                 abscissa = '/workup/time/x_binarated'
+
+                # Drop the zeros padded on by length="pad"; the rest of
+                # the signal is the whole signal, on the original time axis
+
+                n_pad = self.f['workup/time/mask/binarate'].attrs.get('n_pad', 0)
+                if n_pad > 0:
+                    sIFT = sIFT[..., 0:sIFT.shape[-1] - n_pad]
+                    abscissa = 'x'
             else:
                 abscissa = 'x'
         
-        dset = self.f.create_dataset('workup/time/z',data=sIFT)
         unit_y = self.f['y'].attrs['unit']
-        attrs = OrderedDict([
-            ('name','z'),
-            ('unit',unit_y),
-            ('label','z [{0}]'.format(unit_y)),
-            ('label_latex','$z \: [\mathrm{{{0}}}]$'.format(unit_y)),
-            ('help','complex cantilever displacement'),
-            ('abscissa',abscissa)
-            ])
-        update_attrs(dset.attrs,attrs)         
 
-        # Compute and save the phase and amplitude
-        
-        p = np.unwrap(np.angle(sIFT))/(2*np.pi)
-        dset = self.f.create_dataset('workup/time/p',data=p)
-        attrs = OrderedDict([
-            ('name','phase'),
-            ('unit','cyc'),
-            ('label','phase [cyc]'),
-            ('label_latex','$\phi \: [\mathrm{cyc}]$'),
-            ('help','cantilever phase'),
-            ('abscissa',abscissa)
-            ])
-        update_attrs(dset.attrs,attrs)
-                  
-        a = abs(sIFT)
-        dset = self.f.create_dataset('workup/time/a',data=a)
-        attrs = OrderedDict([
-            ('name','amplitude'),
-            ('unit',unit_y),
-            ('label','a [{0}]'.format(unit_y)),
-            ('label_latex','$a \: [\mathrm{{{0}}}]$'.format(unit_y)),
-            ('help','cantilever amplitude'),
-            ('abscissa',abscissa)
-            ])
-        update_attrs(dset.attrs,attrs)
+        if 'z' in outputs:
+            dset = self.f.create_dataset('workup/time/z',data=sIFT)
+            attrs = OrderedDict([
+                ('name','z'),
+                ('unit',unit_y),
+                ('label','z [{0}]'.format(unit_y)),
+                ('label_latex','$z \: [\mathrm{{{0}}}]$'.format(unit_y)),
+                ('help','complex cantilever displacement'),
+                ('abscissa',abscissa)
+                ])
+            update_attrs(dset.attrs,attrs)         
+
+        # Compute and save the phase and amplitude, chunk by chunk, 
+        # unwrapping each chunk's phase from the last phase of the 
+        # chunk before
+        
+        n = sIFT.shape[-1]
+        if chunk is None:
+            chunk = max(n, 1)
+
+        if 'p' in outputs:
+            p_dset = self.f.create_dataset('workup/time/p',
+                                           shape=sIFT.shape, dtype=dtype)
+        if 'a' in outputs:
+            a_dset = self.f.create_dataset('workup/time/a',
+                                           shape=sIFT.shape, dtype=dtype)
+
+        p_last = None
+        for k in range(0, n, chunk):
+            z_k = sIFT[..., k:k+chunk]
+            if 'p' in outputs:
+                if p_last is None:
+                    p_k = np.unwrap(np.angle(z_k))
+                else:
+                    p_k = np.unwrap(np.concatenate([p_last, np.angle(z_k)],
+                                                   axis=-1))[..., 1:]
+                p_last = p_k[..., -1:]
+                p_dset[..., k:k+chunk] = p_k/(2*np.pi)
+            if 'a' in outputs:
+                a_dset[..., k:k+chunk] = abs(z_k)
+
+        if 'p' in outputs:
+            attrs = OrderedDict([
+                ('name','phase'),
+                ('unit','cyc'),
+                ('label','phase [cyc]'),
+                ('label_latex','$\phi \: [\mathrm{cyc}]$'),
+                ('help','cantilever phase'),
+                ('abscissa',abscissa)
+                ])
+            update_attrs(p_dset.attrs,attrs)
+
+        if 'a' in outputs:
+            attrs = OrderedDict([
+                ('name','amplitude'),
+                ('unit',unit_y),
+                ('label','a [{0}]'.format(unit_y)),
+                ('label_latex','$a \: [\mathrm{{{0}}}]$'.format(unit_y)),
+                ('help','cantilever amplitude'),
+                ('abscissa',abscissa)
+                ])
+            update_attrs(a_dset.attrs,attrs)
           
         new_report = []
         new_report.append("Apply an inverse Fourier transform.")
+        if sorted(outputs) != ['a', 'p', 'z']:
+            new_report.append("Store only {0}.".format(", ".join(outputs)))
         self.report.append(" ".join(new_report))
-        
-    def fit_phase(self, dt_chunk_target):
+
+    @_workup_stage
+    def lockin(self, bw, fc=None, decimate=None, n_taps=None):
+
+        """
+        Demodulate the signal with a digital lock-in amplifier, an
+        alternative to the ``fft()``, ``freq_filter_bp()``, and ``ifft()``
+        steps, with
+
+        :param float bw: the bandwidth [kHz]; the low-pass filter passes
+            frequencies within about ``bw`` of ``fc`` and stops those more
+            than ``2*bw`` away
+        :param float fc: the local oscillator frequency [kHz]; if None, use
+            the center frequency found by ``freq_filter_bp()``, if it has
+            been run, or else the peak of the spectrum of the first
+            :math:`2^{16}` points
+        :param int decimate: keep every ``decimate``-th point; if None,
+            decimate to a sample rate of about ``4*bw``
+        :param int n_taps: the target low-pass filter length [points];
+            defaults to :math:`5.5/(\\mathrm{bw} \\: \\Delta t)`, for a
+            transition band ``bw`` wide.  The length is rounded up to
+            ``2*decimate*K + 1``.
+
+        The signal is multiplied by the complex local oscillator
+        :math:`\\exp(-2 \\pi \\imath f_c t)`, low-pass filtered with a
+        Blackman-windowed FIR filter, and decimated, in one polyphase pass
+        over blocks of the signal.  The cost is proportional to the number
+        of points, the memory used is a few blocks, and the signal may be
+        any length -- no binarate mask is needed.  The first and last ``K``
+        output points, whose filter spans run past the ends of the signal,
+        are dropped, so no rippleless mask is needed either.
+
+        Store the complex signal ``workup/time/z``, the phase
+        ``workup/time/p``, and the amplitude ``workup/time/a``, as
+        ``ifft()`` does, against the decimated time axis
+        ``workup/time/x_lockin``.  The phase of the local oscillator is
+        added back to the phase, so ``fit_phase()`` gives the frequency of
+        the signal, not its offset from ``fc``.  The decimation factor is
+        stored in the ``decimate`` attribute of each.
+        """
+
+        start = time.time()
+
+        y = self.f['y']
+        n = y.shape[-1]
+        dt = self.f['x'].attrs['step']
+
+        if fc is None:
+            if self.f.__contains__('workup/freq/filter/bp') == True:
+                fc = self.f['workup/freq/filter/bp'].attrs['fc']
+            else:
+                m = min(n, 2**16)
+                spectrum = abs(fftbackend.rfft(np.blackman(m)*y[..., 0:m]))
+                freq = np.fft.rfftfreq(m, dt)/1E3
+                fc = freq[1 + np.argmax(spectrum[..., 1:], axis=-1)]
+        fc = np.asarray(fc, dtype=float)
+
+        if decimate is None:
+            decimate = max(1, int(1.0/(4*1E3*bw*dt)))
+        if n_taps is None:
+            n_taps = int(math.ceil(5.5/(1E3*bw*dt)))
+        D = int(decimate)
+        K = max(1, int(math.ceil((n_taps - 1)/(2.0*D))))
+        h = firwin(2*D*K + 1, 1.5E3*bw, window='blackman', fs=1/dt)
+
+        z, j_first = _lockin(y[()], dt, fc, h, D)
+        n_out = z.shape[-1]
+        if n_out < 2:
+            raise ValueError("The signal is too short for a {0}-point"
+                             " low-pass filter".format(h.size))
+
+        j = np.arange(j_first, j_first + n_out)
+        x = self.f['x'][j_first*D:(j_first + n_out - 1)*D + 1:D]
+        p = (np.unwrap(np.angle(z))/(2*np.pi)
+             + (1E3*fc*dt*D)[..., np.newaxis]*j)
+        a = abs(z)
+
+        self._create_decimated_datasets('workup/time/x_lockin', x, z, p, a,
+                                        D, fc)
+
+        stop = time.time()
+        t_calc = stop - start
+
+        new_report = []
+        if fc.ndim == 0:
+            new_report.append("Demodulate with a lock-in at")
+            new_report.append("fc = {0:.6f} kHz,".format(fc))
+        else:
+            new_report.append("Demodulate {0} signals with".format(fc.size))
+            new_report.append("lock-ins at fc = {0:.6f}".format(fc.min()))
+            new_report.append("to {0:.6f} kHz,".format(fc.max()))
+        new_report.append("a {0}-point low-pass filter".format(h.size))
+        new_report.append("of bandwidth {0:.3f} kHz,".format(bw))
+        new_report.append("and decimation by {0},".format(D))
+        new_report.append("giving {0} points.".format(n_out))
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to demodulate the signal.")
+        self.report.append(" ".join(new_report))
+
+    @_workup_stage
+    def pll(self, bw, fc=None, order=2, decimate=None):
+
+        """
+        Track the signal with a software phase-locked loop, for a carrier
+        that drifts farther than a fixed bandpass filter is wide, with
+
+        :param float bw: the loop bandwidth [kHz]
+        :param float fc: the loop oscillator's starting frequency [kHz]; if
+            None, use the center frequency found by ``freq_filter_bp()``, if
+            it has been run, or else the peak of the spectrum of the first
+            :math:`2^{14}` points
+        :param int order: the loop order, 1, 2 (default), or 3
+        :param int decimate: the number of points per loop update; see
+            :class:`freqdemod.stream.PLLTracker`
+
+        The loop is the :class:`freqdemod.stream.PLLTracker`, which can also
+        track a signal block by block as it arrives.  Store the complex
+        signal ``workup/time/z``, the phase ``workup/time/p``, and the
+        amplitude ``workup/time/a`` measured at each loop update, as
+        ``lockin()`` does, against the update times
+        ``workup/time/x_pll``, and the loop oscillator's frequency after
+        each update in ``workup/fit/y`` against ``workup/fit/x``.  The
+        phase can also be fit in chunks by ``fit_phase()``, which replaces
+        ``workup/fit``.
+        """
+
+        # stream.py imports this module, so import the tracker here
+
+        from freqdemod.stream import PLLTracker
+
+        start = time.time()
+
+        if fc is None and self.f.__contains__('workup/freq/filter/bp') == True:
+            fc = self.f['workup/freq/filter/bp'].attrs['fc']
+
+        dt = self.f['x'].attrs['step']
+        P = PLLTracker(dt, bw, fc=fc, order=order, decimate=decimate,
+                       t0=self.f['x'][0])
+        out = P.process(self.f['y'][()])
+        if out is None:
+            out = P.flush()
+        if out is None or out.x.size < 2:
+            raise ValueError("The signal is too short for loop updates of"
+                             " {0} points".format(P.decimate))
+        fc = np.asarray(P.fc, dtype=float)
+
+        self._create_decimated_datasets('workup/time/x_pll', out.x, out.z,
+                                        out.p, out.a, P.decimate, fc)
+        self._create_fit_datasets(out.x, out.f,
+            [('decimate', P.decimate), ('order', order), ('bw', bw)])
+        self.f['workup/fit/x'].attrs['help'] = 'time at each loop update'
+        self.f['workup/fit/y'].attrs['help'] = 'loop oscillator frequency'
+
+        stop = time.time()
+        t_calc = stop - start
+
+        new_report = []
+        new_report.append("Track the signal with an order {0}".format(order))
+        new_report.append("phase-locked loop of bandwidth")
+        new_report.append("{0:.3f} kHz, starting at".format(bw))
+        if fc.ndim == 0:
+            new_report.append("fc = {0:.6f} kHz,".format(fc))
+        else:
+            new_report.append("fc = {0:.6f} to {1:.6f} kHz,".format(
+                fc.min(), fc.max()))
+        new_report.append("with an update every {0} points".format(P.decimate))
+        new_report.append("({0} updates).".format(out.x.size))
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to track the signal.")
+        self.report.append(" ".join(new_report))
+
+    def _create_decimated_datasets(self, abscissa, x, z, p, a, decimate,
+                                   fc):
+        """Save the decimated time axis ``x`` to ``abscissa``, and the
+        complex signal, phase, and amplitude measured at those times to
+        ``workup/time/z``, ``p``, and ``a``, recording the decimation factor
+        and the reference frequency ``fc`` [kHz]."""
+
+        dset = self.f.create_dataset(abscissa,data=x)
+        attrs = OrderedDict([
+            ('name','t_decimated'),
+            ('unit','s'),
+            ('label','t [s]'),
+            ('label_latex','$t \\: [\\mathrm{s}]$'),
+            ('help','time'),
+            ('initial', x[0]),
+            ('step', x[1]-x[0])
+            ])
+        update_attrs(dset.attrs,attrs)
+
+        unit_y = self.f['y'].attrs['unit']
+
+        datasets = [
+            ('z', z, unit_y, 'z [{0}]'.format(unit_y),
+             '$z \\: [\\mathrm{{{0}}}]$'.format(unit_y),
+             'complex cantilever displacement'),
+            ('p', p, 'cyc', 'phase [cyc]', '$\\phi \\: [\\mathrm{cyc}]$',
+             'cantilever phase'),
+            ('a', a, unit_y, 'a [{0}]'.format(unit_y),
+             '$a \\: [\\mathrm{{{0}}}]$'.format(unit_y),
+             'cantilever amplitude')
+            ]
+
+        for name, data, unit, label, label_latex, help_string in datasets:
+            dset = self.f.create_dataset('workup/time/' + name, data=data)
+            attrs = OrderedDict([
+                ('name',{'z': 'z', 'p': 'phase', 'a': 'amplitude'}[name]),
+                ('unit',unit),
+                ('label',label),
+                ('label_latex',label_latex),
+                ('help',help_string),
+                ('abscissa',abscissa),
+                ('decimate',decimate),
+                ('fc',fc)
+                ])
+            update_attrs(dset.attrs,attrs)
+
+    def _phase_step(self):
+        """The time per point [s] of the phase ``workup/time/p``, which is
+        decimated by ``lockin()``."""
+
+        return (self.f['x'].attrs['step']
+                *self.f['workup/time/p'].attrs.get('decimate', 1))
+
+    @_workup_stage
+    def fit_phase(self, dt_chunk_target, dt_hop_target=None):
         
         """
         Fit the phase *vs* time data to a line.  The slope of the line is the
         (instantaneous) frequency. The phase data is broken into "chunks", with
         
         :param float dt_chunk_target: the target chunk duration [s]
+        :param float dt_hop_target: the target time between the starts of
+            successive chunks [s].  If None (default), the chunks do not
+            overlap.  Any shorter time gives overlapping chunks -- a sliding
+            window -- down to one chunk starting at every phase point.
         
         If the chosen duration is not an integer multiple of the digitization
-        time, then find the nearest chunk duration which is.
+        time, then find the nearest chunk duration which is.  Likewise for
+        the hop time, which is at least one point.
         
         Calculate the slope :math:`m` of the phase *vs* time line using
         the linear-least squares formula
@@ -1093,13 +2253,26 @@ class Signal(object):
         the time and phase arrays in each chuck so that the time array
         and phase array passed to the least-square formula each start at
         zero.
+
+        With overlapping chunks, :math:`S_y` and :math:`S_{xy}` for every
+        chunk are instead computed as differences of the running (prefix)
+        sums of :math:`\\phi_k` and :math:`k \\: \\phi_k`, so the time taken
+        is proportional to the number of phase points no matter how long the
+        chunks or how small the hop.  The prefix sums restart every chunk
+        length, so that they stay small however long the record is.  The number of points per chunk and per
+        hop are stored in the ``n_per_chunk`` and ``n_hop`` attributes of
+        ``workup/fit/y``.
         
         """                        
 
+        if dt_hop_target is not None:
+            self._fit_phase_sliding(dt_chunk_target, dt_hop_target)
+            return
+
         # work out the chunking details
 
-        dt = self.f['x'].attrs['step']                # time per phase point
-        n = np.array(self.f['workup/time/p'][:]).size # no. of phase points
+        dt = self._phase_step()                       # time per phase point
+        n = self.f['workup/time/p'].shape[-1]        # no. of phase points
         
         n_per_chunk = int(round(dt_chunk_target/dt)) # points per chunck
         dt_chunk = dt*n_per_chunk                    # actual time per chunk
@@ -1123,42 +2296,132 @@ class Signal(object):
         self.report.append(" ".join(new_report))
         start = time.time() 
         
-        # Reshape the phase data and 
-        #  zero the phase at start of each chunk
+        # Fit each chunk of phase data to a line
+
+        y = self.f['workup/time/p'][..., 0:n_total]
+        abscissa = self.f['workup/time/p'].attrs['abscissa']
+        x = self.f[abscissa][0:n_total]
+
+        x_sub_middle, slope = _fit_phase_chunks(x, y, dt, n_per_chunk)
+
+        stop = time.time()
+        t_calc = stop - start
+                                
+        # Save the time axis and the slope
+
+        self._create_fit_datasets(x_sub_middle, slope)
         
-        y = np.array(self.f['workup/time/p'][0:n_total])        
-        y_sub = y.reshape((n_tot_chunk,n_per_chunk))
-        y_sub_reset = y_sub - y_sub[:,:,np.newaxis][:,0,:]*np.ones(n_per_chunk)
+        # report the curve-fitting details
+        #  and prepare the report
+        
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to perform the curve fit and obtain the frequency.")
+                 
+        self.report.append(" ".join(new_report))      
+
+    def _fit_phase_sliding(self, dt_chunk_target, dt_hop_target):
+        """Fit overlapping chunks of phase data; see :meth:`fit_phase`."""
+
+        dt = self._phase_step()                       # time per phase point
+        n = self.f['workup/time/p'].shape[-1]        # no. of phase points
+
+        n_per_chunk = int(round(dt_chunk_target/dt)) # points per chunk
+        n_hop = max(1, int(round(dt_hop_target/dt))) # points per hop
+        dt_chunk = dt*n_per_chunk                    # actual time per chunk
+        n_tot_chunk = (n - n_per_chunk)//n_hop + 1   # total number of chunks
+
+        new_report = []
+        new_report.append("Curve fit the phase data in overlapping chunks.")
+        new_report.append("The actual chunk duration is")
+        new_report.append("{0:.3f} us".format(1E6*dt_chunk))
+        new_report.append("({0} points)".format(n_per_chunk))
+        new_report.append("and a new chunk starts every")
+        new_report.append("{0:.3f} us".format(1E6*dt*n_hop))
+        new_report.append("({0} points).".format(n_hop))
+        new_report.append("A total of {0} chunks will be curve fit.".format(n_tot_chunk))
+        start = time.time()
+
+        y = self.f['workup/time/p'][()]
+        abscissa = self.f['workup/time/p'].attrs['abscissa']
+        x = self.f[abscissa][()]
+
+        x_middle, slope = _fit_phase_sliding(x, y, dt, n_per_chunk, n_hop)
+
+        stop = time.time()
+        t_calc = stop - start
+
+        self._create_fit_datasets(x_middle, slope,
+            [('n_per_chunk', n_per_chunk), ('n_hop', n_hop)])
+
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to perform the curve fit and obtain the frequency.")
+
+        self.report.append(" ".join(new_report))
+
+    @_workup_stage
+    def fit_phase_multi(self, dt_chunk_targets):
+
+        """
+        Fit the phase *vs* time data to a line in non-overlapping chunks, as
+        in :meth:`fit_phase`, for each of several chunk durations, with
+
+        :param list dt_chunk_targets: the target chunk durations [s]
 
-        # Reshape the time data
-        #  zero the time at start of each chunk
+        The phase is read once, and each chunk duration is fit from prefix
+        sums of the phase restarted every chunk length (see
+        :meth:`fit_phase`), so each additional resolution costs one pass
+        over the phase points.  The results for a chunk of ``n`` points are
+        stored in::
 
+            workup/fit/multi/n/x
+            workup/fit/multi/n/y
+
+        with the ``abscissa`` of each ``y`` pointing to the ``x`` in the same
+        group.  Chunk durations that round to the same number of points are
+        fit once.
+        """
+
+        dt = self._phase_step()                       # time per phase point
+        start = time.time()
+
+        y = self.f['workup/time/p'][()]
         abscissa = self.f['workup/time/p'].attrs['abscissa']
-        x = np.array(self.f[abscissa])[0:n_total]
-        x_sub = x.reshape((n_tot_chunk,n_per_chunk))
-        x_sub_reset = x_sub - x_sub[:,:,np.newaxis][:,0,:]*np.ones(n_per_chunk)
+        x = self.f[abscissa][()]
 
-        # use linear least-squares fitting formulas
-        #  to calculate the best-fit slope
+        n_per_chunks = []
+        for dt_chunk_target in dt_chunk_targets:
+            n_per_chunk = int(round(dt_chunk_target/dt))
+            if n_per_chunk not in n_per_chunks:
+                n_per_chunks.append(n_per_chunk)
 
-        SX = dt*0.50*(n_per_chunk-1)*(n_per_chunk)
-        SXX = (dt)**2*(1/6.0)*(n_per_chunk)*(n_per_chunk-1)*(2*n_per_chunk-1)
-        SY = np.sum(y_sub_reset,axis=1)
-        SXY = np.sum(x_sub_reset*y_sub_reset,axis=1)
-        slope = (n_per_chunk*SXY-SX*SY)/(n_per_chunk*SXX-SX*SX)
+        for n_per_chunk in n_per_chunks:
+            x_middle, slope = _fit_phase_sliding(x, y, dt, n_per_chunk,
+                                                 n_per_chunk)
+            self._create_fit_datasets(x_middle, slope,
+                [('n_per_chunk', n_per_chunk), ('n_hop', n_per_chunk)],
+                group='workup/fit/multi/{0}'.format(n_per_chunk))
 
         stop = time.time()
         t_calc = stop - start
-                                
-        # Save the time axis and the slope
-        #
-        # Tricky: the time we want is the time in the ~middle~ of each chunk
-        #
-        #     old: x_sub[:,0]
-        #     new: x_sub_middle = np.mean(x_sub[:,:],axis=1)
-
-        x_sub_middle = np.mean(x_sub[:,:],axis=1)
-        dset = self.f.create_dataset('workup/fit/x',data=x_sub_middle)
+
+        new_report = []
+        new_report.append("Curve fit the phase data with chunk durations of")
+        new_report.append(", ".join(["{0:.3f} us".format(1E6*dt*n)
+                                     for n in n_per_chunks]))
+        new_report.append("({0} points).".format(
+            ", ".join([str(n) for n in n_per_chunks])))
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to perform the curve fits and obtain the frequencies.")
+
+        self.report.append(" ".join(new_report))
+
+    def _create_fit_datasets(self, x, slope, extra_attrs=[],
+                             group='workup/fit'):
+        """Save the chunk times and best-fit slopes to ``x`` and ``y`` in
+        ``group`` (by default ``workup/fit``), adding the ``extra_attrs``
+        (name, value) pairs to the attributes of ``y``."""
+
+        dset = self.f.create_dataset(group + '/x',data=x)
         attrs = OrderedDict([
             ('name','t'),
             ('unit','s'),
@@ -1168,25 +2431,70 @@ class Signal(object):
             ])
         update_attrs(dset.attrs,attrs)
                   
-        dset = self.f.create_dataset('workup/fit/y',data=slope)
+        dset = self.f.create_dataset(group + '/y',data=slope)
         attrs = OrderedDict([
             ('name','f'),
             ('unit','cyc/s'),
             ('label','f [cyc/s]'),
             ('label_latex','$f \: [\mathrm{cyc/s}]$'),
             ('help','best-fit slope'),
-            ('abscissa','workup/fit/x')
-            ])
+            ('abscissa',group + '/x')
+            ] + list(extra_attrs))
         update_attrs(dset.attrs,attrs)        
-        
-        # report the curve-fitting details
-        #  and prepare the report
-        
+
+    @_workup_stage
+    def demodulate(self, bw, tw, td, dt_chunk_target, order=50,
+                   style="brick wall", mode="middle", real=False,
+                   length="power of two", smooth=5):
+
+        """
+        Determine the frequency *vs* time in one call.  This is equivalent to
+        the staged workup ::
+
+            S.time_mask_binarate(mode, length, smooth)
+            S.time_window_cyclicize(tw)
+            S.fft(real=real)
+            S.freq_filter_Hilbert_complex()
+            S.freq_filter_bp(bw, order, style)
+            S.time_mask_rippleless(td)
+            S.ifft()
+            S.fit_phase(dt_chunk_target)
+
+        and gives identical ``workup/fit/x`` and ``workup/fit/y`` datasets,
+        but the intermediate masks, window, spectrum, filters, and complex
+        signal are kept in memory only and are not written to the file.  See
+        :func:`demodulate_array` for the parameters.
+        """
+
+        start = time.time()
+
+        dt = self.f['x'].attrs['step']
+        x_fit, slope = demodulate_array(self.f['y'][()], dt, bw, tw, td,
+                                        dt_chunk_target, order=order,
+                                        style=style, mode=mode,
+                                        x=self.f['x'][()], real=real,
+                                        length=length, smooth=smooth)
+
+        self._create_fit_datasets(x_fit, slope)
+
+        stop = time.time()
+        t_calc = stop - start
+
+        new_report = []
+        new_report.append("Demodulate the signal in one pass")
+        new_report.append("(mode = {0},".format(mode))
+        new_report.append("window = {0:.3f} us,".format(1E6*tw))
+        new_report.append("{0} bandpass filter with".format(style))
+        new_report.append("bandwidth = {0:.3f} kHz and order = {1},".format(bw, order))
+        new_report.append("dead time = {0:.3f} us,".format(1E6*td))
+        new_report.append("chunk duration = {0:.3f} us).".format(
+            1E6*dt*int(round(dt_chunk_target/dt))))
+        new_report.append("A total of {0} chunks were curve fit.".format(slope.shape[-1]))
         new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
-        new_report.append("to perform the curve fit and obtain the frequency.")
-                 
-        self.report.append(" ".join(new_report))      
+        new_report.append("to demodulate the signal.")
+        self.report.append(" ".join(new_report))
 
+    @_workup_stage
     def fit_amplitude(self):
         
         """
@@ -1198,6 +2506,10 @@ class Signal(object):
         
             workup/fit/exp
         
+        If ``workup/time/a`` holds a stack of amplitudes, one per row, fit
+        every row at once with :func:`fit_exp_decay` and store arrays of the
+        fit parameters, one element per row, in the same attributes.
+
         **Programming Notes**
         
         * From the ``lmfit`` documentation [`link <http://newville.github.io/lmfit-py/fitting.html#fit_report>`__]:    
@@ -1212,8 +2524,12 @@ class Signal(object):
         
         # extract the data from the Datasets
         y_dset = self.f['workup/time/a']
-        x = np.array(self.f[y_dset.attrs['abscissa']][:])
-        y = np.array(y_dset[:])
+        x = self.f[y_dset.attrs['abscissa']][()]
+        y = y_dset[()]
+
+        if y.ndim > 1:
+            self._fit_amplitude_batch(y_dset, x, y)
+            return
         
         # define objective function: returns the array to be minimized
         def fcn2min(params, x, y, y_stdev):
@@ -1224,20 +2540,27 @@ class Signal(object):
             y_calc = a0*np.exp(-x/tau) + a1
             return (y_calc - y)/y_stdev
 
-        # create a set of Parameters
+        # create a set of Parameters, starting from a closed-form estimate;
+        #  keep the amplitudes off their lower bound, where the fit
+        #  could not move them
+        a0, tau, a1 = _exp_decay_guess(x, y)
+        span = np.ptp(y)
         params = Parameters()
-        params.add('a0', value= 1.0,  min=0)
-        params.add('a1', value= 0.1,  min=0)
-        params.add('tau', value= 1.0)
+        params.add('a0', value=max(a0, 1E-3*span),  min=0)
+        params.add('a1', value=max(a1, 1E-3*span),  min=0)
+        params.add('tau', value=tau)
 
-        # do fit once, here with leastsq model
+        # do fit once, here with leastsq model and the analytic Jacobian
         y_stdev = np.ones(y.size)
-        result = minimize(fcn2min, params, args=(x,y,y_stdev))
+        fit_kws = {'Dfun': _exp_decay_jacobian, 'col_deriv': 1}
+        result = minimize(fcn2min, params, args=(x,y,y_stdev), **fit_kws)
 
-        # do fit again, using the standard deviation of the residuals
-        #  as an estimate of the standard error in each data point
+        # do fit again, starting from the first fit and using the standard
+        #  deviation of the residuals as an estimate of the standard error
+        #  in each data point
         y_stdev = np.std(result.residual)*np.ones(y.size)
-        result = minimize(fcn2min, params, args=(x,y,y_stdev))
+        result = minimize(fcn2min, result.params, args=(x,y,y_stdev),
+                          **fit_kws)
 
         # calculate final result
         y_calc = y + y_stdev*result.residual
@@ -1248,8 +2571,6 @@ class Signal(object):
         # store fit results!
         # format string examples: http://mkaz.com/2012/10/10/python-string-format/
 
-        dset = self.f.create_group('workup/fit/exp')
-        
         p = result.params
 
         title = "a(t) = a0*exp(-t/tau) + a1" \
@@ -1266,13 +2587,7 @@ class Signal(object):
                         p['tau'].value, p['tau'].stderr,
                         p['a1'].value, p['a1'].stderr)
                 
-        attrs = OrderedDict([
-            ('abscissa', y_dset.attrs['abscissa']),
-            ('ordinate', 'workup/time/a'),
-            ('fit_report', rep),
-            ('help', 'fit to decaying exponential'),
-            ('title', title),
-            ('title_LaTeX', title_LaTeX),
+        values = OrderedDict([
             ('tau', p['tau'].value),
             ('tau_stderr', p['tau'].stderr),
             ('a0', p['a0'].value),
@@ -1280,6 +2595,63 @@ class Signal(object):
             ('a1', p['a1'].value),
             ('a1_stderr', p['a1'].stderr)         
             ])
+
+        self._store_exp_fit(y_dset, values, rep, title, title_LaTeX,
+                            y_calc, result.residual)
+
+    def _fit_amplitude_batch(self, y_dset, x, y):
+        """
+        Fit every row of the amplitude stack ``y`` at once; see
+        :meth:`fit_amplitude`.
+        """
+
+        start = time.time()
+        values, y_calc = fit_exp_decay(x, y)
+
+        # the residuals, scaled as in the single fit by each row's
+        #  standard deviation of the residuals
+        y_resid = y_calc - y
+        y_resid = y_resid/np.std(y_resid, axis=-1, keepdims=True)
+
+        n_conv = int(values['converged'].sum())
+        rep = "Levenberg-Marquardt fit of {0} traces; {1} converged".format(
+            y.shape[0], n_conv)
+
+        title = "a(t) = a0*exp(-t/tau) + a1" \
+                "\n" \
+                "{0} traces, median tau = {1:.6f}".format(
+                    y.shape[0], np.median(values['tau']))
+        title_LaTeX = r'$a(t) = a_0 \exp(-t/\tau) + a_1$' \
+                      '\n' \
+                      r'{0} traces, median $\tau = {1:.6f}$'.format(
+                          y.shape[0], np.median(values['tau']))
+
+        self._store_exp_fit(y_dset, values, rep, title, title_LaTeX,
+                            y_calc, y_resid)
+
+        stop = time.time()
+        new_report = []
+        new_report.append("Fit {0} amplitude traces".format(y.shape[0]))
+        new_report.append("to decaying exponentials;")
+        new_report.append("{0} converged.".format(n_conv))
+        new_report.append("It took {0:.1f} ms.".format(1E3*(stop - start)))
+        self.report.append(" ".join(new_report))
+
+    def _store_exp_fit(self, y_dset, values, rep, title, title_LaTeX,
+                       y_calc, y_resid):
+        """Store a decaying-exponential fit at ``workup/fit/exp``."""
+
+        dset = self.f.create_group('workup/fit/exp')
+
+        attrs = OrderedDict([
+            ('abscissa', y_dset.attrs['abscissa']),
+            ('ordinate', 'workup/time/a'),
+            ('fit_report', rep),
+            ('help', 'fit to decaying exponential'),
+            ('title', title),
+            ('title_LaTeX', title_LaTeX)
+            ])
+        attrs.update(values)
         update_attrs(dset.attrs,attrs)
         
         dset = self.f.create_dataset('workup/fit/exp/y_calc',data=y_calc)
@@ -1294,7 +2666,7 @@ class Signal(object):
             ])
         update_attrs(dset.attrs,attrs)
                 
-        dset = self.f.create_dataset('workup/fit/exp/y_resid',data=result.residual) 
+        dset = self.f.create_dataset('workup/fit/exp/y_resid',data=y_resid) 
         attrs = OrderedDict([ 
             ('abscissa', y_dset.attrs['abscissa']),
             ('name', 'a (resid)'),
@@ -1305,6 +2677,340 @@ class Signal(object):
             ])
         update_attrs(dset.attrs,attrs)
 
+    @_workup_stage
+    def stability(self, tau=None, n_tau=40):
+
+        """
+        Characterize the frequency noise of the demodulated signal, with
+
+        :param tau: the target averaging times :math:`\\tau` [s]; if None
+            (default), ``n_tau`` log-spaced times from one point to a third
+            of the record
+        :param int n_tau: the number of default averaging times
+
+        Compute the overlapping Allan deviation of the frequency directly
+        from the phase :math:`\\phi_k` [cyc] in ``workup/time/p``.  With
+        :math:`\\tau = m \\: \\Delta t`,
+
+        .. math::
+
+            \\begin{equation}
+            \\sigma_f^2(\\tau) = \\frac{1}{2 \\tau^2 (N - 2m)}
+            \\sum_{k = 0}^{N - 2m - 1}
+            (\\phi_{k+2m} - 2 \\phi_{k+m} + \\phi_k)^2
+            \\end{equation}
+
+        Each averaging time takes one pass over the phase, so the cost is
+        proportional to :math:`N` times the number of averaging times.
+        Averaging times which round to the same :math:`m` are computed once.
+        Store the results in::
+
+            workup/stability/tau
+            workup/stability/adev
+
+        The Allan deviation is in cyc/s; divide by the carrier frequency for
+        the fractional Allan deviation.  The number of terms averaged at
+        each :math:`\\tau` is stored in ``workup/stability/adev_n``.
+
+        If ``workup/fit/y`` is defined, with at least three chunks, also
+        compute the power spectrum of the frequency fluctuations about their
+        mean, normalized as in ``fft(psd=True)``, and store it in::
+
+            workup/stability/freq
+            workup/stability/psd
+        """
+
+        start = time.time()
+
+        p = self.f['workup/time/p'][()]
+        dt = self._phase_step()
+        N = p.shape[-1]
+
+        if tau is None:
+            m = np.logspace(0, np.log10(max(1, (N - 1)//3)), n_tau)
+        else:
+            m = np.asarray(tau)/dt
+        m = np.unique(np.round(m).astype(int))
+        m = m[(m >= 1) & (2*m < N)]
+        if m.size == 0:
+            raise ValueError("No averaging time is between one point,"
+                             " {0:.3g} s, and half the record, {1:.3g} s".format(
+                                 dt, dt*(N - 1)/2))
+
+        adev = np.zeros(p.shape[:-1] + (m.size,))
+        for k, mk in enumerate(m):
+            d = p[..., 2*mk:] - 2*p[..., mk:N-mk] + p[..., 0:N-2*mk]
+            adev[..., k] = np.sqrt(np.mean(d*d, axis=-1)/(2*(mk*dt)**2))
+
+        dset = self.f.create_dataset('workup/stability/tau',data=m*dt)
+        attrs = OrderedDict([
+            ('name','tau'),
+            ('unit','s'),
+            ('label','tau [s]'),
+            ('label_latex','$\\tau \\: [\\mathrm{s}]$'),
+            ('help','averaging time')
+            ])
+        update_attrs(dset.attrs,attrs)
+
+        dset = self.f.create_dataset('workup/stability/adev',data=adev)
+        attrs = OrderedDict([
+            ('name','adev'),
+            ('unit','cyc/s'),
+            ('label','sigma_f [cyc/s]'),
+            ('label_latex','$\\sigma_f(\\tau) \\: [\\mathrm{cyc/s}]$'),
+            ('help','overlapping Allan deviation of the frequency'),
+            ('abscissa','workup/stability/tau')
+            ])
+        update_attrs(dset.attrs,attrs)
+
+        dset = self.f.create_dataset('workup/stability/adev_n',data=N - 2*m)
+        attrs = OrderedDict([
+            ('name','n'),
+            ('unit','unitless'),
+            ('label','n'),
+            ('label_latex','$n$'),
+            ('help','number of terms averaged'),
+            ('abscissa','workup/stability/tau')
+            ])
+        update_attrs(dset.attrs,attrs)
+
+        new_report = []
+        new_report.append("Compute the overlapping Allan deviation of the")
+        new_report.append("frequency at {0} averaging times".format(m.size))
+        new_report.append("from {0:.3f} us".format(1E6*m[0]*dt))
+        new_report.append("to {0:.3f} ms.".format(1E3*m[-1]*dt))
+
+        if self.f.__contains__('workup/fit/y') == True and \
+                self.f['workup/fit/y'].shape[-1] < 3:
+
+            new_report.append("Skip the power spectrum of the frequency")
+            new_report.append("fluctuations; workup/fit/y has fewer than")
+            new_report.append("three points.")
+
+        elif self.f.__contains__('workup/fit/y') == True:
+
+            f_fit = self.f['workup/fit/y'][()]
+            x_fit = self.f['workup/fit/x'][()]
+            dt_fit = x_fit[1] - x_fit[0]
+            n_fit = f_fit.shape[-1]
+
+            df = f_fit - np.mean(f_fit, axis=-1, keepdims=True)
+            psd = (dt_fit/n_fit)*np.power(abs(fftbackend.rfft(df)), 2.0)
+            freq = np.fft.rfftfreq(n_fit, dt_fit)
+
+            # Keep the bins fft(psd=True) keeps
+
+            mask = np.arange(freq.size) < (n_fit + 1)//2
+            freq = freq[mask]
+            psd = psd[..., mask]
+
+            dset = self.f.create_dataset('workup/stability/freq',data=freq/1E3)
+            attrs = OrderedDict([
+                ('name','f'),
+                ('unit','kHz'),
+                ('label','f [kHz]'),
+                ('label_latex','$f \\: [\\mathrm{kHz}]$'),
+                ('help','frequency'),
+                ('initial',freq[0]),
+                ('step',freq[1]-freq[0])
+                ])
+            update_attrs(dset.attrs,attrs)
+
+            dset = self.f.create_dataset('workup/stability/psd',data=psd)
+            attrs = OrderedDict([
+                ('name','P_df'),
+                ('unit','(cyc/s)^2/Hz'),
+                ('label','P_df [(cyc/s)^2/Hz]'),
+                ('label_latex','$P_{\\delta f} \\: [\\mathrm{(cyc/s)^2/Hz}]$'),
+                ('help','power spectrum of the frequency fluctuations'),
+                ('abscissa','workup/stability/freq'),
+                ('n_avg',1)
+                ])
+            update_attrs(dset.attrs,attrs)
+
+            new_report.append("Compute the power spectrum of the")
+            new_report.append("frequency fluctuations in workup/fit/y.")
+
+        stop = time.time()
+        t_calc = stop - start
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to characterize the frequency noise.")
+        self.report.append(" ".join(new_report))
+
+    @_workup_stage
+    def sweep_bandpass(self, bws, styles=("brick wall",), orders=(50,),
+                       td=None, dt_chunk_target=250E-6, workers=1):
+
+        """
+        Demodulate the signal with every combination of bandpass filter
+        bandwidth, style, and order, sharing one Fourier transform, and
+        tabulate the frequency noise of each, with
+
+        :param bws: the bandpass filter bandwidths [kHz]
+        :param styles: the bandpass filter styles, "brick wall" (default),
+            "cosine", or "gaussian"
+        :param orders: the bandpass filter orders (defaults to 50)
+        :param float td: the dead time [s] trimmed from each end of the
+            phase; if None (default), use ``workup/time/mask/rippleless``
+            if it is defined and otherwise trim nothing
+        :param float dt_chunk_target: the target chunk duration [s] for the
+            phase fits (defaults to 250 us)
+        :param int workers: the number of filter configurations worked up at
+            once, in a thread pool (defaults to 1).  The FFTs release the
+            GIL, so a few workers speed up a long sweep, at the cost of one
+            spectrum and one complex signal of memory per worker.
+
+        The spectrum ``workup/freq/FT`` is computed by ``fft()`` if it is
+        not already defined.  Each configuration is then filtered,
+        inverse transformed, and fit in chunks exactly as by
+        ``freq_filter_bp()``, ``ifft()``, and ``fit_phase()``, using the
+        complex Hilbert filter and the bandpass filter centered on the
+        spectrum's peak.  The results are stored in a table with one row per
+        configuration::
+
+            workup/sweep/bw       bandwidth [kHz]
+            workup/sweep/style    filter style (bytes)
+            workup/sweep/order    filter order
+            workup/sweep/f_mean   mean of the chunk frequencies [cyc/s]
+            workup/sweep/f_std    standard deviation of the chunk
+                                  frequencies [cyc/s]
+            workup/sweep/adev     overlapping Allan deviation of the
+                                  frequency at the chunk duration [cyc/s]
+
+        along with the chunk times ``workup/sweep/x`` and the chunk
+        frequencies ``workup/sweep/y``, one row per configuration.  For a
+        *SignalBatch*, the metrics and frequencies have an extra axis, one
+        entry per signal.
+        """
+
+        start = time.time()
+
+        if isinstance(styles, six.string_types):
+            styles = [styles]
+        configs = [(float(bw), style, int(order)) for bw in np.atleast_1d(bws)
+                   for style in styles for order in np.atleast_1d(orders)]
+
+        # The spectrum and the filters shared by every configuration
+
+        if self.f.__contains__('workup/freq/FT') == False:
+            self.fft()
+
+        dt = self.f['x'].attrs['step']
+        FT_attrs = self.f['workup/freq/FT'].attrs
+        freq = self.f['workup/freq/freq'][()]
+        spectrum = self.f['workup/freq/FT'][()]/dt
+
+        if self.f.__contains__('workup/freq/filter/Hc') == True:
+            Hc = self.f['workup/freq/filter/Hc'][()]
+        else:
+            Hc = _hilbert_filter(freq, FT_attrs.get('layout'),
+                                 FT_attrs.get('n_fft'))
+        i_c = np.argmax(Hc*abs(spectrum), axis=-1)
+
+        # The range of the inverse transform to keep, and its time axis
+
+        if self.f.__contains__('workup/time/mask/binarate') == True:
+            x = self.f['workup/time/x_binarated'][()]
+            n_pad = self.f['workup/time/mask/binarate'].attrs.get('n_pad', 0)
+        else:
+            x = self.f['x'][()]
+            n_pad = 0
+
+        if td is not None:
+            ww = int(math.ceil((1.0*td)/(1.0*dt)))
+            n_start, n_stop = ww, x.size - n_pad - ww
+        elif self.f.__contains__('workup/time/mask/rippleless') == True:
+            n_start, n_stop = self._mask_bounds('workup/time/mask/rippleless')
+        else:
+            n_start, n_stop = 0, x.size - n_pad
+
+        n_per_chunk = int(round(dt_chunk_target/dt))
+        n_total = n_per_chunk*int((n_stop - n_start)/n_per_chunk)
+        x = x[n_start:n_start + n_total]
+
+        def demodulate_one(config):
+            bw, style, order = config
+
+            s = spectrum*Hc
+            s *= _bandpass_filter(freq, i_c, bw, order, style)
+            if FT_attrs.get('layout') == 'rfft':
+                z = _analytic_ifft(s, FT_attrs['n_fft'])
+            else:
+                z = fftbackend.ifft(np.fft.ifftshift(s, axes=-1))
+            del s
+
+            z = z[..., n_start:n_start + n_total]
+            p = np.unwrap(np.angle(z))/(2*np.pi)
+            del z
+
+            x_fit, f_fit = _fit_phase_chunks(x, p, dt, n_per_chunk)
+
+            m = n_per_chunk
+            d = p[..., 2*m:] - 2*p[..., m:n_total-m] + p[..., 0:n_total-2*m]
+            adev = np.sqrt(np.mean(d*d, axis=-1)/(2*(m*dt)**2))
+
+            return x_fit, f_fit, adev
+
+        if workers > 1 and len(configs) > 1:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(demodulate_one, configs))
+        else:
+            results = [demodulate_one(config) for config in configs]
+
+        x_fit = results[0][0]
+        f_fit = np.array([result[1] for result in results])
+        adev = np.array([result[2] for result in results])
+
+        # Save the table of configurations and metrics
+
+        self._create_fit_datasets(x_fit, f_fit,
+            [('n_per_chunk', n_per_chunk)], group='workup/sweep')
+
+        columns = [
+            ('bw', np.array([config[0] for config in configs]),
+             'kHz', 'bw [kHz]', '$\\Delta f \\: [\\mathrm{kHz}]$',
+             'bandpass filter bandwidth'),
+            ('style', np.array([config[1] for config in configs], dtype='S'),
+             'unitless', 'style', 'style', 'bandpass filter style'),
+            ('order', np.array([config[2] for config in configs]),
+             'unitless', 'order', 'order', 'bandpass filter order'),
+            ('f_mean', np.mean(f_fit, axis=-1),
+             'cyc/s', 'f_mean [cyc/s]', '$\\bar{f} \\: [\\mathrm{cyc/s}]$',
+             'mean frequency'),
+            ('f_std', np.std(f_fit, axis=-1),
+             'cyc/s', 'f_std [cyc/s]', '$\\sigma_f \\: [\\mathrm{cyc/s}]$',
+             'standard deviation of the chunk frequencies'),
+            ('adev', adev,
+             'cyc/s', 'sigma_f [cyc/s]',
+             '$\\sigma_f(\\tau) \\: [\\mathrm{cyc/s}]$',
+             'overlapping Allan deviation of the frequency'),
+            ]
+
+        for name, data, unit, label, label_latex, help_string in columns:
+            dset = self.f.create_dataset('workup/sweep/' + name, data=data)
+            attrs = OrderedDict([
+                ('name',name),
+                ('unit',unit),
+                ('label',label),
+                ('label_latex',label_latex),
+                ('help',help_string)
+                ])
+            if name in ('f_mean', 'f_std', 'adev'):
+                attrs['abscissa'] = 'workup/sweep/bw'
+            update_attrs(dset.attrs,attrs)
+
+        stop = time.time()
+        t_calc = stop - start
+
+        new_report = []
+        new_report.append("Sweep {0} bandpass filter".format(len(configs)))
+        new_report.append("configurations through the filter, inverse FFT,")
+        new_report.append("and phase fit, with a chunk duration of")
+        new_report.append("{0:.3f} us.".format(1E6*dt*n_per_chunk))
+        new_report.append("It took {0:.1f} ms".format(1E3*t_calc))
+        new_report.append("to work up every configuration.")
+        self.report.append(" ".join(new_report))
+
     def plot_fit(self, fit_group, LaTeX=False):
         
         """
@@ -1417,8 +3123,8 @@ class Signal(object):
             of the t_dataset
         :param bool infer_attrs: If True, fill in any missing attributes
             used by freqdemod."""
-        h5object.copy(t_dataset, self.f, name='x')
-        h5object.copy(s_dataset, self.f, name='y')
+        copy_item(h5object, t_dataset, self.f, 'x')
+        copy_item(h5object, s_dataset, self.f, 'y')
 
         x_attrs = self.f['x'].attrs
         y_attrs = self.f['y'].attrs
@@ -1450,7 +3156,7 @@ class Signal(object):
         :param float dt: the time per point [s]
         :param str s_help: the signal's help string
         """
-        h5object.copy(s_dataset, self.f, name='y', without_attrs=True)
+        copy_item(h5object, s_dataset, self.f, 'y', without_attrs=True)
         y_attrs = {'name': s_name,
                    'unit': s_unit,
                    'help': s_help,
@@ -1460,10 +3166,10 @@ class Signal(object):
         infer_labels(self.f['y'].attrs)
 
         if t_dataset is not None:
-            h5object.copy(t_dataset, self.f, name='x', without_attrs=True)
+            copy_item(h5object, t_dataset, self.f, 'x', without_attrs=True)
             dt_ = infer_timestep(h5object[t_dataset])
         elif dt is not None:
-            self.f['x'] = dt * np.arange(self.f['y'][:].size)
+            self.f['x'] = dt * np.arange(self.f['y'].shape[-1])
             dt_ = dt
         else:
             raise ValueError("Must specify one of 't_dataset' or 'dt'")
@@ -1478,6 +3184,187 @@ class Signal(object):
 
         update_attrs(self.f['x'].attrs, x_attrs)
 
+class SignalBatch(Signal):
+
+    """
+    A stack of equal-length signals worked up together.  The signals are
+    stored as the rows of an (N, n) array ``y``, sharing the time axis
+    ``x``, and every workup step of *Signal* -- ``time_mask_binarate``,
+    ``time_window_cyclicize``, ``fft``, ``freq_filter_Hilbert_complex``,
+    ``freq_filter_bp``, ``time_mask_rippleless``, ``ifft``, ``lockin``,
+    ``pll``, ``fit_phase``, ``fit_amplitude``, and the one-call
+    ``demodulate`` -- operates on all N rows at once along the last axis.
+    The masks, window, frequency axis, and Hilbert filter are shared by
+    every row; the bandpass filter has one row per signal, each centered on
+    that signal's own peak frequency.  The result is an (N, n_chunks)
+    frequency matrix in ``workup/fit/y``.
+
+    Example::
+
+        B = SignalBatch()
+        B.load_nparray(Y, "x", "nm", dt)   # Y.shape == (N, n)
+        B.demodulate(bw=1.0, tw=3E-3, td=15E-3, dt_chunk_target=250E-6)
+        B.f['workup/fit/y'].shape         # (N, n_chunks)
+    """
+
+    def load_nparray(self, s, s_name, s_unit, dt, s_help='cantilever displacement'):
+
+        """
+        Load a stack of signals.
+
+        :param s: the signals *vs* time, one signal per row
+        :type s: np.array with shape (N, n)
+        :param str s_name: the signals' name
+        :param str s_unit: the signals' units
+        :param float dt: the time per point [s]
+        :param str s_help: the signals' help string
+        """
+
+        s = np.asarray(s)
+        if s.ndim != 2:
+            raise ValueError("SignalBatch expects an (N, n) array of signals;"
+                             " got shape {0}".format(s.shape))
+
+        Signal.load_nparray(self, s, s_name, s_unit, dt, s_help)
+        self.f['y'].attrs['n_signals'] = s.shape[0]
+
+        # Correct the length reported by Signal.load_nparray
+
+        self.report[-1] = " ".join([
+            "Add {0} signals {1}[{2}]".format(s.shape[0], s_name, s_unit),
+            "of length {0},".format(s.shape[1]),
+            "time step {0:.3f} us,".format(1E6*dt),
+            "and duration {0:.3f} s".format(s.shape[1]*dt)])
+
+    def plot(self, ordinate, row=0, LaTeX=False, component='abs'):
+
+        """
+        Plot one signal of the stack; see ``Signal.plot()``.
+
+        :param str ordinate: the name the y-axis data key
+        :param int row: which signal to plot, for a dataset with one row
+            per signal; a dataset shared by every signal, such as a mask, is
+            plotted as it is
+        :param boolean LaTeX: use LaTeX axis labels; ``True`` or ``False``
+            (default)
+        :param str component: `abs` (default), `real`, `imag`, or `both`;
+            if the dataset is complex, which component do we plot
+        """
+
+        y = self.f[ordinate]
+        y_attrs = y.attrs
+        x = self.f[y_attrs['abscissa']]
+
+        if y_attrs.get('name') == 'mask':
+            y = self.mask_array(ordinate)
+        elif len(y.shape) == 2:
+            y = y[row]
+
+        self._plot(x, y, y_attrs, LaTeX, component)
+
+def demodulate_array(y, dt, bw, tw, td, dt_chunk_target, order=50,
+                     style="brick wall", mode="middle", x=None, real=False,
+                     length="power of two", smooth=5):
+
+    """
+    Determine the frequency *vs* time of the signal ``y`` without creating a
+    *Signal* object.  Carry out the binarate, cyclicize, FFT, Hilbert,
+    bandpass, rippleless, IFFT, and phase-fitting steps of the staged
+    *Signal* workup in one pass, with
+    
+    :param y: the signal *vs* time
+    :type y: np.array
+    :param float dt: the time per point [s]
+    :param float bw: bandpass filter bandwidth [kHz]
+    :param float tw: the window's target rise/fall time [s]; no window if None
+    :param float td: the dead time [s]; no rippleless mask if None
+    :param float dt_chunk_target: the target chunk duration [s]
+    :param int order: bandpass filter order (defaults to 50)
+    :param str style: bandpass filter style (defaults to "brick wall")
+    :param str mode: binarate mode, "start", "middle" (default), or "end";
+        no binarate mask if None
+    :param x: the time array; defaults to ``dt * np.arange(y.size)``
+    :param bool real: If True, use the real-input FFT, as in
+        ``Signal.fft(real=True)``
+    :param str length: binarate length, "power of two" (default), "trim", or
+        "pad", as in ``Signal.time_mask_binarate``
+    :param int smooth: the largest prime factor allowed in the "trim" or
+        "pad" length (defaults to 5)
+    
+    Return ``(x_fit, f_fit)``, the time at the middle of each chunk [s] and
+    the frequency during each chunk [cyc/s].  If ``y`` is an (N, n) stack of
+    signals, each row is demodulated with its own center frequency and
+    ``f_fit`` has shape (N, n_chunks).  The masks become slices and the
+    window and filters are applied to a single spectrum buffer, so that only
+    a few full-length arrays are allocated.  The arithmetic is carried out
+    in the same order as the staged workup, so the results are identical.
+    """
+
+    y = np.asarray(y)
+    if x is None:
+        x = dt * np.arange(y.shape[-1])
+
+    # Masks become slices
+
+    if mode is not None:
+        n_start, n_stop, n_pad = _binarate_bounds(y.shape[-1], mode, length,
+                                                  smooth)
+    else:
+        n_start, n_stop, n_pad = 0, y.shape[-1], 0
+    n = n_stop - n_start + n_pad
+    s = y[..., n_start:n_stop]
+    x = x[n_start:n_stop]
+
+    if n_pad > 0:
+        s = np.concatenate([s, np.zeros(s.shape[:-1] + (n_pad,),
+                                        dtype=s.dtype)], axis=-1)
+        x = np.concatenate([x, x[-1] + dt*np.arange(1, n_pad+1)])
+
+    if tw is not None:
+        ww = int(math.ceil((1.0*tw)/(1.0*dt)))
+        s = _cyclicize_window(n, ww, n_pad)*s
+
+    # Forward transform; scaled by dt as in Signal.fft()
+
+    if real == True:
+        layout = 'rfft'
+        spectrum = fftbackend.rfft(s)
+        freq = np.fft.rfftfreq(n,dt)/1E3
+    else:
+        layout = 'fftshift'
+        spectrum = np.fft.fftshift(fftbackend.fft(s), axes=-1)
+        freq = np.fft.fftshift(np.fft.fftfreq(n,dt))/1E3
+    spectrum *= dt
+
+    # The Hilbert and bandpass filters combine into one filter, since
+    # multiplying by Hc = 0, 1, or 2 is exact
+
+    Hc = _hilbert_filter(freq, layout, n)
+    i_c = np.argmax(Hc*abs(spectrum), axis=-1)
+    filt = _bandpass_filter(freq, i_c, bw, order, style)*Hc
+
+    # Undo the dt scaling exactly as Signal.ifft() does, then filter
+
+    spectrum /= dt
+    spectrum *= filt
+    if real == True:
+        z = _analytic_ifft(spectrum, n)
+    else:
+        z = fftbackend.ifft(np.fft.ifftshift(spectrum, axes=-1))
+
+    if td is not None:
+        wd = int(math.ceil((1.0*td)/(1.0*dt)))
+        z = z[..., wd:n-n_pad-wd]
+        x = x[wd:n-n_pad-wd]
+    elif n_pad > 0:
+        z = z[..., 0:n-n_pad]
+        x = x[0:n-n_pad]
+
+    p = np.unwrap(np.angle(z))/(2*np.pi)
+
+    n_per_chunk = int(round(dt_chunk_target/dt))
+    return _fit_phase_chunks(x, p, dt, n_per_chunk)
+
 def testsignal_sine():
         
     fd = 50.0E3    # digitization frequency
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# fftbackend.py
+
+"""
+
+The Fast Fourier transforms used by :meth:`Signal.fft`, :meth:`Signal.ifft`,
+and :func:`demodulate_array` -- and so by the power spectra averaged by the
+``PSD`` object in :mod:`thermomechanical` -- all go through the functions in
+this module, so that the FFT library can be chosen in one place.  Three
+backends are available:
+
+* ``'scipy'`` (default) -- ``scipy.fft``, run on ``workers`` threads.
+  ``scipy.fft`` keeps its own cache of recently used plans.
+
+* ``'pyfftw'`` -- FFTW through the optional ``pyfftw`` package, run on
+  ``workers`` threads.  Plans are built once per transform type, length,
+  and dtype and kept in an LRU cache, and FFTW's accumulated "wisdom" can be
+  saved to and loaded from a file so that later sessions skip the planning.
+
+* ``'numpy'`` -- ``numpy.fft``, single threaded.
+
+Example::
+
+    from freqdemod import fftbackend
+    fftbackend.set_backend('scipy', workers=4)
+    fftbackend.set_backend('pyfftw', workers=4, wisdom_file='fftw.wisdom')
+
+    with fftbackend.using('numpy'):
+        S.fft()
+
+"""
+
+from __future__ import division, print_function, absolute_import
+import os
+import pickle
+import threading
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import scipy.fft
+
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+_config = {'backend': 'scipy', 'workers': 1, 'wisdom_file': None}
+
+_plans = OrderedDict()
+_plan_stats = {'hits': 0, 'misses': 0}
+_plan_lock = threading.Lock()
+PLAN_CACHE_SIZE = 32
+
+def set_backend(backend='scipy', workers=None, wisdom_file=None):
+    """
+    Choose the FFT library.
+
+    :param str backend: ``'scipy'`` (default), ``'pyfftw'``, or ``'numpy'``
+    :param int workers: number of threads per transform; -1 means one per
+        CPU.  If None, keep the current setting.
+    :param str wisdom_file: (``'pyfftw'`` only) load FFTW wisdom from this
+        file, if it exists; ``save_wisdom()`` writes it back.
+    """
+
+    if backend not in ('scipy', 'pyfftw', 'numpy'):
+        raise ValueError("Unrecognized FFT backend '{0}'; use 'scipy',"
+                         " 'pyfftw', or 'numpy'".format(backend))
+
+    if backend == 'pyfftw' and pyfftw is None:
+        raise ImportError("The 'pyfftw' backend requires the pyfftw package")
+
+    _config['backend'] = backend
+    if workers is not None:
+        if workers == -1:
+            workers = os.cpu_count() or 1
+        _config['workers'] = int(workers)
+
+    if backend == 'pyfftw':
+        _config['wisdom_file'] = wisdom_file
+        if wisdom_file is not None and os.path.exists(wisdom_file):
+            with open(wisdom_file, 'rb') as fh:
+                pyfftw.import_wisdom(pickle.load(fh))
+
+    clear_plan_cache()
+
+def get_backend():
+    """Return the current backend settings as a dictionary."""
+    return dict(_config)
+
+@contextlib.contextmanager
+def using(backend=None, workers=None):
+    """Temporarily change the backend and/or the number of workers."""
+
+    old = get_backend()
+    try:
+        set_backend(backend if backend is not None else old['backend'],
+                    workers=workers)
+        yield
+    finally:
+        _config.update(old)
+        clear_plan_cache()
+
+def save_wisdom(filename=None):
+    """Save FFTW's wisdom, by default to the ``wisdom_file`` given to
+    ``set_backend``."""
+
+    if pyfftw is None:
+        raise ImportError("Saving wisdom requires the pyfftw package")
+    filename = filename if filename is not None else _config['wisdom_file']
+    if filename is None:
+        raise ValueError("No wisdom file specified")
+    with open(filename, 'wb') as fh:
+        pickle.dump(pyfftw.export_wisdom(), fh)
+
+def plan_cache_info():
+    """Return the plan-cache size, hits, and misses (``'pyfftw'`` only)."""
+    return {'size': len(_plans),
+            'maxsize': PLAN_CACHE_SIZE,
+            'hits': _plan_stats['hits'],
+            'misses': _plan_stats['misses']}
+
+def clear_plan_cache():
+    """Forget all cached plans and reset the hit/miss counters."""
+    with _plan_lock:
+        _plans.clear()
+        _plan_stats['hits'] = 0
+        _plan_stats['misses'] = 0
+
+def _fftw(kind, a, n, axis):
+    """Run the cached FFTW plan for this transform type, shape, and dtype,
+    building it first if necessary."""
+
+    key = (kind, a.shape, a.dtype.str, n, axis, _config['workers'])
+
+    with _plan_lock:
+
+        if key in _plans:
+            _plans.move_to_end(key)
+            _plan_stats['hits'] += 1
+        else:
+            _plan_stats['misses'] += 1
+            builder = getattr(pyfftw.builders, kind)
+            _plans[key] = builder(np.empty_like(a), n=n, axis=axis,
+                                  threads=_config['workers'],
+                                  planner_effort='FFTW_MEASURE')
+            while len(_plans) > PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)
+
+        # The plan writes into the same output array every call, so copy
+        return _plans[key](a).copy()
+
+def _transform(kind, a, n, axis):
+
+    a = np.asarray(a)
+    backend = _config['backend']
+
+    if backend == 'scipy':
+        return getattr(scipy.fft, kind)(a, n=n, axis=axis,
+                                        workers=_config['workers'])
+    elif backend == 'pyfftw':
+        return _fftw(kind, a, n, axis)
+    else:
+        return getattr(np.fft, kind)(a, n=n, axis=axis)
+
+def fft(a, n=None, axis=-1):
+    """Discrete Fourier transform of ``a`` along ``axis``."""
+    return _transform('fft', a, n, axis)
+
+def ifft(a, n=None, axis=-1):
+    """Inverse discrete Fourier transform of ``a`` along ``axis``."""
+    return _transform('ifft', a, n, axis)
+
+def rfft(a, n=None, axis=-1):
+    """Discrete Fourier transform of the real array ``a`` along ``axis``;
+    only the non-negative frequencies are returned."""
+    return _transform('rfft', a, n, axis)
+
+def irfft(a, n=None, axis=-1):
+    """Inverse of ``rfft``; ``n`` is the length of the real output."""
+    return _transform('irfft', a, n, axis)
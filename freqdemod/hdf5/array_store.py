@@ -0,0 +1,294 @@
+"""
+An in-memory, array-backed stand-in for an ``h5py`` file.
+
+The ``Signal`` workup writes every intermediate result to an HDF5 file, even
+when the file lives in core memory.  For long signals the time spent creating
+and copying ``h5py`` datasets can exceed the time spent computing FFTs.  The
+classes below implement the small part of the ``h5py.File`` interface used by
+``freqdemod`` -- path-style indexing, ``create_dataset``, ``create_group``,
+``attrs``, ``copy``, and ``close`` -- with plain ``numpy`` arrays and
+attribute dictionaries underneath.  Nothing is written in HDF5 format until
+the object is copied into a real ``h5py`` file or group, either with
+``copy()`` or by calling ``close()`` on a file opened with
+``backing_store=True``.
+
+Datasets are stored *without* copying the array handed to
+``create_dataset``, and reading a dataset with ``dset[()]`` or ``dset[:]``
+returns the stored array (or a view of it) rather than a copy.
+
+Example::
+
+    f = ArrayFile()
+    f['x'] = np.arange(4)
+    f['x'].attrs['unit'] = 's'
+    f.create_dataset('workup/time/p', data=np.zeros(4))
+    'workup/time' in f   # True
+
+"""
+
+from __future__ import division, print_function, absolute_import
+import os
+from collections import OrderedDict
+import numpy as np
+import h5py
+import six
+
+
+def _split_path(path):
+    """Split an HDF5-style path into its non-empty components."""
+    return [part for part in path.split('/') if part != '']
+
+
+class ArrayDataset(object):
+    """A ``numpy`` array plus an attribute dictionary, indexed like an
+    ``h5py.Dataset``."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.attrs = OrderedDict()
+        self._data = data
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def size(self):
+        return self._data.size
+
+    @property
+    def ndim(self):
+        return self._data.ndim
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self._data
+        return self._data.astype(dtype)
+
+    def __repr__(self):
+        return '<ArrayDataset "{0}": shape {1}, type "{2}">'.format(
+            self.name, self.shape, self.dtype.str)
+
+
+class ArrayGroup(object):
+    """An ordered collection of ``ArrayDataset`` and ``ArrayGroup`` objects,
+    indexed like an ``h5py.Group``."""
+
+    def __init__(self, name='/'):
+        self.name = name
+        self.attrs = OrderedDict()
+        self._items = OrderedDict()
+
+    def _child_name(self, key):
+        return '/'.join([self.name.rstrip('/'), key])
+
+    def _resolve(self, path):
+        """Return the item at ``path``, or raise ``KeyError``."""
+        item = self
+        for part in _split_path(path):
+            if not isinstance(item, ArrayGroup) or part not in item._items:
+                raise KeyError("Unable to open object (object '{0}' doesn't"
+                               " exist)".format(path))
+            item = item._items[part]
+        return item
+
+    def _parent(self, path, create=False):
+        """Return the group holding ``path`` and the final path component.
+        With ``create=True``, build any missing intermediate groups."""
+        parts = _split_path(path)
+        if len(parts) == 0:
+            raise ValueError("Empty path")
+        group = self
+        for part in parts[:-1]:
+            if part not in group._items:
+                if not create:
+                    raise KeyError("Unable to open object (object '{0}'"
+                                   " doesn't exist)".format(path))
+                group._items[part] = ArrayGroup(group._child_name(part))
+            group = group._items[part]
+            if not isinstance(group, ArrayGroup):
+                raise ValueError("Unable to create '{0}' (parent is not a"
+                                 " group)".format(path))
+        return group, parts[-1]
+
+    def __getitem__(self, path):
+        return self._resolve(path)
+
+    def __setitem__(self, path, data):
+        self.create_dataset(path, data=data)
+
+    def __delitem__(self, path):
+        group, key = self._parent(path)
+        if key not in group._items:
+            raise KeyError("Couldn't delete link '{0}'".format(path))
+        del group._items[key]
+
+    def __contains__(self, path):
+        try:
+            self._resolve(path)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        return self._items.keys()
+
+    def values(self):
+        return self._items.values()
+
+    def items(self):
+        return self._items.items()
+
+    def get(self, path, default=None):
+        try:
+            return self._resolve(path)
+        except KeyError:
+            return default
+
+    def create_group(self, path):
+        """Create a new group at ``path``, building intermediate groups."""
+        group, key = self._parent(path, create=True)
+        if key in group._items:
+            raise ValueError("Unable to create group (name already exists)")
+        new = ArrayGroup(group._child_name(key))
+        group._items[key] = new
+        return new
+
+    def require_group(self, path):
+        """Return the group at ``path``, creating it if necessary."""
+        if path in self:
+            return self._resolve(path)
+        return self.create_group(path)
+
+    def create_dataset(self, path, shape=None, dtype=None, data=None):
+        """Create a new dataset at ``path``, building intermediate groups.
+        The array ``data`` is stored without copying where possible."""
+        group, key = self._parent(path, create=True)
+        if key in group._items:
+            raise ValueError("Unable to create dataset (name already exists)")
+        if data is None:
+            data = np.zeros(shape, dtype=dtype if dtype is not None else 'f4')
+        else:
+            data = np.asarray(data, dtype=dtype)
+            if shape is not None:
+                data = data.reshape(shape)
+        new = ArrayDataset(group._child_name(key), data)
+        group._items[key] = new
+        return new
+
+    def copy(self, source, dest, name=None, without_attrs=False):
+        """Copy ``source`` (a path or item in this store) to the group
+        ``dest``, which may be an ``ArrayGroup``, an ``h5py`` group or file,
+        or a path in this store.  Copying into ``h5py`` materializes the data
+        in HDF5 format."""
+        if not isinstance(source, (ArrayDataset, ArrayGroup)):
+            source = self._resolve(source)
+        if isinstance(dest, six.string_types):
+            dest = self.require_group(dest)
+        if name is None:
+            name = _split_path(source.name)[-1]
+
+        if isinstance(source, ArrayDataset):
+            data = source[()]
+            if isinstance(dest, ArrayGroup):
+                data = np.array(data, copy=True)
+            new = dest.create_dataset(name, data=data)
+        else:
+            new = dest.create_group(name)
+            for key in source:
+                self.copy(source[key], new, name=key,
+                          without_attrs=without_attrs)
+
+        if not without_attrs:
+            for key, val in source.attrs.items():
+                new.attrs[key] = val
+
+    def visit(self, func):
+        """Call ``func(name)`` for every item below this group, in the manner
+        of ``h5py.Group.visit``."""
+        for key, item in self._items.items():
+            result = func(item.name.lstrip('/'))
+            if result is not None:
+                return result
+            if isinstance(item, ArrayGroup):
+                result = item.visit(func)
+                if result is not None:
+                    return result
+
+    def __repr__(self):
+        return '<ArrayGroup "{0}" ({1} members)>'.format(self.name, len(self))
+
+
+class ArrayFile(ArrayGroup):
+    """The root group of an array-backed store.
+
+    :param str filename: the file written by ``close()`` when
+        ``backing_store=True``
+    :param str mode: file open mode used when writing the file (see
+        h5py.File); with ``'w-'`` an existing file is an error
+    :param bool backing_store: If True, write the contents to ``filename`` in
+        HDF5 format on ``close()``.
+    """
+
+    def __init__(self, filename=None, mode='w-', backing_store=False):
+        ArrayGroup.__init__(self, '/')
+        self.filename = filename
+        self.mode = mode
+        self.backing_store = backing_store
+
+        if backing_store:
+            if filename is None:
+                raise ValueError("A filename is required with"
+                                 " backing_store=True")
+            if mode in ('w-', 'x') and os.path.exists(filename):
+                raise IOError("Unable to create file (file exists)"
+                              " {0}".format(filename))
+
+    @property
+    def file(self):
+        return self
+
+    def flush(self):
+        """Write the contents to ``filename`` if ``backing_store=True``."""
+        if self.backing_store:
+            mode = 'w' if self.mode in ('w', 'w-', 'x') else self.mode
+            with h5py.File(self.filename, mode=mode) as fh:
+                self.materialize(fh)
+            # Later flushes overwrite the file written here
+            self.mode = 'w'
+
+    def materialize(self, dest):
+        """Copy every dataset, group, and attribute into the ``h5py`` file
+        or group ``dest``."""
+        for key in self:
+            if key in dest:
+                del dest[key]
+            self.copy(key, dest, name=key)
+        for key, val in self.attrs.items():
+            dest.attrs[key] = val
+
+    def close(self):
+        """Write the file to disk if ``backing_store=True``."""
+        self.flush()
+
+    def __repr__(self):
+        return '<ArrayFile "{0}" (mode {1})>'.format(self.filename, self.mode)
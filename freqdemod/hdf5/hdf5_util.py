@@ -3,6 +3,7 @@ A set of utility functions for HDF5 files
 """
 import six
 import h5py
+from freqdemod.hdf5.array_store import ArrayFile, ArrayGroup, ArrayDataset
 
 def update_attrs(h5_attrs, attrs):
     """Update the attributes in ``h5_attrs``, an ``h5py`` group or dataset,
@@ -16,11 +17,30 @@ def update_attrs(h5_attrs, attrs):
         h5_attrs[key] = val
 
 
+def copy_item(f_src, source, f_dst, name, without_attrs=False):
+    """Copy the dataset or group ``source`` in ``f_src`` to ``name`` in
+    ``f_dst``. Either object may be an h5py file / group or an array-backed
+    ``ArrayGroup``; h5py's own copy method is used when both are h5py."""
+    if isinstance(f_src, ArrayGroup) or not isinstance(f_dst, ArrayGroup):
+        f_src.copy(source, f_dst, name=name, without_attrs=without_attrs)
+        return
+
+    item = f_src[source]
+    if isinstance(item, h5py.Dataset):
+        new = f_dst.create_dataset(name, data=item[()])
+    else:
+        new = f_dst.create_group(name)
+        for key in item:
+            copy_item(item, key, new, key, without_attrs=without_attrs)
+    if not without_attrs:
+        update_attrs(new.attrs, item.attrs)
+
+
 def _save_hdf5(f_src, f_dst, datasets, **kwargs):
     """Copy all the elements of datasets from f_src to f_dst. For information
     on kwargs, see the documentation for the h5py copy method."""
     for dset in datasets:
-        f_src.copy(dset, f_dst, name=dset, **kwargs)
+        copy_item(f_src, dset, f_dst, dset, **kwargs)
 
 
 def save_hdf5(f_src, f_dst, datasets, overwrite=False, **kwargs):
@@ -46,18 +66,18 @@ def h5ls_str(g, offset='', print_types=True):
     
     See goo.gl/2JiUQK."""
     string = []
-    if isinstance(g, h5py.File):
+    if isinstance(g, (h5py.File, ArrayFile)):
         string.append(offset+repr(g.file))
-    elif isinstance(g, h5py.Dataset):
+    elif isinstance(g, (h5py.Dataset, ArrayDataset)):
         if print_types:
             string.append(offset+g.name+'  '+repr(g.shape)+'  '+(g.dtype.str))
         else:
             string.append(offset+g.name+'  '+repr(g.shape))
-    elif isinstance(g, h5py.Group):
+    elif isinstance(g, (h5py.Group, ArrayGroup)):
         string.append(offset+g.name)
     else:
         raise ValueError('WARNING: UNKNOWN ITEM IN HDF5 FILE'+g.name)
-    if isinstance(g, h5py.File) or isinstance(g, h5py.Group):
+    if isinstance(g, (h5py.Group, ArrayGroup)):
         for key, subg in dict(g).items():
             string.append(h5ls_str(subg, offset + '    ',
                                    print_types=print_types))
@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# stream.py
+
+"""
+
+Demodulate a signal that arrives in blocks, with bounded memory.  The
+staged *Signal* workup Fourier transforms the entire record at once; the
+:class:`StreamDemodulator` instead applies the same complex Hilbert filter
+:math:`H_c` and bandpass filter :math:`\\mathrm{bp}` (any style of
+:meth:`Signal.freq_filter_bp`) as a finite impulse response filter, by
+overlap-save block convolution with a fixed FFT length.  Every full input
+block yields a block of the complex analytic signal :math:`z(t)`, the
+phase :math:`\\phi(t)` in cycles, unwrapped continuously from block to
+block, and the frequency.
+
+The filter is designed by sampling :math:`H_c(f) \\, \\mathrm{bp}(f)` at
+``n_taps`` frequencies and inverse transforming, so its frequency
+resolution is :math:`1/(n_{\\mathrm{taps}} \\Delta t)` and the center
+frequency is rounded to that resolution.  The impulse response is centered,
+and the output is shifted back by the filter's delay of
+:math:`(n_{\\mathrm{taps}} - 1)/2` points so that output point :math:`k`
+belongs to input point :math:`k`.
+
+Example::
+
+    D = StreamDemodulator(dt, bw=1.0, dt_chunk_target=250E-6)
+    for out in D.demodulate(blocks):   # blocks: any iterable of arrays
+        save(out.x_fit, out.f_fit)
+
+or, pushing the data in as it arrives::
+
+    out = D.process(y_block)
+    ...
+    out = D.flush()
+
+For a carrier that drifts farther than a fixed bandpass filter is wide,
+the :class:`PLLTracker` follows the signal with a software phase-locked
+loop instead, block by block in the same way::
+
+    P = PLLTracker(dt, bw=0.1, order=2)
+    for out in P.track(blocks):
+        save(out.x, out.f, out.a)
+
+"""
+
+from __future__ import division, print_function, absolute_import
+import math
+import cmath
+from collections import namedtuple
+import numpy as np
+from scipy.signal import firwin, upfirdn
+from freqdemod import fftbackend
+from freqdemod.demodulate import _hilbert_filter, _bandpass_filter
+from freqdemod.demodulate import _fit_phase_chunks
+from freqdemod.util import next_fast_len
+
+PLLBlock = namedtuple('PLLBlock', ['x', 'z', 'p', 'a', 'f'])
+PLLBlock.__doc__ = """
+The phase-locked loop output for each loop update completed in one block:
+the time ``x`` [s] at the middle of the update, the complex signal ``z``,
+phase ``p`` [cyc], and amplitude ``a`` measured there, and the frequency
+``f`` [cyc/s] of the loop's oscillator after the update.
+"""
+
+DemodBlock = namedtuple('DemodBlock', ['x', 'z', 'p', 'f', 'x_fit', 'f_fit'])
+DemodBlock.__doc__ = """
+One block of demodulator output: the time ``x`` [s], complex signal ``z``,
+phase ``p`` [cyc], and instantaneous frequency ``f`` [cyc/s] of each point,
+and the time ``x_fit`` [s] and frequency ``f_fit`` [cyc/s] of each phase
+chunk completed in this block.
+"""
+
+class StreamDemodulator(object):
+
+    def __init__(self, dt, bw, fc=None, order=50, style="brick wall",
+                 n_taps=None, block=None, dt_chunk_target=None, t0=0.0):
+        """
+        Set up a streaming demodulator with
+
+        :param float dt: the time per point [s]
+        :param float bw: bandpass filter bandwidth [kHz]
+        :param float fc: bandpass filter center frequency [kHz]; if None,
+            use the peak of the spectrum of the first ``n_fft`` points
+        :param int order: bandpass filter order (defaults to 50)
+        :param str style: "brick wall" (default), "cosine", or "gaussian"
+        :param int n_taps: filter length [points], made odd; defaults to
+            about :math:`16/\\Delta f` long
+        :param int block: new points filtered per FFT; defaults to
+            ``4*n_taps``.  The output latency is one block.
+        :param float dt_chunk_target: the target chunk duration [s] for the
+            phase fits; if None, only the point-by-point frequency is
+            computed
+        :param float t0: the time of the first point [s]
+        """
+
+        if n_taps is None:
+            n_taps = 2*int(math.ceil(8.0/(1E3*bw*dt))) + 1
+        n_taps = int(n_taps) | 1
+        if block is None:
+            block = 4*n_taps
+
+        self.dt = dt
+        self.bw = bw
+        self.fc = fc
+        self.order = order
+        self.style = style
+        self.n_taps = n_taps
+        self.block = int(block)
+        self.n_fft = next_fast_len(self.block + n_taps - 1)
+        self.delay = (n_taps - 1)//2
+        self.dt_chunk_target = dt_chunk_target
+        self.t0 = t0
+        self.H = None
+
+        if dt_chunk_target is not None:
+            self.n_per_chunk = int(round(dt_chunk_target/dt))
+        else:
+            self.n_per_chunk = None
+
+        self.reset()
+
+    def reset(self):
+        """Forget the signal seen so far, keeping the filter."""
+
+        self._pending = []
+        self._n_pending = 0
+        self._history = np.zeros(self.n_taps - 1)
+        self._n_in = 0
+        self._n_out = 0
+        self._to_drop = self.delay
+        self._p_last = None
+        self._chunk_x = np.zeros(0)
+        self._chunk_p = np.zeros(0)
+
+    def design(self, fc=None):
+        """
+        Compute the filter's transform, of length ``n_fft``, for center
+        frequency ``fc`` [kHz].
+        """
+
+        if fc is not None:
+            self.fc = fc
+
+        M = self.n_taps
+        freq = np.fft.fftshift(np.fft.fftfreq(M, self.dt))/1E3
+        i_c = np.argmin(abs(freq - self.fc))
+        self.fc = freq[i_c]
+
+        filt = (_hilbert_filter(freq)
+                *_bandpass_filter(freq, i_c, self.bw, self.order, self.style))
+
+        # Centered impulse response, zero padded to the FFT length
+
+        h = np.fft.fftshift(fftbackend.ifft(np.fft.ifftshift(filt)))
+        self.H = fftbackend.fft(h, n=self.n_fft)
+
+    def _estimate_fc(self, y):
+        """The frequency [kHz] of the largest peak in the spectrum of ``y``."""
+
+        spectrum = abs(fftbackend.rfft(np.blackman(y.size)*y))
+        freq = np.fft.rfftfreq(y.size, self.dt)/1E3
+        return freq[1 + np.argmax(spectrum[1:])]
+
+    def _filter(self, y):
+        """Overlap-save filter the next ``y.size <= block`` points."""
+
+        buf = np.zeros(self.n_fft, dtype=np.result_type(y, self._history))
+        n_hist = self._history.size
+        buf[0:n_hist] = self._history
+        buf[n_hist:n_hist + y.size] = y
+        self._history = buf[y.size:y.size + n_hist].copy()
+
+        z = fftbackend.ifft(fftbackend.fft(buf)*self.H)
+        return z[n_hist:n_hist + y.size]
+
+    def _output(self, z):
+        """Phase, frequency, and chunk fits for the filtered points ``z``."""
+
+        # Drop the points produced before the first delayed input point
+
+        drop = min(self._to_drop, z.size)
+        z = z[drop:]
+        self._to_drop -= drop
+
+        x = self.t0 + self.dt*(self._n_out + np.arange(z.size))
+        self._n_out += z.size
+
+        # Unwrap against the last phase of the previous block
+
+        if self._p_last is None:
+            p_rad = np.unwrap(np.angle(z))
+            p_prev = p_rad[0:1]/(2*np.pi)
+            f_first = np.array([np.nan])
+        else:
+            p_rad = np.unwrap(np.concatenate([[self._p_last], np.angle(z)]))[1:]
+            p_prev = np.array([self._p_last/(2*np.pi)])
+            f_first = None
+        if z.size > 0:
+            self._p_last = p_rad[-1]
+        p = p_rad/(2*np.pi)
+
+        f = np.diff(np.concatenate([p_prev, p]))/self.dt
+        if f_first is not None and f.size > 0:
+            f[0] = f_first[0]
+
+        # Fit the phase in whole chunks, carrying the remainder over
+
+        if self.n_per_chunk is not None:
+            cx = np.concatenate([self._chunk_x, x])
+            cp = np.concatenate([self._chunk_p, p])
+            n_total = self.n_per_chunk*(cp.size//self.n_per_chunk)
+            if n_total > 0:
+                x_fit, f_fit = _fit_phase_chunks(cx[0:n_total], cp[0:n_total],
+                                                 self.dt, self.n_per_chunk)
+            else:
+                x_fit, f_fit = np.zeros(0), np.zeros(0)
+            self._chunk_x = cx[n_total:]
+            self._chunk_p = cp[n_total:]
+        else:
+            x_fit, f_fit = None, None
+
+        return DemodBlock(x, z, p, f, x_fit, f_fit)
+
+    def process(self, y):
+        """
+        Add the points ``y`` to the stream.  Return a :class:`DemodBlock`
+        holding the output for every input block completed, or None if no
+        block was completed.
+        """
+
+        y = np.asarray(y)
+        self._pending.append(y)
+        self._n_pending += y.size
+        self._n_in += y.size
+
+        if self.H is None:
+            if self.fc is None and self._n_pending < self.n_fft:
+                return None
+            y_all = np.concatenate(self._pending)
+            self._pending = [y_all]
+            if self.fc is None:
+                self.fc = self._estimate_fc(y_all[0:self.n_fft])
+            self.design()
+
+        if self._n_pending < self.block:
+            return None
+
+        y_all = np.concatenate(self._pending)
+        n_blocks = y_all.size//self.block
+        z = [self._filter(y_all[k*self.block:(k+1)*self.block])
+             for k in range(n_blocks)]
+        rest = y_all[n_blocks*self.block:]
+        self._pending = [rest]
+        self._n_pending = rest.size
+
+        return self._output(np.concatenate(z))
+
+    def flush(self):
+        """
+        Filter the points still waiting and push the last ``delay`` points
+        through the filter.  Return the final :class:`DemodBlock`, or None
+        if there is nothing left, and reset the stream.
+        """
+
+        if self._n_in == 0:
+            return None
+
+        y_all = np.concatenate(self._pending)
+        if self.H is None:
+            if self.fc is None:
+                self.fc = self._estimate_fc(y_all)
+            self.design()
+
+        y_all = np.concatenate([y_all, np.zeros(self.delay, dtype=y_all.dtype)])
+        z = [self._filter(y_all[k:k+self.block])
+             for k in range(0, y_all.size, self.block)]
+        z = np.concatenate(z)[0:self._n_in - self._n_out + self._to_drop]
+
+        out = self._output(z)
+        self.reset()
+        return out
+
+    def demodulate(self, blocks):
+        """
+        Demodulate the iterable of point blocks ``blocks``; a generator of
+        :class:`DemodBlock` outputs.
+        """
+
+        for y in blocks:
+            out = self.process(y)
+            if out is not None:
+                yield out
+        out = self.flush()
+        if out is not None:
+            yield out
+
+def demodulate_stream(blocks, dt, bw, **kwargs):
+    """
+    Demodulate the iterable of point blocks ``blocks``; a generator of
+    :class:`DemodBlock` outputs.  See :class:`StreamDemodulator` for the
+    parameters.
+    """
+
+    return StreamDemodulator(dt, bw, **kwargs).demodulate(blocks)
+
+class PLLTracker(object):
+
+    # The loop filter gains, as multiples of powers of the loop's natural
+    # frequency, for first, second, and third order loops
+
+    _GAINS = {1: (1.0, 0.0, 0.0),
+              2: (math.sqrt(2.0), 1.0, 0.0),
+              3: (2.4, 1.1, 1.0)}
+
+    def __init__(self, dt, bw, fc=None, order=2, decimate=None, t0=0.0,
+                 n_estimate=2**14):
+        """
+        Set up a software phase-locked loop with
+
+        :param float dt: the time per point [s]
+        :param float bw: the loop bandwidth [kHz], the natural frequency
+            :math:`\\omega_0/2\\pi` of the loop
+        :param float fc: the reference frequency [kHz] the signal is mixed
+            down from, and the loop oscillator's starting frequency; if
+            None, use the peak of the spectrum of the first ``n_estimate``
+            points.  For an (N, n) stack of signals, one per signal.
+        :param int order: the loop order, 1, 2 (default), or 3.  A first
+            order loop follows a change in frequency with a constant phase
+            lag, a second order loop with no phase lag, and a third order
+            loop follows a steadily drifting frequency with no phase lag.
+        :param int decimate: the number of points per loop update; defaults
+            to :math:`1/(20 \\: \\omega_0 \\Delta t)`, so that the loop
+            updates many times per loop time constant, or to
+            :math:`1/(f_c \\Delta t)`, one update per carrier period, if
+            that is fewer points
+        :param float t0: the time of the first point [s]
+        :param int n_estimate: the number of points used to estimate ``fc``
+
+        The signal is first mixed down by a fixed oscillator at ``fc``,
+        :math:`\\exp(-2 \\pi \\imath f_c t)`, and low-pass filtered and
+        decimated in one polyphase FIR pass, as in :meth:`Signal.lockin`.
+        The filter, a Blackman-windowed sinc about 11 carrier periods long,
+        has its cutoff at :math:`f_c/2`; it removes the :math:`2 f_c` image
+        and any offset in the signal and passes the carrier as it drifts up
+        to :math:`f_c/4` away from ``fc``.  At each update, the angle of the
+        filtered signal relative to the loop oscillator is the phase error
+        :math:`e` [cyc], and twice its magnitude is the signal's amplitude.
+        The oscillator's frequency offset from ``fc`` is steered by the loop
+        filter, with gains :math:`K_1 = b \\: \\omega_0`,
+        :math:`K_2 = a \\: \\omega_0^2`, and :math:`K_3 = \\omega_0^3` and
+        update time :math:`T`, ::
+
+            r = r + K3 e T
+            f_int = f_int + (K2 e + r) T
+            f = f_int + K1 e
+            phase = phase + f T
+
+        with :math:`(b, a) = (1, 0)`, :math:`(\\sqrt{2}, 1)`, or
+        :math:`(2.4, 1.1)` for first, second, or third order loops.  The
+        oscillator's phase is aligned with the signal's at the first update.
+        The filter sits outside the loop, so its delay does not slow the
+        loop down; the outputs are labelled with the time at the middle of
+        the filter.
+        """
+
+        if order not in self._GAINS:
+            raise ValueError("Unrecognized loop order {0}; use 1, 2,"
+                             " or 3".format(order))
+
+        self.dt = dt
+        self.bw = bw
+        self.fc = fc
+        self.order = order
+        self.decimate = decimate
+        self.t0 = t0
+        self.n_estimate = n_estimate
+
+        w0 = 2*np.pi*1E3*bw
+        b, a, c = self._GAINS[order]
+        self.K1, self.K2, self.K3 = b*w0, a*w0**2, c*w0**3
+
+        self.h = None
+        if fc is not None:
+            self._design()
+
+        self.reset()
+
+    def _design(self):
+        """Choose the decimation and design the filter, once ``fc`` is known."""
+
+        fc = np.asarray(self.fc, dtype=float)
+        if self.decimate is None:
+            D_loop = int(round(1.0/(40*np.pi*1E3*self.bw*self.dt)))
+            D_carrier = int(1.0/(1E3*fc.max()*self.dt))
+            self.decimate = max(1, min(D_loop, D_carrier))
+        D = self.decimate = int(self.decimate)
+        self.T = D*self.dt
+
+        n_taps = int(math.ceil(11.0/(1E3*fc.min()*self.dt)))
+        self.K = K = max(1, int(math.ceil((n_taps - 1)/(2.0*D))))
+        self.h = firwin(2*D*K + 1, 0.5E3*fc.min(), window='blackman',
+                        fs=1.0/self.dt)
+
+    def reset(self):
+        """Forget the signal seen so far, and unlock the loop."""
+
+        self._pending = []
+        self._n_pending = 0
+        self._n_in = 0
+        self._buf = None
+        self._s0 = 0
+        self._state = None
+
+    def _estimate_fc(self, y):
+        """The frequency [kHz] of the largest peak in the spectrum of ``y``."""
+
+        spectrum = abs(fftbackend.rfft(np.blackman(y.shape[-1])*y))
+        freq = np.fft.rfftfreq(y.shape[-1], self.dt)/1E3
+        return freq[1 + np.argmax(spectrum[..., 1:], axis=-1)]
+
+    def _mix(self, y):
+        """Mix the next points ``y`` down by the fixed oscillator at ``fc``."""
+
+        n = self._n_in + np.arange(y.shape[-1])
+        f_dt = 1E3*self.dt*np.asarray(self.fc, dtype=float)[..., np.newaxis]
+        self._n_in += y.shape[-1]
+        return y*np.exp(-2j*np.pi*np.mod(f_dt*n, 1.0))
+
+    def _filter(self, y):
+        """
+        Add the points ``y`` to the mixed signal, and return the filtered
+        signal at every update whose filter span is complete, with the
+        index of the point at the middle of each, or None.
+        """
+
+        D, K = self.decimate, self.K
+        u = self._mix(y)
+        if self._buf is not None:
+            u = np.concatenate([self._buf, u], axis=-1)
+
+        # Update i ends on point i D of the buffer, which starts on a whole
+        # update, and spans 2 D K + 1 points
+
+        i_last = (u.shape[-1] - 1)//D
+        if i_last < 2*K:
+            self._buf = u
+            return None
+
+        v = upfirdn(self.h, u[..., 0:i_last*D + 1], down=D, axis=-1)
+        v = 2*v[..., 2*K:i_last + 1]
+        n_mid = self._s0 + D*(np.arange(2*K, i_last + 1) - K)
+
+        n_keep = (i_last + 1 - 2*K)*D
+        self._buf = u[..., n_keep:]
+        self._s0 = self._s0 + n_keep
+
+        return v, n_mid
+
+    def _track(self, v, n_mid):
+        """Run the loop over the filtered signal ``v``."""
+
+        rows = v.reshape(-1, v.shape[-1])
+        if self._state is None:
+            self._state = [None]*rows.shape[0]
+
+        K1, K2, K3, T = self.K1, self.K2, self.K3, self.T
+        dp = np.empty(rows.shape)
+        df = np.empty(rows.shape)
+
+        for m, row in enumerate(rows):
+            if self._state[m] is None:
+                phase = cmath.phase(row[0])/(2*np.pi)
+                f_int, f, r = 0.0, 0.0, 0.0
+            else:
+                phase, f_int, f, r = self._state[m]
+
+            for k, v_k in enumerate(row.tolist()):
+                e = cmath.phase(v_k*cmath.exp(-2j*math.pi*phase))/(2*math.pi)
+                dp[m, k] = phase + e
+                r = r + K3*e*T
+                f_int = f_int + (K2*e + r)*T
+                f = f_int + K1*e
+                df[m, k] = f
+                phase = phase + f*T
+
+            self._state[m] = (phase, f_int, f, r)
+
+        # Add the fixed oscillator back to the phase and frequency
+
+        fc = 1E3*np.asarray(self.fc, dtype=float)[..., np.newaxis]
+        p = dp.reshape(v.shape) + fc*self.dt*n_mid
+        f = df.reshape(v.shape) + fc
+        a = abs(v)
+        x = self.t0 + self.dt*n_mid
+
+        return PLLBlock(x, a*np.exp(2j*np.pi*p), p, a, f)
+
+    def process(self, y):
+        """
+        Add the points ``y`` to the stream; for a stack of signals, the
+        points are along the last axis.  Return a :class:`PLLBlock` holding
+        the output of every loop update completed, or None if none was
+        completed.
+        """
+
+        y = np.asarray(y)
+        if self.fc is None:
+            self._pending.append(y)
+            self._n_pending += y.shape[-1]
+            if self._n_pending < self.n_estimate:
+                return None
+            y = np.concatenate(self._pending, axis=-1)
+            self._pending = []
+            self._n_pending = 0
+            self.fc = self._estimate_fc(y[..., 0:self.n_estimate])
+        if self.h is None:
+            self._design()
+
+        out = self._filter(y)
+        if out is None:
+            return None
+        return self._track(*out)
+
+    def flush(self):
+        """
+        Return a :class:`PLLBlock` for the updates still waiting -- if
+        ``fc`` has not yet been estimated, estimate it from the points
+        received -- or None, and reset the loop.  The last points, whose
+        filter span is incomplete, are dropped.
+        """
+
+        out = None
+        if self.fc is None and self._n_pending > 0:
+            y_all = np.concatenate(self._pending, axis=-1)
+            self._pending = []
+            self._n_pending = 0
+            self.fc = self._estimate_fc(y_all)
+            out = self.process(y_all)
+        self.reset()
+        return out
+
+    def track(self, blocks):
+        """
+        Track the iterable of point blocks ``blocks``; a generator of
+        :class:`PLLBlock` outputs.
+        """
+
+        for y in blocks:
+            out = self.process(y)
+            if out is not None:
+                yield out
+        out = self.flush()
+        if out is not None:
+            yield out
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+Tests for the batch module.  Each test writes a few small signal files to a
+temporary directory and works them up with the batch runner.
+
+"""
+from __future__ import division, print_function, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from numpy.testing import assert_array_equal
+from freqdemod.demodulate import Signal
+from freqdemod import batch
+
+
+class BatchTests(unittest.TestCase):
+
+    recipe = [('demodulate', {'bw': 1.00, 'tw': 3E-3, 'td': 15E-3,
+                              'dt_chunk_target': 221.34E-6})]
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.dt = dt = 1/50.0E3
+        t = dt*np.arange(6000)
+        self.f0 = [2.00E3, 2.20E3, 2.40E3]
+
+        for k, f0 in enumerate(self.f0):
+            s = Signal(os.path.join(self.dir, 'run{0}.h5'.format(k)),
+                       backing_store=True)
+            s.load_nparray(np.sin(2*np.pi*f0*t), "x", "nm", dt)
+            s.close()
+
+    def expected(self, k):
+        s = Signal()
+        s.load_hdf5(os.path.join(self.dir, 'run{0}.h5'.format(k)))
+        s.demodulate(1.00, 3E-3, 15E-3, 221.34E-6)
+        y = s.f['workup/fit/y'][:]
+        s.close()
+        return y
+
+    def test_output_dir(self):
+        """Batch: one output file per input file"""
+
+        out = os.path.join(self.dir, 'out')
+        report = batch.run(os.path.join(self.dir, 'run*.h5'), self.recipe,
+                           output_dir=out, workers=2, progress=False)
+        self.assertEqual((report.n_files, report.n_ok), (3, 3))
+        self.assertEqual(report.n_samples, 3*6000)
+        self.assertTrue(report.samples_per_s > 0)
+
+        with h5py.File(os.path.join(out, 'run1.h5'), 'r') as fh:
+            assert_array_equal(fh['workup/fit/y'][:], self.expected(1))
+            self.assertTrue('y' in fh)
+
+    def test_output_file(self):
+        """Batch: one group per input file in a consolidated file"""
+
+        out = os.path.join(self.dir, 'fits.h5')
+        report = batch.run(os.path.join(self.dir, 'run*.h5'), self.recipe,
+                           output_file=out, save='fit_phase_no_s',
+                           workers=1, progress=False)
+        self.assertEqual(report.n_ok, 3)
+
+        with h5py.File(out, 'r') as fh:
+            self.assertEqual(sorted(fh.keys()), ['run0', 'run1', 'run2'])
+            assert_array_equal(fh['run2/workup/fit/y'][:], self.expected(2))
+            self.assertFalse('run2/y' in fh)
+
+    def test_failures(self):
+        """Batch: missing files and files over the memory budget fail"""
+
+        missing = os.path.join(self.dir, 'missing.h5')
+        report = batch.run([os.path.join(self.dir, 'run0.h5'), missing],
+                           self.recipe, output_file=os.path.join(
+                               self.dir, 'fits.h5'),
+                           workers=1, progress=False)
+        self.assertEqual(report.n_ok, 1)
+        self.assertEqual(report.failures[0][0], missing)
+
+        report = batch.run(os.path.join(self.dir, 'run*.h5'), self.recipe,
+                           output_file=os.path.join(self.dir, 'fits.h5'),
+                           memory_budget=6000, progress=False)
+        self.assertEqual(report.n_ok, 0)
+        self.assertTrue('MemoryError' in report.failures[0][1])
+
+    def test_bad_recipe(self):
+        """Batch: unknown workup steps are an error"""
+
+        with self.assertRaises(ValueError):
+            batch.run('*.h5', [('fft_fast', {})], output_dir=self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
@@ -16,11 +16,17 @@ Tests for the demodulate module.
 #    def test_that_fails():
 #
 
-from freqdemod.demodulate import Signal
+from freqdemod.demodulate import Signal, SignalBatch, demodulate_array
+from freqdemod.demodulate import fit_exp_decay, _exp_decay_guess
+from freqdemod.demodulate import _fit_phase_chunks, _fit_phase_sliding
+from freqdemod import fftbackend
+from freqdemod.cache import ArrayCache, filter_cache, window_cache
 from freqdemod.hdf5 import update_attrs
 from freqdemod.util import silent_remove
 from freqdemod.util import nearest2power
+from freqdemod.util import next_fast_len, prev_fast_len
 import unittest
+import json
 import numpy as np
 from numpy.testing import assert_allclose, assert_array_equal
 import h5py
@@ -112,7 +118,7 @@ class MaskTests(unittest.TestCase):
         """Binarate mask middle; test length is 2^n"""
         
         self.s.time_mask_binarate("middle")
-        m = self.s.f['workup/time/mask/binarate']
+        m = self.s.mask_array('workup/time/mask/binarate')
 
         self.assertEqual(np.count_nonzero(m),32*1024)    
         
@@ -120,7 +126,7 @@ class MaskTests(unittest.TestCase):
         """Binarate mask start; test length is 2^n"""
         
         self.s.time_mask_binarate("start")
-        m = self.s.f['workup/time/mask/binarate']
+        m = self.s.mask_array('workup/time/mask/binarate')
 
         self.assertEqual(np.count_nonzero(m),32*1024)   
         
@@ -128,10 +134,113 @@ class MaskTests(unittest.TestCase):
         """Binarate mask end test length is 2^n"""
         
         self.s.time_mask_binarate("end")
-        m = self.s.f['workup/time/mask/binarate']
+        m = self.s.mask_array('workup/time/mask/binarate')
 
         self.assertEqual(np.count_nonzero(m),32*1024)   
  
+    def load_61000(self):
+        """Replace the signal with one whose length is not 5-smooth"""
+
+        self.s.f.close()
+        self.s = Signal()
+        self.s.load_nparray(np.arange(61000),"x","nm",10E-6)
+
+    def test_binarate_trim(self):
+        """Binarate mask trim; test length is the largest 5-smooth length"""
+        
+        self.load_61000()
+        self.s.time_mask_binarate("middle", length="trim")
+        m = self.s.mask_array('workup/time/mask/binarate')
+
+        self.assertEqual(np.count_nonzero(m), 60750)  # 2 3^5 5^3
+        self.assertEqual(self.s.f['workup/time/x_binarated'].size, 60750)
+
+    def test_binarate_pad(self):
+        """Binarate mask pad; keep every point and pad to a 5-smooth length"""
+        
+        self.load_61000()
+        self.s.time_mask_binarate("middle", length="pad")
+        m = self.s.f['workup/time/mask/binarate']
+
+        self.assertEqual(np.count_nonzero(self.s.mask_array(m.name)), 61000)
+        self.assertEqual(m.attrs['n_pad'], 440)  # 61440 = 2^12 3 5
+        x = self.s.f['workup/time/x_binarated'][:]
+        self.assertEqual(x.size, 61440)
+        assert_allclose(np.diff(x), 10E-6)
+
+    def test_binarate_pad_workup(self):
+        """Binarate mask pad; window, fft, and rippleless mask skip the padding"""
+
+        self.load_61000()
+        self.s.time_mask_binarate("middle", length="pad")
+        self.s.time_window_cyclicize(1E-3)
+        self.s.fft()
+        self.s.time_mask_rippleless(1E-3)
+
+        w = self.s.f['workup/time/window/cyclicize'][:]
+        self.assertEqual(w.size, 61440)
+        self.assertTrue((w[61000:] == 0).all())
+        self.assertEqual(self.s.f['workup/freq/FT'].size, 61440)
+        m = self.s.mask_array('workup/time/mask/rippleless')
+        self.assertEqual(np.count_nonzero(m), 61000 - 2*100)
+        self.assertFalse(m[61000 - 100:].any())
+
+    def test_binarate_pad_ifft(self):
+        """Binarate mask pad; with no rippleless mask, ifft drops the padding"""
+
+        dt = 10E-6
+        y = np.sin(2*np.pi*2.0E3*dt*np.arange(61000))
+        self.s.f.close()
+        self.s = Signal()
+        self.s.load_nparray(y, "x", "nm", dt)
+        self.s.time_mask_binarate("middle", length="pad")
+        self.s.time_window_cyclicize(1E-3)
+        self.s.fft()
+        self.s.freq_filter_Hilbert_complex()
+        self.s.freq_filter_bp(1.0)
+        self.s.ifft()
+
+        for name in ['z', 'p', 'a']:
+            dset = self.s.f['workup/time/' + name]
+            self.assertEqual(dset.shape, (61000,))
+            self.assertEqual(dset.attrs['abscissa'], 'x')
+        assert_allclose(self.s.f['workup/time/a'][1000:-1000], 1.0, rtol=1E-3)
+
+        x_fit, f_fit = demodulate_array(y, dt, 1.0, 1E-3, None, 1E-3,
+                                        length="pad")
+        self.assertEqual(x_fit.size, 610)
+        self.assertTrue(x_fit[-1] < 61000*dt)
+
+        self.s.sweep_bandpass([1.0], dt_chunk_target=1E-3)
+        self.assertTrue(self.s.f['workup/sweep/x'][-1] < 61000*dt)
+
+    def test_binarate_range(self):
+        """Binarate mask middle; stored as a range, not a boolean array"""
+
+        self.s.time_mask_binarate("middle")
+        m = self.s.f['workup/time/mask/binarate']
+
+        self.assertEqual(m.attrs['start'], (60000 - 32*1024)//2)
+        self.assertEqual(m.attrs['stop'] - m.attrs['start'], 32*1024)
+        self.assertFalse(hasattr(m, 'shape'))
+        assert_array_equal(self.s.f['workup/time/x_binarated'][:],
+                           self.s.f['x'][m.attrs['start']:m.attrs['stop']])
+
+    def test_boolean_mask_dataset(self):
+        """A boolean mask dataset, as saved by earlier versions, still works"""
+
+        mask = np.zeros(60000, dtype=bool)
+        mask[100:59900] = True
+        dset = self.s.f.create_dataset('workup/time/mask/binarate', data=mask)
+        dset.attrs['abscissa'] = 'x'
+        self.s.time_window_cyclicize(1E-3)
+        self.s.fft()
+
+        self.assertEqual(self.s.f['workup/time/window/cyclicize'].size, 59800)
+        self.assertEqual(self.s.f['workup/freq/FT'].size, 59800)
+        assert_array_equal(self.s.mask_array('workup/time/mask/binarate'),
+                           mask)
+
     def test_binarate_4(self):
         """If we have not called binarate, then workup/time/mask/binarate does not exist"""
         
@@ -207,6 +316,162 @@ class FFTTests(unittest.TestCase):
             pass                
 
 
+class IFFTOutputTests(unittest.TestCase):
+    """
+    Choosing the ifft outputs, their type, and chunked phase unwrapping.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 1/50.0E3
+        t = dt*np.arange(4096)
+        self.y = np.sin(2*np.pi*5.0E3*t) + 0.1*np.random.normal(0, 1, t.size)
+        self.ref = self.workup()
+        self.ref.ifft()
+
+    def workup(self):
+        s = Signal(store='numpy')
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(10*self.dt)
+        s.fft()
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(2.0)
+        s.time_mask_rippleless(1E-3)
+        return s
+
+    def test_phase_only(self):
+        """IFFT outputs: store only the phase, unwrapped in chunks"""
+
+        s = self.workup()
+        s.ifft(outputs='p', chunk=100)
+        self.assertFalse(s.f.__contains__('workup/time/z'))
+        self.assertFalse(s.f.__contains__('workup/time/a'))
+        p = s.f['workup/time/p']
+        self.assertEqual(p.attrs['abscissa'], 'workup/time/x_rippleless')
+        assert_allclose(p[()], self.ref.f['workup/time/p'][()], rtol=0,
+                        atol=1E-9)
+        s.close()
+
+    def test_float32(self):
+        """IFFT outputs: store the phase and amplitude as float32"""
+
+        s = self.workup()
+        s.ifft(outputs=['p', 'a'], dtype=np.float32, chunk=1000)
+        for name in ['p', 'a']:
+            dset = s.f['workup/time/' + name]
+            self.assertEqual(dset.dtype, np.float32)
+            assert_allclose(dset[()], self.ref.f['workup/time/' + name][()],
+                            rtol=1E-6)
+        s.close()
+
+    def test_bad_output(self):
+        """IFFT outputs: reject an unknown output"""
+
+        s = self.workup()
+        self.assertRaises(ValueError, s.ifft, outputs=['p', 'f'])
+        s.close()
+
+    def tearDown(self):
+        self.ref.close()
+
+
+class WorkupGraphTests(unittest.TestCase):
+    """
+    Re-running workup stages: reuse unchanged output, recompute only the
+    stages downstream of a change.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 1/50.0E3
+        t = dt*np.arange(8192)
+        self.y = np.sin(2*np.pi*5.0E3*t) + 0.1*np.random.normal(0, 1, t.size)
+
+    def workup(self, bw=2.0, td=1E-3, store='numpy'):
+        s = Signal(store=store)
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(10*self.dt)
+        s.fft()
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(bw)
+        s.time_mask_rippleless(td)
+        s.ifft()
+        s.fit_phase(1E-3)
+        return s
+
+    def test_new_bandwidth(self):
+        """Workup graph: a new bandwidth reuses the FFT and redoes the rest"""
+
+        s = self.workup()
+        FT = s.f['workup/freq/FT']
+        mask = s.f['workup/time/mask/rippleless']
+        s.freq_filter_bp(1.0)
+
+        self.assertIs(s.f['workup/freq/FT'], FT)
+        self.assertIs(s.f['workup/time/mask/rippleless'], mask)
+        self.assertIn("Recompute ifft(), fit_phase() with the new output"
+                      " of freq_filter_bp().", s.report)
+
+        ref = self.workup(bw=1.0)
+        for name in ['workup/freq/filter/bp', 'workup/time/p', 'workup/fit/y']:
+            assert_array_equal(s.f[name][()], ref.f[name][()])
+        s.close()
+        ref.close()
+
+    def test_new_dead_time(self):
+        """Workup graph: a new dead time redoes the ifft, not the filters"""
+
+        s = self.workup(store='hdf5')
+        s.time_mask_rippleless(2E-3)
+
+        ref = self.workup(td=2E-3, store='hdf5')
+        for name in ['workup/time/x_rippleless', 'workup/time/a',
+                     'workup/fit/x', 'workup/fit/y']:
+            assert_array_equal(s.f[name][()], ref.f[name][()])
+        self.assertIn("Recompute ifft(), fit_phase() with the new output"
+                      " of time_mask_rippleless().", s.report)
+        self.assertFalse(any(line.startswith("Create a bandpass")
+                             for line in s.report[-4:]))
+        s.close()
+        ref.close()
+
+    def test_same_parameters(self):
+        """Workup graph: repeating a stage with the same parameters reuses it"""
+
+        s = self.workup()
+        p = s.f['workup/time/p']
+        s.freq_filter_bp(2.0, order=50)
+        s.ifft()
+
+        self.assertIs(s.f['workup/time/p'], p)
+        self.assertTrue(s.report[-1].startswith("Reuse workup/time/z"))
+        s.close()
+
+    def test_recorded_parameters(self):
+        """Workup graph: each stage records its parameters and inputs"""
+
+        s = self.workup()
+        attrs = s.f['workup/freq/filter/bp'].attrs
+
+        self.assertEqual(attrs['stage'], 'freq_filter_bp')
+        self.assertEqual(json.loads(attrs['stage_params']),
+                         {'bw': 2.0, 'order': 50, 'style': 'brick wall'})
+        self.assertEqual(json.loads(attrs['stage_inputs']),
+                         ['workup/freq/freq', 'workup/freq/FT',
+                          'workup/freq/filter/Hc'])
+        self.assertEqual(json.loads(
+            s.f['workup/time/p'].attrs['stage_params'])['dtype'], 'float64')
+
+        # lockin() writes the same datasets as ifft(); list each once
+
+        s.lockin(2.0)
+        self.assertEqual(json.loads(s.f['workup/fit/y'].attrs['stage_inputs']),
+                         ['workup/time/z', 'workup/time/p', 'workup/time/a',
+                          'workup/time/x_lockin'])
+        s.close()
+
 class FFTOddPoints(unittest.TestCase):
     def setUp(self):
         self.x = np.array([0, 1, 0, -1, 0, 1, 0, -1, 0])
@@ -226,6 +491,195 @@ class FFTOddPoints(unittest.TestCase):
         self.s.close()
 
 
+class RealFFTTests(unittest.TestCase):
+    """
+    The real-input FFT layout must give the same workup as the full layout.
+    """
+
+    def setUp(self):
+
+        fd = 50.0E3    # digitization frequency
+        f0 = 2.00E3    # signal frequency
+        nt = 6000      # number of signal points
+
+        dt = 1/fd
+        t = dt*np.arange(nt)
+        self.y = np.sin(2*np.pi*f0*t) + 0.01*np.random.normal(0, 1, t.size)
+
+        self.s = {}
+        for real in [False, True]:
+            s = Signal()
+            s.load_nparray(self.y, "x", "nm", dt)
+            s.time_mask_binarate("middle")
+            s.time_window_cyclicize(3E-3)
+            s.fft(real=real)
+            s.freq_filter_Hilbert_complex()
+            s.freq_filter_bp(bw=1.00)
+            s.time_mask_rippleless(15E-3)
+            s.ifft()
+            self.s[real] = s
+
+    def test_layout(self):
+        """Real FFT: only non-negative frequencies are stored"""
+
+        FT = self.s[True].f['workup/freq/FT']
+        self.assertEqual(FT.attrs['layout'], 'rfft')
+        self.assertEqual(FT.size, 4096//2 + 1)
+        self.assertTrue((self.s[True].f['workup/freq/freq'][:] >= 0).all())
+
+    def test_analytic_signal(self):
+        """Real FFT: same analytic signal as the full FFT"""
+
+        assert_allclose(self.s[True].f['workup/time/z'][:],
+                        self.s[False].f['workup/time/z'][:], atol=1E-12)
+
+    def test_psd(self):
+        """Real FFT: same power spectrum as the full FFT"""
+
+        for n in [8, 9]:
+            psd = {}
+            for real in [False, True]:
+                s = Signal()
+                s.load_nparray(self.y[0:n], "x", "nm", 1.0)
+                s.fft(psd=True, real=real)
+                psd[real] = s.f['workup/freq/FT'][:]
+                s.close()
+            assert_allclose(psd[True], psd[False], rtol=1E-12)
+
+    def test_ifft_odd_pts(self):
+        """Real FFT: without the Hilbert filter, recover the signal"""
+
+        x = np.array([0, 1, 0, -1, 0, 1, 0, -1, 0])
+        s = Signal()
+        s.load_nparray(x, 'x', 'nm', 1)
+        s.fft(real=True)
+        s.ifft()
+        assert_allclose(s.f['workup/time/z'][:].real, x, atol=1e-15)
+        s.close()
+
+    def tearDown(self):
+        for s in self.s.values():
+            s.close()
+
+
+class FFTBackendTests(unittest.TestCase):
+    """
+    Every FFT backend must give the same transforms.
+    """
+
+    def setUp(self):
+        self.x = np.random.normal(0, 1, 1000)
+
+    def test_scipy_workers(self):
+        """FFT backend: scipy with several workers matches numpy"""
+
+        with fftbackend.using('scipy', workers=2):
+            X = fftbackend.fft(self.x)
+            self.assertEqual(fftbackend.get_backend()['workers'], 2)
+        assert_allclose(X, np.fft.fft(self.x), atol=1E-10)
+        self.assertEqual(fftbackend.get_backend()['backend'], 'scipy')
+
+    def test_numpy_signal(self):
+        """FFT backend: Signal.fft and Signal.ifft use the chosen backend"""
+
+        z = {}
+        for backend in ['numpy', 'scipy']:
+            with fftbackend.using(backend):
+                s = Signal()
+                s.load_nparray(self.x, 'x', 'nm', 1E-6)
+                s.fft(real=True)
+                s.freq_filter_Hilbert_complex()
+                s.ifft()
+                z[backend] = s.f['workup/time/z'][:]
+                s.close()
+        assert_allclose(z['numpy'], z['scipy'], atol=1E-12)
+
+    def test_unknown(self):
+        """FFT backend: unknown backends are an error"""
+
+        with self.assertRaises(ValueError):
+            fftbackend.set_backend('fftpack')
+
+    @unittest.skipIf(fftbackend.pyfftw is None, "pyfftw is not installed")
+    def test_pyfftw_plan_cache(self):
+        """FFT backend: pyfftw plans are reused for same-length transforms"""
+
+        with fftbackend.using('pyfftw'):
+            X = fftbackend.rfft(self.x)
+            fftbackend.rfft(2*self.x)
+            info = fftbackend.plan_cache_info()
+        assert_allclose(X, np.fft.rfft(self.x), atol=1E-10)
+        self.assertEqual((info['hits'], info['misses']), (1, 1))
+
+
+class CacheTests(unittest.TestCase):
+    """
+    Same-length signals share the cached window and bandpass filter.
+    """
+
+    def setUp(self):
+        fd = 50.0E3    # digitization frequency
+        self.dt = dt = 1/fd
+        self.t = dt*np.arange(6000)
+        filter_cache.clear()
+        window_cache.clear()
+
+    def workup(self, f0, style="brick wall"):
+        s = Signal()
+        s.load_nparray(np.sin(2*np.pi*f0*self.t), "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(3E-3)
+        s.fft()
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(bw=1.00, style=style)
+        return s
+
+    def test_hits(self):
+        """Cache: a second signal reuses the window and filter"""
+
+        for f0 in [2.00E3, 2.50E3]:
+            self.workup(f0).close()
+        self.assertEqual(filter_cache.info()['misses'], 1)
+        self.assertEqual(filter_cache.info()['hits'], 1)
+        self.assertEqual(window_cache.info()['hits'], 1)
+
+    def test_shifted_filter(self):
+        """Cache: the shifted template equals the filter computed directly"""
+
+        for style in ["brick wall", "gaussian"]:
+            s = self.workup(2.50E3, style)
+            freq = s.f['workup/freq/freq'][:]
+            bp = s.f['workup/freq/filter/bp'][:]
+            Hc = s.f['workup/freq/filter/Hc'][:]
+            fc = freq[np.argmax(Hc*abs(s.f['workup/freq/FT'][:]))]
+            self.assertAlmostEqual(fc, 2.50, delta=0.02)
+            if style == "brick wall":
+                direct = 1.0/(1.0 + np.power(abs(freq - fc)/1.00, 50))
+            else:
+                direct = np.exp(-np.power((freq - fc)/1.00, 2.0))
+            assert_allclose(bp, direct, rtol=1E-10, atol=1E-300)
+            s.close()
+
+    def test_memory_cap(self):
+        """Cache: the least recently used array is discarded at the cap"""
+
+        cache = ArrayCache(max_bytes=2*8*100)
+        for key in ['a', 'b', 'a', 'c']:
+            cache.get(key, lambda: np.zeros(100))
+        info = cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+                         (1, 3, 2))
+        self.assertTrue(info['nbytes'] <= info['max_bytes'])
+        cache.get('b', lambda: np.zeros(100))
+        self.assertEqual(cache.info()['misses'], 4)
+        with self.assertRaises(ValueError):
+            cache.get('a', lambda: np.zeros(100))[0] = 1.0
+
+    def tearDown(self):
+        filter_cache.clear()
+        window_cache.clear()
+
+
 class HDF5LoadGeneral(unittest.TestCase):
     filename = '.general_format_h5_file.h5'
 
@@ -409,6 +863,736 @@ class SaveBeforeWorkupTest(unittest.TestCase):
         self.s.close()
 
 
+class ArrayStoreWorkupTests(unittest.TestCase):
+    """
+    The numpy-array store must give the same workup as the hdf5 store.
+    """
+
+    filename = '.ArrayStoreWorkupTests.h5'
+
+    def setUp(self):
+
+        fd = 50.0E3    # digitization frequency
+        f0 = 2.00E3    # signal frequency
+        nt = 6000      # number of signal points
+
+        dt = 1/fd
+        t = dt*np.arange(nt)
+        y = np.sin(2*np.pi*f0*t) + 0.01*np.random.normal(0, 1, t.size)
+
+        self.s_h5 = Signal()
+        self.s_np = Signal(store='numpy')
+
+        for s in [self.s_h5, self.s_np]:
+            s.load_nparray(y, "x", "nm", dt)
+            s.time_mask_binarate("middle")
+            s.time_window_cyclicize(3E-3)
+            s.fft()
+            s.freq_filter_Hilbert_complex()
+            s.freq_filter_bp(bw=1.00, style="cosine")
+            s.time_mask_rippleless(15E-3)
+            s.ifft()
+            s.fit_phase(221.34E-6)
+
+    def test_copies_input(self):
+        """Array store: changing the loaded array leaves the signal alone"""
+
+        y = np.zeros(16)
+        for store in ['hdf5', 'numpy']:
+            s = Signal(store=store)
+            s.load_nparray(y, "x", "nm", 1E-6)
+            y[0] = 99
+            self.assertEqual(s.f['y'][0], 0.0)
+            y[0] = 0
+            s.close()
+
+    def test_same_workup(self):
+        """Array store: every dataset matches the hdf5 store"""
+
+        for name in ['workup/time/x_binarated', 'workup/freq/FT',
+                     'workup/freq/filter/bp', 'workup/time/p',
+                     'workup/fit/x', 'workup/fit/y']:
+            assert_array_equal(self.s_np.f[name][()], self.s_h5.f[name][()])
+            self.assertEqual(dict(self.s_np.f[name].attrs),
+                             dict(self.s_h5.f[name].attrs))
+
+    def test_save(self):
+        """Array store: save() materializes the workup into hdf5"""
+
+        f_dst = h5py.File('.test_array_store.h5', mode='w-',
+                          driver='core', backing_store=False)
+        self.s_np.save(f_dst, 'fit_phase')
+        assert_array_equal(f_dst['workup/fit/y'][:],
+                           self.s_np.f['workup/fit/y'][()])
+        self.assertEqual(f_dst['workup/fit/y'].attrs['unit'], 'cyc/s')
+        self.assertEqual(f_dst.attrs['source'], 'demodulate.py')
+        f_dst.close()
+
+    def test_close(self):
+        """Array store: close() writes the file when backing_store=True"""
+
+        s = Signal(self.filename, mode='w', backing_store=True, store='numpy')
+        s.load_nparray(np.arange(4), "x", "nm", 1E-6)
+        s.close()
+
+        with h5py.File(self.filename, 'r') as f:
+            assert_array_equal(f['y'][:], np.arange(4))
+            self.assertEqual(f['x'].attrs['step'], 1E-6)
+            self.assertTrue('Array store' in f.attrs['report'])
+
+    def tearDown(self):
+        self.s_h5.close()
+        self.s_np.close()
+        silent_remove(self.filename)
+
+
+class FusedDemodulateTests(unittest.TestCase):
+    """
+    The one-call demodulator must reproduce the staged workup exactly.
+    """
+
+    def setUp(self):
+
+        fd = 50.0E3    # digitization frequency
+        f0 = 2.00E3    # signal frequency
+        nt = 6000      # number of signal points
+
+        self.dt = dt = 1/fd
+        t = dt*np.arange(nt)
+        self.y = np.sin(2*np.pi*f0*t) + 0.01*np.random.normal(0, 1, t.size)
+
+        self.s = Signal()
+        self.s.load_nparray(self.y, "x", "nm", dt)
+
+    def staged(self, style):
+
+        s = Signal()
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(3E-3)
+        s.fft()
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(bw=1.00, style=style)
+        s.time_mask_rippleless(15E-3)
+        s.ifft()
+        s.fit_phase(221.34E-6)
+        return s
+
+    def test_identical(self):
+        """Fused demodulate: identical to the staged workup"""
+
+        for style in ["brick wall", "cosine", "gaussian"]:
+            s = self.staged(style)
+            x, f = demodulate_array(self.y, self.dt, 1.00, 3E-3, 15E-3,
+                                    221.34E-6, style=style)
+            assert_array_equal(x, s.f['workup/fit/x'][:])
+            assert_array_equal(f, s.f['workup/fit/y'][:])
+            s.close()
+
+    def test_identical_real(self):
+        """Fused demodulate: identical to the staged workup with a real FFT"""
+
+        s = Signal()
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(3E-3)
+        s.fft(real=True)
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(bw=1.00)
+        s.time_mask_rippleless(15E-3)
+        s.ifft()
+        s.fit_phase(221.34E-6)
+
+        x, f = demodulate_array(self.y, self.dt, 1.00, 3E-3, 15E-3,
+                                221.34E-6, real=True)
+        assert_array_equal(f, s.f['workup/fit/y'][:])
+        s.close()
+
+    def test_identical_pad(self):
+        """Fused demodulate: identical to the staged workup with zero padding"""
+
+        y = self.y[0:5990]  # not 5-smooth
+
+        for length in ["trim", "pad"]:
+            s = Signal()
+            s.load_nparray(y, "x", "nm", self.dt)
+            s.time_mask_binarate("middle", length=length)
+            s.time_window_cyclicize(3E-3)
+            s.fft(real=True)
+            s.freq_filter_Hilbert_complex()
+            s.freq_filter_bp(bw=1.00)
+            s.time_mask_rippleless(15E-3)
+            s.ifft()
+            s.fit_phase(221.34E-6)
+
+            x, f = demodulate_array(y, self.dt, 1.00, 3E-3, 15E-3,
+                                    221.34E-6, real=True, length=length)
+            assert_array_equal(x, s.f['workup/fit/x'][:])
+            assert_array_equal(f, s.f['workup/fit/y'][:])
+            assert_allclose(f, 2.00E3, rtol=1E-2)
+            s.close()
+
+    def test_signal_demodulate(self):
+        """Fused demodulate: only the fit is written to the file"""
+
+        self.s.demodulate(1.00, 3E-3, 15E-3, 221.34E-6, style="cosine")
+        self.assertTrue('workup/fit/y' in self.s.f)
+        self.assertFalse('workup/freq' in self.s.f)
+        self.assertFalse('workup/time' in self.s.f)
+        assert_allclose(self.s.f['workup/fit/y'][:], 2.00E3, rtol=1E-2)
+
+    def tearDown(self):
+        self.s.close()
+
+
+class SignalBatchTests(unittest.TestCase):
+    """
+    Each row of a SignalBatch must be worked up exactly as a lone Signal.
+    """
+
+    def setUp(self):
+
+        fd = 50.0E3                             # digitization frequency
+        f0 = np.array([2.00E3, 2.30E3, 1.80E3]) # signal frequencies
+        nt = 6000                               # number of signal points
+
+        self.dt = dt = 1/fd
+        t = dt*np.arange(nt)
+        self.f0 = f0
+        self.Y = (np.sin(2*np.pi*f0[:, np.newaxis]*t)
+                  + 0.01*np.random.normal(0, 1, (f0.size, t.size)))
+
+    def workup(self, s, real):
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(3E-3)
+        s.fft(real=real)
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(bw=1.00)
+        s.time_mask_rippleless(15E-3)
+        s.ifft()
+        s.fit_phase(221.34E-6)
+
+    def test_identical(self):
+        """SignalBatch: each row matches the single-signal workup"""
+
+        for real in [False, True]:
+            B = SignalBatch()
+            B.load_nparray(self.Y, "x", "nm", self.dt)
+            self.workup(B, real)
+            fit = B.f['workup/fit/y'][:]
+            self.assertEqual(fit.shape[0], 3)
+
+            for i in range(3):
+                s = Signal()
+                s.load_nparray(self.Y[i], "x", "nm", self.dt)
+                self.workup(s, real)
+                assert_array_equal(fit[i], s.f['workup/fit/y'][:])
+                assert_array_equal(B.f['workup/fit/x'][:],
+                                   s.f['workup/fit/x'][:])
+                s.close()
+            B.close()
+
+    def test_demodulate(self):
+        """SignalBatch: one-call demodulation with per-row center frequencies"""
+
+        B = SignalBatch(store='numpy')
+        B.load_nparray(self.Y, "x", "nm", self.dt)
+        B.demodulate(1.00, 3E-3, 15E-3, 221.34E-6)
+        fit = B.f['workup/fit/y'][()]
+        assert_allclose(fit.mean(axis=1), self.f0, rtol=1E-3)
+        self.assertEqual(B.f['y'].attrs['n_signals'], 3)
+        B.close()
+
+    def test_not_2d(self):
+        """SignalBatch: a 1-D signal is an error"""
+
+        B = SignalBatch()
+        with self.assertRaises(ValueError):
+            B.load_nparray(self.Y[0], "x", "nm", self.dt)
+        B.close()
+
+
+class SlidingFitTests(unittest.TestCase):
+    """
+    Overlapping-chunk phase fits must agree with fitting each chunk directly.
+    """
+
+    def setUp(self):
+
+        fd = 50.0E3    # digitization frequency
+        f0 = 2.00E3    # signal frequency
+        nt = 6000      # number of signal points
+
+        self.dt = dt = 1/fd
+        t = dt*np.arange(nt)
+        self.p = f0*t + 0.1*np.sin(2*np.pi*50*t) + 1E-3*np.random.normal(0, 1, nt)
+
+        self.s = Signal(store='numpy')
+        self.s.load_nparray(np.cos(2*np.pi*self.p), "x", "nm", dt)
+        self.s.f['workup/time/p'] = self.p
+        self.s.f['workup/time/p'].attrs['abscissa'] = 'x'
+
+    def test_hop_one(self):
+        """Sliding fit: one chunk per point matches a direct fit"""
+
+        self.s.fit_phase(220E-6, dt_hop_target=0)
+        x = self.s.f['workup/fit/x'][()]
+        y = self.s.f['workup/fit/y'][()]
+        self.assertEqual(y.size, 6000 - 11 + 1)
+        self.assertEqual(self.s.f['workup/fit/y'].attrs['n_hop'], 1)
+
+        t = self.s.f['x'][()]
+        for i in [0, 17, 2500, 5989]:
+            slope = np.polyfit(t[i:i+11] - t[i], self.p[i:i+11], 1)[0]
+            self.assertAlmostEqual(y[i], slope, delta=1E-6*abs(slope))
+            self.assertAlmostEqual(x[i], np.mean(t[i:i+11]), places=12)
+
+    def test_hop_chunk(self):
+        """Sliding fit: a hop of one chunk matches the non-overlapping fit"""
+
+        self.s.fit_phase(220E-6, dt_hop_target=220E-6)
+        y = self.s.f['workup/fit/y'][()]
+
+        s = Signal(store='numpy')
+        s.load_nparray(np.cos(2*np.pi*self.p), "x", "nm", self.dt)
+        s.f['workup/time/p'] = self.p
+        s.f['workup/time/p'].attrs['abscissa'] = 'x'
+        s.fit_phase(220E-6)
+        assert_allclose(y, s.f['workup/fit/y'][()], rtol=1E-9)
+        assert_allclose(self.s.f['workup/fit/x'][()], s.f['workup/fit/x'][()])
+        s.close()
+
+    def test_long_chirp(self):
+        """Sliding fit: keeps its precision on a long, drifting record"""
+
+        dt = 1E-6
+        x = dt*np.arange(10**7)
+        for drift, n in [(100.0, 250), (1.0E3, 10)]:
+            p = 50.0E3*x + 0.5*drift*x**2
+            x_fit, f_fit = _fit_phase_sliding(x, p, dt, n, n)
+            x_chunk, f_chunk = _fit_phase_chunks(x, p, dt, n)
+            assert_allclose(x_fit, x_chunk, rtol=1E-12)
+            assert_allclose(f_fit, f_chunk, rtol=0, atol=1E-3)
+
+    def test_multi(self):
+        """Sliding fit: each resolution matches its own fit_phase call"""
+
+        self.s.fit_phase_multi([100E-6, 220E-6, 221E-6, 1E-3])
+        self.assertEqual(sorted(self.s.f['workup/fit/multi'].keys()),
+                         ['11', '5', '50'])
+
+        for n in [5, 11, 50]:
+            s = Signal(store='numpy')
+            s.load_nparray(np.cos(2*np.pi*self.p), "x", "nm", self.dt)
+            s.f['workup/time/p'] = self.p
+            s.f['workup/time/p'].attrs['abscissa'] = 'x'
+            s.fit_phase(n*self.dt)
+            group = 'workup/fit/multi/{0}'.format(n)
+            assert_allclose(self.s.f[group + '/y'][()],
+                            s.f['workup/fit/y'][()], rtol=1E-9)
+            assert_allclose(self.s.f[group + '/x'][()],
+                            s.f['workup/fit/x'][()])
+            self.assertEqual(self.s.f[group + '/y'].attrs['abscissa'],
+                             group + '/x')
+            s.close()
+
+    def test_multi_long_chirp(self):
+        """Sliding fit: fit_phase_multi matches fit_phase on a long chirp"""
+
+        dt = 1E-6
+        x = dt*np.arange(10**7)
+        p = 50.0E3*x + 0.5*100.0*x**2
+
+        fits = []
+        for multi in [True, False]:
+            s = Signal(store='numpy')
+            s.load_nparray(np.zeros(1), "x", "nm", dt)
+            s.f['workup/time/p'] = p
+            s.f['workup/time/p'].attrs['abscissa'] = 'workup/time/x_p'
+            s.f['workup/time/x_p'] = x
+            if multi == True:
+                s.fit_phase_multi([250E-6])
+                fits.append(s.f['workup/fit/multi/250/y'][()])
+            else:
+                s.fit_phase(250E-6)
+                fits.append(s.f['workup/fit/y'][()])
+            s.close()
+        assert_allclose(fits[0], fits[1], rtol=0, atol=1E-3)
+
+    def tearDown(self):
+        self.s.close()
+
+
+class StabilityTests(unittest.TestCase):
+    """
+    Allan deviation and frequency-noise spectrum of white frequency noise.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 1E-4
+        self.sigma = 2.0                                # [cyc/s]
+        f = 1.00E3 + self.sigma*np.random.normal(0, 1, 2**16)
+        p = np.concatenate([[0.0], np.cumsum(f*dt)])
+
+        self.s = Signal(store='numpy')
+        self.s.load_nparray(np.cos(2*np.pi*p), "x", "nm", dt)
+        self.s.f['workup/time/p'] = p
+        self.s.f['workup/time/p'].attrs['abscissa'] = 'x'
+        self.s.fit_phase(10*dt)
+
+    def test_adev(self):
+        """Stability: ADEV of white frequency noise falls as 1/sqrt(tau)"""
+
+        self.s.stability(tau=[self.dt, 10*self.dt, 100*self.dt])
+        tau = self.s.f['workup/stability/tau'][()]
+        adev = self.s.f['workup/stability/adev'][()]
+        assert_allclose(tau, [1E-4, 1E-3, 1E-2])
+        assert_allclose(adev, self.sigma/np.sqrt([1, 10, 100]), rtol=0.1)
+
+        m = 10
+        p = self.s.f['workup/time/p'][()]
+        d = [p[k+2*m] - 2*p[k+m] + p[k] for k in range(p.size - 2*m)]
+        self.assertAlmostEqual(adev[1], np.sqrt(np.mean(np.square(d))
+                                                /(2*(m*self.dt)**2)))
+
+    def test_default_tau(self):
+        """Stability: default averaging times are log spaced and unique"""
+
+        self.s.stability(n_tau=30)
+        tau = self.s.f['workup/stability/tau'][()]
+        self.assertTrue(np.all(np.diff(tau) > 0))
+        self.assertTrue(2*tau[-1]/self.dt < self.s.f['workup/time/p'].size)
+        self.assertEqual(self.s.f['workup/stability/adev_n'][0],
+                         self.s.f['workup/time/p'].size - 2)
+
+    def test_psd(self):
+        """Stability: the frequency-noise spectrum of white noise is flat"""
+
+        self.s.stability()
+        psd = self.s.f['workup/stability/psd'][()]
+        f_fit = self.s.f['workup/fit/y'][()]
+        dt_fit = 10*self.dt
+        assert_allclose(np.mean(psd[1:]), np.var(f_fit)*dt_fit, rtol=0.1)
+        assert_allclose(np.mean(psd[1:100]), np.mean(psd[-100:]), rtol=0.3)
+
+    def test_short(self):
+        """Stability: no usable tau is an error; one chunk skips the spectrum"""
+
+        with self.assertRaises(ValueError):
+            self.s.stability(tau=[1E-9])
+
+        self.s.fit_phase(4.0)
+        self.assertEqual(self.s.f['workup/fit/y'].size, 1)
+        self.s.stability(tau=[self.dt])
+        self.assertTrue(self.s.f.__contains__('workup/stability/adev'))
+        self.assertFalse(self.s.f.__contains__('workup/stability/psd'))
+
+    def tearDown(self):
+        self.s.close()
+
+
+class SweepBandpassTests(unittest.TestCase):
+    """
+    Sweeping the bandpass filter over a shared spectrum.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 1/50.0E3
+        t = dt*np.arange(8192)
+        self.y = np.sin(2*np.pi*5.0E3*t) + 0.1*np.random.normal(0, 1, t.size)
+
+    def workup(self, real=False):
+        s = Signal(store='numpy')
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle")
+        s.time_window_cyclicize(10*self.dt)
+        s.fft(real=real)
+        s.freq_filter_Hilbert_complex()
+        return s
+
+    def staged(self, bw, style, real=False):
+        s = self.workup(real)
+        s.freq_filter_bp(bw, style=style)
+        s.time_mask_rippleless(1E-3)
+        s.ifft()
+        s.fit_phase(1E-3)
+        return s.f['workup/fit/x'][()], s.f['workup/fit/y'][()]
+
+    def test_matches_staged_workup(self):
+        """Sweep: each configuration matches the staged workup"""
+
+        for real in [False, True]:
+            s = self.workup(real)
+            s.sweep_bandpass([1.0, 2.0], styles=["brick wall", "gaussian"],
+                             td=1E-3, dt_chunk_target=1E-3)
+            style = s.f['workup/sweep/style'][()]
+            assert_array_equal(s.f['workup/sweep/bw'][()], [1, 1, 2, 2])
+            assert_array_equal(style, [b"brick wall", b"gaussian"]*2)
+            for k, bw in enumerate(s.f['workup/sweep/bw'][()]):
+                x, y = self.staged(bw, style[k].decode(), real)
+                assert_array_equal(s.f['workup/sweep/x'][()], x)
+                assert_allclose(s.f['workup/sweep/y'][k], y, rtol=1E-12)
+                assert_allclose(s.f['workup/sweep/f_mean'][k], y.mean(),
+                                rtol=1E-12)
+                assert_allclose(s.f['workup/sweep/f_std'][k], y.std(),
+                                rtol=1E-9)
+            s.close()
+
+    def test_threads_and_metrics(self):
+        """Sweep: a thread pool gives the same table; noise grows with bw"""
+
+        s = self.workup()
+        s.time_mask_rippleless(1E-3)
+        s.sweep_bandpass([0.5, 1.0, 4.0], dt_chunk_target=1E-3)
+        adev = s.f['workup/sweep/adev'][()]
+        f_mean = s.f['workup/sweep/f_mean'][()]
+
+        s.sweep_bandpass([0.5, 1.0, 4.0], dt_chunk_target=1E-3, workers=3)
+        assert_array_equal(s.f['workup/sweep/adev'][()], adev)
+        assert_allclose(f_mean, 5.0E3, rtol=1E-3)
+        self.assertTrue((np.diff(adev) > 0).all())
+        self.assertEqual(s.f['workup/sweep/adev'].attrs['abscissa'],
+                         'workup/sweep/bw')
+        s.close()
+
+    def test_batch(self):
+        """Sweep: a SignalBatch gets one metric per signal"""
+
+        B = SignalBatch(store='numpy')
+        B.load_nparray(np.array([self.y, -self.y]), "x", "nm", self.dt)
+        B.time_mask_binarate("middle")
+        B.sweep_bandpass([1.0, 2.0], td=1E-3, dt_chunk_target=1E-3)
+
+        self.assertEqual(B.f['workup/sweep/f_std'].shape, (2, 2))
+        self.assertEqual(B.f['workup/sweep/y'].shape[0:2], (2, 2))
+        assert_allclose(B.f['workup/sweep/f_mean'][:, 0],
+                        B.f['workup/sweep/f_mean'][:, 1], rtol=1E-9)
+        B.close()
+
+class LockinTests(unittest.TestCase):
+    """
+    Demodulating with the heterodyne-and-decimate lock-in.
+    """
+
+    def setUp(self):
+
+        self.dt = 1E-6
+        self.t = self.dt*np.arange(200003)     # not a fast FFT length
+        self.y = 2.0*np.cos(2*np.pi*50.0E3*self.t + 0.3)
+
+    def test_sine(self):
+        """Lock-in: a pure sine gives its amplitude and frequency"""
+
+        s = Signal(store='numpy')
+        s.load_nparray(self.y, "x", "nm", self.dt)
+        s.lockin(1.0, fc=49.8)
+        s.fit_phase(1E-3)
+
+        p = s.f['workup/time/p']
+        self.assertEqual(p.attrs['decimate'], 250)
+        self.assertEqual(p.attrs['abscissa'], 'workup/time/x_lockin')
+        x = s.f['workup/time/x_lockin'][()]
+        assert_allclose(np.diff(x), 250*self.dt)
+        self.assertTrue(x[0] > 0 and x[-1] < self.t[-1])
+        assert_allclose(s.f['workup/time/a'][()], 2.0, rtol=1E-4)
+        assert_allclose(s.f['workup/fit/y'][()], 50.0E3, rtol=1E-9)
+        s.close()
+
+    def test_matches_fft_path(self):
+        """Lock-in: agrees with the FFT workup and takes fc from the bandpass"""
+
+        y = self.y + 0.1*np.random.default_rng(6).normal(0, 1, self.y.size)
+        s = Signal(store='numpy')
+        s.load_nparray(y, "x", "nm", self.dt)
+        s.time_mask_binarate("middle", length="trim")
+        s.time_window_cyclicize(1E-3)
+        s.fft()
+        s.freq_filter_Hilbert_complex()
+        s.freq_filter_bp(1.0)
+        s.time_mask_rippleless(5E-3)
+        s.ifft()
+        s.fit_phase(10E-3)
+        f_fft = s.f['workup/fit/y'][()]
+
+        s.lockin(1.0)
+        self.assertEqual(s.f['workup/time/p'].attrs['fc'],
+                         s.f['workup/freq/filter/bp'].attrs['fc'])
+        f_lockin = s.f['workup/fit/y'][()]
+        self.assertEqual(s.f['workup/fit/x'].size, 19)
+        assert_allclose(f_lockin.mean(), f_fft.mean(), atol=0.5)
+        assert_allclose(f_lockin.std(), f_fft.std(), rtol=0.5)
+        s.close()
+
+    def test_batch(self):
+        """Lock-in: each signal of a SignalBatch gets its own fc"""
+
+        Y = np.array([self.y, 2.0*np.cos(2*np.pi*52.0E3*self.t)])
+        B = SignalBatch(store='numpy')
+        B.load_nparray(Y, "x", "nm", self.dt)
+        B.lockin(1.0)
+        B.fit_phase(1E-3)
+
+        f = B.f['workup/fit/y'][()]
+        self.assertEqual(B.f['workup/time/p'].attrs['fc'].shape, (2,))
+        assert_allclose(f[0], 50.0E3, rtol=1E-9)
+        assert_allclose(f[1], 52.0E3, rtol=1E-9)
+        B.close()
+
+class PLLTests(unittest.TestCase):
+    """
+    Storing the phase-locked loop's output in the workup.  The loop's
+    tracking is tested in test_stream.py.
+    """
+
+    def setUp(self):
+
+        self.dt = 1E-6
+        t = self.dt*np.arange(2**18)
+        self.s = Signal(store='numpy')
+        self.s.load_nparray(2.0*np.cos(2*np.pi*50.0E3*t + 0.3), "x", "nm",
+                            self.dt)
+
+    def test_layout(self):
+        """PLL: stores the loop output in the workup/time and workup/fit layout"""
+
+        self.s.pll(0.2, fc=50.0)
+
+        p = self.s.f['workup/time/p']
+        self.assertEqual(p.attrs['decimate'], 20)
+        self.assertEqual(p.attrs['abscissa'], 'workup/time/x_pll')
+        self.assertEqual(self.s.f['workup/fit/y'].attrs['order'], 2)
+        self.assertEqual(self.s.f['workup/fit/y'].attrs['abscissa'],
+                         'workup/fit/x')
+        assert_allclose(self.s.f['workup/fit/x'][()],
+                        self.s.f['workup/time/x_pll'][()])
+        self.assertEqual(self.s.f['workup/time/z'].shape, p.shape)
+        self.assertEqual(self.s.f['workup/time/a'].shape, p.shape)
+
+    def test_recompute(self):
+        """PLL: fit_phase() on the loop's phase is redone for a new bandwidth"""
+
+        self.s.pll(0.2, fc=50.0)
+        self.s.fit_phase(1E-3)
+        self.assertEqual(self.s.f['workup/fit/x'].size, 261)
+        assert_allclose(self.s.f['workup/fit/y'][()], 50.0E3, atol=1E-3)
+
+        self.s.pll(0.3, fc=50.0)
+        self.assertIn("Recompute fit_phase() with the new output of pll().",
+                      self.s.report)
+        self.assertEqual(self.s.f['workup/fit/x'].size, 261)
+
+    def tearDown(self):
+        self.s.close()
+
+class AmplitudeFitTests(unittest.TestCase):
+    """
+    Ringdown fits of an amplitude in nm decaying in ms.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 2E-5
+        x = dt*np.arange(2000)
+        self.a = 0.5*np.exp(-x/4E-3) + 0.02
+        self.s = Signal(store='numpy')
+        self.s.load_nparray(self.a, "x", "nm", dt)
+
+    def test_guess(self):
+        """Amplitude fit: the closed-form estimate is exact without noise"""
+
+        x = self.s.f['x'][()]
+        a0, tau, a1 = _exp_decay_guess(x, self.a)
+        assert_allclose([a0, tau, a1], [0.5, 4E-3, 0.02], rtol=1E-4)
+
+        a0, tau, a1 = _exp_decay_guess(x[500:], np.stack([self.a[500:],
+                                                          2*self.a[500:]]))
+        assert_allclose(tau, [4E-3, 4E-3], rtol=1E-4)
+        assert_allclose(a0, [0.5, 1.0], rtol=1E-4)
+
+    def test_fit(self):
+        """Amplitude fit: a noisy ringdown converges from the estimate"""
+
+        noise = 0.005*np.random.normal(0, 1, self.a.size)
+        self.s.f['workup/time/a'] = self.a + noise
+        self.s.f['workup/time/a'].attrs['abscissa'] = 'x'
+        self.s.f['workup/time/a'].attrs['unit'] = 'nm'
+        self.s.fit_amplitude()
+
+        attrs = self.s.f['workup/fit/exp'].attrs
+        for name, value in [('a0', 0.5), ('tau', 4E-3), ('a1', 0.02)]:
+            self.assertLess(abs(attrs[name] - value),
+                            5*attrs[name + '_stderr'])
+
+    def tearDown(self):
+        self.s.close()
+
+
+class BatchAmplitudeFitTests(unittest.TestCase):
+    """
+    Vectorized ringdown fits of a stack of noisy amplitude traces.
+    """
+
+    def setUp(self):
+
+        self.dt = dt = 2E-5
+        self.x = dt*np.arange(1500)
+        self.tau = np.array([1E-3, 4E-3, 9E-3, 2.5E-3])
+        self.a0 = np.array([0.5, 2.0, 0.1, 1.0])
+        self.Y = (self.a0[:, np.newaxis]*np.exp(-self.x/self.tau[:, np.newaxis])
+                  + 0.05 + 0.005*np.random.normal(0, 1, (4, self.x.size)))
+
+    def test_same_as_lmfit(self):
+        """Batch amplitude fit: the parameters and errors match lmfit's"""
+
+        values, y_calc = fit_exp_decay(self.x, self.Y)
+        self.assertTrue(np.all(values['converged']))
+        self.assertEqual(y_calc.shape, self.Y.shape)
+
+        for k in range(self.Y.shape[0]):
+            s = Signal(store='numpy')
+            s.load_nparray(self.Y[k], "x", "nm", self.dt)
+            s.f['workup/time/a'] = self.Y[k]
+            s.f['workup/time/a'].attrs['abscissa'] = 'x'
+            s.f['workup/time/a'].attrs['unit'] = 'nm'
+            s.fit_amplitude()
+            attrs = s.f['workup/fit/exp'].attrs
+            for name in ['a0', 'tau', 'a1']:
+                assert_allclose(values[name][k], attrs[name], rtol=1E-5)
+                assert_allclose(values[name + '_stderr'][k],
+                                attrs[name + '_stderr'], rtol=1E-3)
+            assert_allclose(y_calc[k], s.f['workup/fit/exp/y_calc'][()],
+                            rtol=1E-5)
+            s.close()
+
+    def test_signal_batch(self):
+        """Batch amplitude fit: SignalBatch stores one value per trace"""
+
+        B = SignalBatch(store='numpy')
+        B.load_nparray(self.Y, "x", "nm", self.dt)
+        B.f['workup/time/a'] = self.Y
+        B.f['workup/time/a'].attrs['abscissa'] = 'x'
+        B.f['workup/time/a'].attrs['unit'] = 'nm'
+        B.fit_amplitude()
+
+        attrs = B.f['workup/fit/exp'].attrs
+        self.assertEqual(attrs['ordinate'], 'workup/time/a')
+        for name in ['a0', 'tau', 'a1']:
+            self.assertEqual(attrs[name].shape, (4,))
+            self.assertEqual(attrs[name + '_stderr'].shape, (4,))
+        self.assertTrue(np.all(abs(attrs['tau'] - self.tau)
+                               < 5*attrs['tau_stderr']))
+        self.assertEqual(B.f['workup/fit/exp/y_calc'].shape, self.Y.shape)
+        self.assertEqual(B.f['workup/fit/exp/y_resid'].shape, self.Y.shape)
+        B.close()
+
+    def test_not_2d(self):
+        """Batch amplitude fit: reject a single trace"""
+
+        self.assertRaises(ValueError, fit_exp_decay, self.x, self.Y[0])
+
+
 class MiscTests(unittest.TestCase):
     
     def test_array_middle_1(self):
@@ -429,4 +1613,19 @@ class MiscTests(unittest.TestCase):
 class UtilTests(unittest.TestCase):
 
     def test_nearest2power(self):
-        self.assertEqual(nearest2power(1025), 1024) 
\ No newline at end of file
+        self.assertEqual(nearest2power(1025), 1024) 
+
+    def test_fast_len(self):
+        self.assertEqual(next_fast_len(97), 100)
+        self.assertEqual(prev_fast_len(97), 96)
+        self.assertEqual(prev_fast_len(1900000, smooth=7), 1890000)
+        self.assertEqual(next_fast_len(2**20), 2**20)
+        self.assertEqual(prev_fast_len(361, smooth=19), 361)
+        self.assertEqual(next_fast_len(221, smooth=17), 221)
+
+    def test_fast_len_smooth(self):
+        for smooth in (0, 1):
+            with self.assertRaises(ValueError):
+                next_fast_len(97, smooth=smooth)
+            with self.assertRaises(ValueError):
+                prev_fast_len(97, smooth=smooth)
\ No newline at end of file
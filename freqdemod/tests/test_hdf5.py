@@ -40,6 +40,8 @@ import datetime
 
 from freqdemod.util import silent_remove
 from freqdemod.hdf5 import (update_attrs)
+from freqdemod.hdf5.array_store import ArrayFile, ArrayGroup
+from freqdemod.hdf5.hdf5_util import copy_item, h5ls_str
 
 class Test_update_attrs(unittest.TestCase):
     """Test the helper function update_attrs"""
@@ -265,6 +267,48 @@ class Test_update_attrs_extended(unittest.TestCase):
         silent_remove(self.filename)
 
 
+class Test_array_store(unittest.TestCase):
+    """The array-backed store should index and copy like an h5py file."""
+
+    def setUp(self):
+        self.f = ArrayFile()
+        self.f['x'] = np.arange(4)
+        self.f['x'].attrs['unit'] = 's'
+        self.f.create_dataset('workup/time/p', data=0.5*np.arange(4))
+
+    def test_paths(self):
+        """Intermediate groups are created; leading slashes are ignored"""
+        self.assertTrue('workup/time' in self.f)
+        self.assertTrue('/workup/time/p' in self.f)
+        self.assertFalse('workup/freq' in self.f)
+        self.assertTrue(isinstance(self.f['workup'], ArrayGroup))
+        self.assertEqual(self.f['workup/time/p'].name, '/workup/time/p')
+
+    def test_no_overwrite(self):
+        """Creating an existing dataset is an error, as in h5py"""
+        with self.assertRaises(ValueError):
+            self.f.create_dataset('x', data=np.zeros(2))
+
+    def test_copy_to_h5py(self):
+        """Copying into an h5py file materializes data and attributes"""
+        g = h5py.File('.Test_array_store.h5', 'w', driver='core',
+                      backing_store=False)
+        copy_item(self.f, 'x', g, 'x')
+        copy_item(self.f, 'workup', g, 'workup')
+        assert_array_equal(g['x'][:], np.arange(4))
+        self.assertEqual(g['x'].attrs['unit'], 's')
+        assert_array_equal(g['workup/time/p'][:], 0.5*np.arange(4))
+
+        # ... and back again
+        h = ArrayFile()
+        copy_item(g, 'workup', h, 'w')
+        assert_array_equal(h['w/time/p'][()], 0.5*np.arange(4))
+        g.close()
+
+    def test_h5ls(self):
+        """List the contents of the store"""
+        self.assertTrue('/workup/time/p' in h5ls_str(self.f))
+
 
 if __name__ == '__main__':
 
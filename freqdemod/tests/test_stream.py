@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+Tests for the stream module.  The streaming demodulator must give the same
+output however the signal is broken into blocks, and that output must be
+the linear convolution of the signal with the filter.
+
+"""
+from __future__ import division, print_function, absolute_import
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from freqdemod import fftbackend
+from freqdemod.demodulate import demodulate_array
+from freqdemod.stream import StreamDemodulator, demodulate_stream, PLLTracker
+
+
+class StreamTests(unittest.TestCase):
+
+    def setUp(self):
+
+        fd = 50.0E3    # digitization frequency
+        f0 = 2.00E3    # signal frequency
+        nt = 20000     # number of signal points
+
+        self.dt = dt = 1/fd
+        t = dt*np.arange(nt)
+        self.y = np.sin(2*np.pi*f0*t) + 0.01*np.random.normal(0, 1, t.size)
+        cuts = np.sort(np.random.randint(0, nt, 25))
+        self.blocks = np.split(self.y, cuts)
+
+    def collect(self, outs, key):
+        return np.concatenate([getattr(out, key) for out in outs])
+
+    def test_convolution(self):
+        """Stream: output is the delay-corrected linear convolution"""
+
+        D = StreamDemodulator(self.dt, 1.00, style="cosine")
+        outs = list(D.demodulate(self.blocks))
+        z = self.collect(outs, 'z')
+
+        h = fftbackend.ifft(D.H)[0:D.n_taps]
+        z_direct = np.convolve(self.y, h)[D.delay:D.delay + self.y.size]
+        self.assertEqual(z.size, self.y.size)
+        assert_allclose(z, z_direct, atol=1E-10)
+        assert_allclose(self.collect(outs, 'x'),
+                        self.dt*np.arange(self.y.size))
+
+    def test_block_boundaries(self):
+        """Stream: phase is continuous however the signal is split"""
+
+        kwargs = dict(fc=2.00, dt_chunk_target=221.34E-6)
+        outs1 = list(demodulate_stream(self.blocks, self.dt, 1.00, **kwargs))
+        outs2 = list(demodulate_stream([self.y], self.dt, 1.00, **kwargs))
+
+        p1 = self.collect(outs1, 'p')
+        assert_allclose(p1, self.collect(outs2, 'p'), atol=1E-9)
+        self.assertTrue(np.all(abs(np.diff(p1)) < 0.5))
+        assert_allclose(self.collect(outs1, 'f_fit'),
+                        self.collect(outs2, 'f_fit'), rtol=1E-6)
+
+    def test_frequency(self):
+        """Stream: chunk frequencies agree with the whole-record workup"""
+
+        D = StreamDemodulator(self.dt, 1.00, dt_chunk_target=221.34E-6)
+        outs = list(D.demodulate(self.blocks))
+        self.assertAlmostEqual(D.fc, 2.00, delta=0.02)
+
+        x_fit, f_fit = demodulate_array(self.y, self.dt, 1.00, 3E-3, 15E-3,
+                                        221.34E-6, mode=None)
+        f_stream = self.collect(outs, 'f_fit')
+        self.assertEqual(f_stream.size, int(self.y.size/11))
+        assert_allclose(np.mean(f_stream[100:-100]), np.mean(f_fit),
+                        rtol=1E-4)
+
+
+class PLLTests(unittest.TestCase):
+    """
+    Tracking a drifting signal with the phase-locked loop.
+    """
+
+    def setUp(self):
+
+        self.dt = 1E-6
+        self.t = self.dt*np.arange(2**19)
+        self.R = 4.0E3                              # drift [Hz/s]
+        self.y = 2.0*np.cos(2*np.pi*(50.0E3*self.t
+                                     + 0.5*self.R*self.t**2) + 0.7)
+
+    def collect(self, outs, name):
+        return np.concatenate([getattr(out, name) for out in outs
+                               if out is not None], axis=-1)
+
+    def test_block_boundaries(self):
+        """PLL: the output does not depend on how the signal is split"""
+
+        P = PLLTracker(self.dt, 0.2, fc=50.0)
+        whole = P.process(self.y)
+        blocks = np.array_split(self.y, 37)
+        outs = list(PLLTracker(self.dt, 0.2, fc=50.0).track(blocks))
+
+        for name in ('x', 'p', 'a', 'f'):
+            assert_allclose(self.collect(outs, name), getattr(whole, name),
+                            rtol=1E-12, atol=1E-9)
+
+    def test_drift(self):
+        """PLL: a second-order loop follows a frequency ramp"""
+
+        P = PLLTracker(self.dt, 0.2, fc=50.0, order=2)
+        out = P.process(self.y)
+        self.assertEqual(P.decimate, 20)
+        assert_allclose(np.diff(out.x), 20*self.dt)
+
+        settled = out.x > 0.1
+        f_true = 50.0E3 + self.R*out.x[settled]
+        assert_allclose(out.f[settled], f_true, atol=5.0)
+        assert_allclose(out.a[settled], 2.0, rtol=1E-2)
+
+        p_true = (50.0E3*out.x + 0.5*self.R*out.x**2)[settled]
+        p_err = out.p[settled] - p_true
+        self.assertTrue(np.ptp(p_err) < 0.02)
+
+    def test_wide_loop(self):
+        """PLL: a wide loop rejects the 2 fc image and an offset"""
+
+        t = self.t[0:2**18]
+        y = 0.3 + np.cos(2*np.pi*50.0E3*t)
+        out = PLLTracker(self.dt, 1.0, fc=49.9).process(y)
+        self.assertEqual(out.x.size, 2**18//8 - 28)
+
+        settled = out.x > 0.02
+        self.assertTrue(np.std(out.f[settled]) < 0.1)
+        assert_allclose(out.f[settled], 50.0E3, atol=0.1)
+        assert_allclose(out.a[settled], 1.0, rtol=1E-4)
+
+    def test_order(self):
+        """PLL: loops of order 2 and 3 follow a ramp; order 1 does not"""
+
+        for order in (1, 2, 3):
+            out = PLLTracker(self.dt, 0.2, fc=50.0, order=order).process(self.y)
+            settled = out.x > 0.1
+            f_err = abs(out.f[settled] - 50.0E3 - self.R*out.x[settled]).max()
+            if order == 1:
+                self.assertTrue(f_err > 100.0)
+            else:
+                self.assertTrue(f_err < 5.0)
+
+    def test_estimate_fc(self):
+        """PLL: without fc, the loop starts from the spectrum's peak"""
+
+        P = PLLTracker(self.dt, 0.2)
+        outs = list(P.track(np.array_split(self.y, 100)))
+        self.assertAlmostEqual(P.fc, 50.0, delta=0.1)
+        f = self.collect(outs, 'f')
+        x = self.collect(outs, 'x')
+        assert_allclose(f[x > 0.1], 50.0E3 + self.R*x[x > 0.1], atol=5.0)
+
+    def test_stack(self):
+        """PLL: each signal in a stack is tracked independently"""
+
+        Y = np.array([self.y, np.cos(2*np.pi*52.0E3*self.t)])
+        out = PLLTracker(self.dt, 0.2).process(Y)
+        self.assertEqual(out.f.shape[0], 2)
+        assert_allclose(out.f[1, out.x > 0.1], 52.0E3, atol=5.0)
+        assert_allclose(out.a[1, out.x > 0.1], 1.0, rtol=1E-2)
+
+    def test_bad_order(self):
+        """PLL: an unsupported loop order is refused"""
+
+        with self.assertRaises(ValueError):
+            PLLTracker(self.dt, 0.2, order=4)
+
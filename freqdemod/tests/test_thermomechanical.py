@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+Tests for the thermomechanical module's oscillator simulators and power
+spectrum averaging.
+
+"""
+from __future__ import division, print_function, absolute_import
+import unittest
+from collections import OrderedDict
+import numpy as np
+from numpy.testing import assert_allclose
+from freqdemod.demodulate import Signal
+from freqdemod.hdf5 import update_attrs
+from freqdemod.thermomechanical import harmosc, solve, simulate, PSD
+from freqdemod.thermomechanical import brownian, brownian_jacobian
+
+
+class SimulateTests(unittest.TestCase):
+
+    def test_solve_euler(self):
+        """Simulate: solve() reproduces the step-by-step Euler integration"""
+
+        dtau, Q = 1/128, 50
+        F = np.random.normal(0, 1, 5000)
+        X0 = np.array([0.3, -0.2])
+
+        X = np.zeros([F.size, 2])
+        X[0] = X0
+        for n, f in enumerate(F[:-1]):
+            X[n+1, :] = X[n, :] + dtau * harmosc(X[n], Q, f)
+
+        assert_allclose(solve(X0, dtau, Q, F), X, atol=1E-10)
+        self.assertEqual(solve(X0, dtau, Q, np.zeros((3, 10))).shape,
+                         (3, 10, 2))
+
+    def test_simulate_variance(self):
+        """Simulate: steady-state variance is dtau Q / 2 at any step size"""
+
+        Q = 1000
+        for dtau in [1/64, 1.0]:
+            x, p = simulate(dtau, Q, 2000, M=500, rng=0)
+            self.assertEqual(x.shape, (500, 2000))
+            assert_allclose(np.var(x[:, 0]), dtau*Q/2, rtol=0.2)
+            assert_allclose(np.var(p[:, -1]), dtau*Q/2, rtol=0.2)
+
+    def test_simulate_ringdown(self):
+        """Simulate: with no noise, the free ringdown is exact"""
+
+        dtau, Q = 0.1, 20
+        x, p = simulate(dtau, Q, 1000, X0=[1.0, 0.0], rng=1)
+        self.assertEqual(x.shape, (1000,))
+        self.assertEqual(x[0], 1.0)
+
+        # The mean of many noisy realizations follows the free ringdown
+
+        xs, ps = simulate(dtau, Q, 200, M=4000, X0=[1.0, 0.0], rng=2)
+        tau = dtau*np.arange(200)
+        wd = np.sqrt(1 - 1/(4*Q**2))
+        x_free = np.exp(-tau/(2*Q))*(np.cos(wd*tau)
+                                     + np.sin(wd*tau)/(2*Q*wd))
+        assert_allclose(xs.mean(axis=0), x_free, atol=0.05)
+
+
+class WelchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dt = 1E-5
+        self.x = np.random.default_rng(3).normal(0, 2.0, 64*100 + 37)
+
+    def test_matches_load_signal(self):
+        """Welch: unwindowed, non-overlapping segments reproduce load_signal"""
+
+        n = 64
+        psd1 = PSD()
+        spectra = []
+        for k in range(100):
+            s = Signal()
+            s.load_nparray(self.x[k*n:(k+1)*n], "x", "pm", self.dt)
+            s.fft(psd=True)
+            spectra.append(s.f['workup/freq/FT'][()])
+            psd1.load_signal(s)
+            s.close()
+        psd1.flush()
+
+        psd2 = PSD.from_timeseries(self.x, self.dt, n, noverlap=0,
+                                   window='boxcar')
+
+        self.assertEqual(psd2.Navg, 100)
+        self.assertEqual(psd2.f['psd'].attrs['n_avg'], 100)
+        assert_allclose(psd2.f['freq'][()], psd1.f['freq'][()])
+        assert_allclose(psd2.f['psd'][()], psd1.f['psd'][()], rtol=1E-10)
+        assert_allclose(psd2.f['psd_std'][()],
+                        np.std(spectra, axis=0, ddof=1), rtol=1E-10)
+        assert_allclose(psd2.mean, psd1.mean, rtol=1E-10)
+
+    def test_update_blocks(self):
+        """Welch: streaming the series in uneven blocks gives the same average"""
+
+        psd1 = PSD.from_timeseries(self.x, self.dt, 128, store='numpy')
+
+        psd2 = PSD(store='numpy')
+        psd2.setup_welch(self.dt, 128)
+        for k in range(0, self.x.size, 300):
+            psd2.update(self.x[k:k+300])
+        self.assertFalse(psd2.f.__contains__('psd'))
+        psd2.flush()
+
+        self.assertEqual(psd2.Navg, (self.x.size - 128)//64 + 1)
+        self.assertEqual(psd2.Navg, psd1.Navg)
+        assert_allclose(psd2.f['psd'][()], psd1.f['psd'][()], rtol=1E-10)
+        assert_allclose(psd2.f['psd_std'][()], psd1.f['psd_std'][()],
+                        rtol=1E-8)
+
+    def test_white_noise_level(self):
+        """Welch: a Hann-windowed estimate of white noise is sigma^2 dt"""
+
+        psd = PSD.from_timeseries(self.x, self.dt, 256)
+        assert_allclose(psd.mean, 4.0*self.dt, rtol=0.05)
+
+    def test_bad_options(self):
+        """Welch: reject a bad overlap or window length"""
+
+        psd = PSD()
+        self.assertRaises(ValueError, psd.update, self.x)
+        self.assertRaises(ValueError, psd.setup_welch, self.dt, 64, 64)
+        self.assertRaises(ValueError, psd.setup_welch, self.dt, 64, 0,
+                          np.ones(32))
+
+
+class LoadSignalTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.psd = PSD()
+        self.spectra = []
+        for k in range(20):
+            s = Signal()
+            s.load_nparray(rng.normal(0, 1.0, 128), "x", "pm", 1E-5)
+            s.fft(psd=True)
+            self.spectra.append(s.f['workup/freq/FT'][()])
+            self.psd.load_signal(s)
+            s.close()
+
+    def tearDown(self):
+        self.psd.close()
+
+    def test_running_statistics(self):
+        """load_signal: the running mean and variance match numpy's"""
+
+        self.assertFalse(self.psd.f.__contains__('psd'))
+        assert_allclose(self.psd.mean, np.mean(self.spectra), rtol=1E-12)
+
+        self.psd.flush()
+        self.assertEqual(self.psd.f['psd'].attrs['n_avg'], 20)
+        self.assertEqual(self.psd.f['psd'].attrs['abscissa'], 'freq')
+        assert_allclose(self.psd.f['psd'][()],
+                        np.mean(self.spectra, axis=0), rtol=1E-12)
+        assert_allclose(self.psd.f['psd_std'][()],
+                        np.std(self.spectra, axis=0, ddof=1), rtol=1E-10)
+
+    def test_error_from_variance(self):
+        """load_signal: the fit uses the measured standard error of each bin"""
+
+        self.psd.flush()
+        y = self.psd.f['psd'][()]
+        yerr = np.std(self.spectra, axis=0, ddof=1)/np.sqrt(20)
+        assert_allclose(self.psd._psd_err(y), yerr, rtol=1E-10)
+
+
+def brownian_psd(p):
+    """A PSD averaging 64 exponentially distributed brownian spectra"""
+
+    rng = np.random.default_rng(5)
+    x = np.linspace(0.05, 400.0, 8000)
+    P = brownian(x, **p)*rng.exponential(size=(64, x.size))
+
+    psd = PSD()
+    psd.f['freq'] = x
+    psd.f['psd'] = P.mean(axis=0)
+    update_attrs(psd.f['psd'].attrs, OrderedDict([('name', 'FT(x)'),
+                                                  ('unit', 'pm^2/Hz'),
+                                                  ('abscissa', 'freq')]))
+    psd.f['psd_std'] = P.std(axis=0, ddof=1)
+    psd.Navg = 64
+    return psd
+
+
+class FitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.p = {'A': 1.0, 'tau0': 0.16, 'f0': 100.0, 'B': 1E-4}
+        self.psd = brownian_psd(self.p)
+
+    def tearDown(self):
+        self.psd.close()
+
+    def test_jacobian(self):
+        """Fit: the analytic Jacobian of brownian matches finite differences"""
+
+        f = np.linspace(90, 110, 21)
+        J = brownian_jacobian(f, **self.p)
+        for k, name in enumerate(['A', 'tau0', 'f0', 'B']):
+            h = 1E-6*self.p[name]
+            p1, p2 = dict(self.p), dict(self.p)
+            p1[name] += h
+            p2[name] -= h
+            dy = (brownian(f, **p1) - brownian(f, **p2))/(2*h)
+            assert_allclose(J[k], dy, rtol=1E-5, atol=1E-9*abs(dy).max())
+
+    def test_fit_options(self):
+        """Fit: the Jacobian and a windowed fit give the same parameters"""
+
+        r1 = self.psd.fitPx(jacobian=False)
+        r2 = self.psd.fitPx()
+        for name in ['A', 'tau0', 'f0', 'B']:
+            assert_allclose(r2.params[name].value, r1.params[name].value,
+                            rtol=1E-4)
+        self.assertLess(r2.nfev, r1.nfev)
+
+        r3 = self.psd.fitPx(n_linewidths=10, n_baseline_bins=20)
+        self.assertLess(r3.ndata, 1000)
+        self.assertEqual(self.psd.f['fit'].shape, (8000,))
+        for name in ['A', 'tau0', 'f0', 'B']:
+            self.assertLess(abs(r3.params[name].value - self.p[name]),
+                            4*r3.params[name].stderr)
+        assert_allclose(self.psd.valueU['Q'].magnitude,
+                        np.pi*self.p['f0']*self.p['tau0'], rtol=0.05)
+
+
+class RebinTests(unittest.TestCase):
+
+    def setUp(self):
+        self.p = {'A': 1.0, 'tau0': 0.16, 'f0': 100.0, 'B': 1E-4}
+        self.psd = brownian_psd(self.p)
+
+    def tearDown(self):
+        self.psd.close()
+
+    def test_rebin(self):
+        """Rebin: bins average the spectrum and count its averages"""
+
+        self.psd.rebin(bins=[0.0, 100.0, 400.0])
+        x = self.psd.f['freq'][()]
+        y = self.psd.f['psd'][()]
+        inside = x < 100.0
+
+        assert_allclose(self.psd.f['psd_binned'][()],
+                        [y[inside].mean(), y[~inside].mean()])
+        assert_allclose(self.psd.f['n_avg_binned'][()],
+                        [64*inside.sum(), 64*(~inside).sum()])
+        self.assertEqual(self.psd.f['psd_binned'].attrs['abscissa'],
+                         'freq_binned')
+
+        # The binned standard error combines the bins' errors in quadrature
+
+        yerr = self.psd.f['psd_std'][()]/8
+        err = (self.psd.f['psd_binned_std'][()]
+               /np.sqrt(self.psd.f['n_avg_binned'][()]))
+        assert_allclose(err[0], np.sqrt(np.sum(yerr[inside]**2))/inside.sum())
+
+        self.assertRaises(ValueError, self.psd.rebin, bins=[1.0, 0.5])
+
+    def test_fit_binned(self):
+        """Rebin: fitting the log-binned spectrum recovers the parameters"""
+
+        self.psd.rebin(n_bins=400)
+        n = self.psd.f['psd_binned'].size
+        self.assertLess(n, 400)
+        self.assertEqual(self.psd.f['n_avg_binned'][()].sum(), 64*8000)
+
+        r = self.psd.fitPx(binned=True)
+        self.assertEqual(r.ndata, n)
+        self.assertEqual(self.psd.f['fit_binned'].shape, (n,))
+        self.assertEqual(self.psd.f['fit'].shape, (8000,))
+        self.assertLess(r.redchi, 2.0)
+        for name in ['A', 'tau0', 'f0', 'B']:
+            self.assertLess(abs(r.params[name].value - self.p[name]),
+                            4*r.params[name].stderr)
@@ -14,8 +14,12 @@ spectrum.
 """
 from __future__ import division, print_function, absolute_import
 from scipy import integrate
+from scipy.signal import lfilter, get_window
+from scipy.linalg import expm, solve_discrete_lyapunov
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
+from freqdemod import fftbackend
 from freqdemod.demodulate import Signal
 from collections import OrderedDict
 from freqdemod.hdf5 import update_attrs
@@ -28,6 +32,10 @@ from lmfit import Parameters
 
 ureg = UnitRegistry()
 
+# The most segment points transformed at once by PSD.update
+
+_WELCH_BATCH_POINTS = 2**22
+
 def harmosc(X, Q, F):
     """
     Damped harmonic oscillator with random driving force.
@@ -37,12 +45,104 @@ def harmosc(X, Q, F):
     dotp = - x - (1 / Q) * p + F
     return np.array([dotx, dotp])
 
+def _state_filter(Phi, u):
+    """
+    Run the recurrence X[n] = Phi X[n-1] + u[n], with X[-1] = 0, for the
+    2-vector inputs ``u`` of shape (..., N, 2).  Each component of X obeys a
+    second-order linear recurrence with denominator
+    1 - tr(Phi) z^-1 + det(Phi) z^-2, so the recurrence is carried out by
+    ``scipy.signal.lfilter`` instead of a Python loop.  Return the position
+    and momentum, each of shape (..., N).
+    """
+
+    den = [1.0, -np.trace(Phi), np.linalg.det(Phi)]
+    u1 = u[..., 0]
+    u2 = u[..., 1]
+
+    x = (lfilter([1.0, -Phi[1, 1]], den, u1, axis=-1)
+         + lfilter([0.0, Phi[0, 1]], den, u2, axis=-1))
+    p = (lfilter([0.0, Phi[1, 0]], den, u1, axis=-1)
+         + lfilter([1.0, -Phi[0, 0]], den, u2, axis=-1))
+
+    return x, p
+
 def solve(X0, dtau, Q, F):
-    X = np.zeros([len(F), 2])
-    X[0] = X0
-    for n, f in enumerate(F[:-1]):
-        X[n+1, :] =  X[n, :] + dtau * harmosc(X[n], Q, f)
-    return X
+    """
+    Integrate the damped harmonic oscillator ``harmosc`` driven by the
+    random force ``F``, one force value per time step ``dtau``, with the
+    forward Euler method, starting from ``X0 = [x, p]``.  The Euler step is
+    linear, so it is applied with ``lfilter``.  If ``F`` has shape
+    (M, N), integrate M independent realizations.  Return ``X`` with shape
+    (N, 2), or (M, N, 2).
+    """
+
+    F = np.asarray(F, dtype=float)
+    Phi = np.array([[1.0, dtau],
+                    [-dtau, 1.0 - dtau/Q]])
+
+    u = np.zeros(F.shape + (2,))
+    u[..., 0, :] = X0
+    u[..., 1:, 1] = dtau * F[..., :-1]
+
+    x, p = _state_filter(Phi, u)
+    return np.stack([x, p], axis=-1)
+
+def simulate(dtau, Q, N, M=None, X0=None, rng=None):
+    """
+    Simulate thermal fluctuations of the damped harmonic oscillator
+    ``harmosc`` exactly, at time steps ``dtau`` (in units of the inverse
+    angular resonance frequency), with
+
+    :param float dtau: the time step
+    :param float Q: the quality factor
+    :param int N: the number of time steps
+    :param int M: the number of independent realizations; if None, one
+    :param X0: the initial ``[x, p]``; if None (default), draw the initial
+        state from the steady-state distribution, so no burn-in is needed
+    :param rng: a ``numpy.random.Generator``, or a seed
+
+    Unlike ``solve``, which takes an Euler step per random force value,
+    the state is advanced with the exact transition matrix
+    :math:`\\Phi = e^{A \\Delta\\tau}` and the exact covariance of the
+    random force integrated over a step, both computed with Van Loan's
+    matrix-exponential method.  The result is exact for any step size and
+    any :math:`Q`.  The force has the same strength as in ``solve`` -- a
+    white force of intensity ``dtau`` -- so the result is scaled to
+    physical units by ``thermconstants`` in the same way.
+
+    Return the position and momentum, each of shape (N,) or (M, N).
+    """
+
+    rng = np.random.default_rng(rng)
+    A = np.array([[0.0, 1.0],
+                  [-1.0, -1.0/Q]])
+    GGT = np.array([[0.0, 0.0],
+                    [0.0, dtau]])
+
+    # Van Loan: the exponential of [[-A, G G^T], [0, A^T]] dtau holds the
+    # transition matrix and the covariance of the integrated noise
+
+    VL = np.zeros((4, 4))
+    VL[0:2, 0:2] = -A
+    VL[0:2, 2:4] = GGT
+    VL[2:4, 2:4] = A.T
+    E = expm(VL*dtau)
+    Phi = E[2:4, 2:4].T
+    Qd = Phi.dot(E[0:2, 2:4])
+    Qd = 0.5*(Qd + Qd.T)
+    L = np.linalg.cholesky(Qd)
+
+    shape = (N,) if M is None else (M, N)
+    u = rng.standard_normal(shape + (2,)).dot(L.T)
+
+    if X0 is None:
+        P = solve_discrete_lyapunov(Phi, Qd)
+        u[..., 0, :] = rng.standard_normal(shape[:-1] + (2,)).dot(
+            np.linalg.cholesky(P).T)
+    else:
+        u[..., 0, :] = X0
+
+    return _state_filter(Phi, u)
 
 def thermconstants(T, k, f0, Q, dtau, verbose=False):
 
@@ -84,35 +184,116 @@ def brownian(f, A, tau0, f0, B):
     
     return (A*F0**2)/((F**2-F0**2)**2 + F**2) + B
 
+def brownian_jacobian(f, A, tau0, f0, B):
+    """
+    The partial derivatives of ``brownian`` with respect to its parameters
+    ``A``, ``tau0``, ``f0``, and ``B``, stacked in that order into an array
+    of shape (4, f.size).
+    """
+
+    F2 = (np.pi*tau0*f)**2
+    F02 = (np.pi*tau0*f0)**2
+    diff = F2 - F02
+    inv_D = 1/(diff**2 + F2)
+
+    J = np.empty((4,) + np.shape(f))
+    J[0] = F02*inv_D                                      # d/dA
+    G2 = 2*A*J[0]                                         # twice the peak term
+    J[1] = (G2/tau0)*(1 - (F2*(2*diff + 1) - 2*F02*diff)*inv_D)  # d/dtau0
+    J[2] = (G2/f0)*(1 + 2*F02*diff*inv_D)                 # d/df0
+    J[3] = 1                                              # d/dB
+
+    return J
+
+def _brownian_residual_jacobian(params, data, weights, f):
+    """
+    The Jacobian, one row per varied parameter, of the weighted residual
+    ``(data - brownian)*weights`` minimized by lmfit's ``Model.fit``.  The
+    rows are in the order the parameters were added to ``params``.
+    """
+
+    names = ['A', 'tau0', 'f0', 'B']
+    J = brownian_jacobian(f, *[params[name].value for name in names])
+    rows = [names.index(name) for name in params if params[name].vary]
+    J = J[rows]
+    J *= -weights
+    return J
+
+def _bin_average(x, y, yerr, edges):
+    """
+    Average the points ``(x, y)``, with standard errors ``yerr``, falling
+    between each pair of neighbouring ``edges``; as in ``np.histogram``, the
+    last bin includes its right edge.  Return the mean ``x``, the mean
+    ``y``, its standard error, and the number of points averaged for every
+    bin holding at least one point.
+    """
+
+    n_bins = edges.size - 1
+    k = np.digitize(x, edges) - 1
+    k[x == edges[-1]] = n_bins - 1
+    keep = (k >= 0) & (k < n_bins)
+    k = k[keep]
+
+    counts = np.bincount(k, minlength=n_bins)
+    x_sum = np.bincount(k, weights=x[keep], minlength=n_bins)
+    y_sum = np.bincount(k, weights=y[keep], minlength=n_bins)
+    var_sum = np.bincount(k, weights=yerr[keep]**2, minlength=n_bins)
+
+    full = counts > 0
+    counts = counts[full]
+    return (x_sum[full]/counts, y_sum[full]/counts,
+            np.sqrt(var_sum[full])/counts, counts)
+
 class PSD(object):
 
-    def __init__(self, filename=None, mode='w-', driver='core', backing_store=False):
+    def __init__(self, filename=None, mode='w-', driver='core', backing_store=False,
+                 store='hdf5'):
 
         """
         Copy the initialization routine from the Signal object.  Set the initial
-        number of averages and signal mean and standard deviation to zero.
+        number of averages to zero.
 
         """
 
-        Signal.__init__(self, filename, mode, driver, backing_store)
+        Signal.__init__(self, filename, mode, driver, backing_store, store)
         self.Navg = 0
-        self.mean = 0
-        self.std = 0
         self.fitted = False
-    
+        self._mean = None
+        self._M2 = None
+        self._psd_attrs = None
+        self._welch = None
+        self._dirty = False
+
+    @property
+    def mean(self):
+        """The averaged power spectrum, averaged over frequency."""
+        return self._mean.mean() if self.Navg > 0 else 0
+
+    @property
+    def std(self):
+        """The standard deviation over frequency of the averaged spectrum."""
+        return self._mean.std() if self.Navg > 0 else 0
+
     def close(self):
+        self.flush()
         Signal.close(self)
 
     def plot(self, ordinate, LaTeX=False, component='abs'):
         Signal.plot(self, ordinate, LaTeX, component)
         """Copy the generic plotting function from the Signal object."""
 
-    def plot_psd(self, LaTeX=False, x_scale='linear', y_scale='log'):
-        """Plot the power spectrum in `self.f['psd']`. """
+    def plot_psd(self, LaTeX=False, x_scale='linear', y_scale='log',
+                 binned=False):
+        """
+        Plot the power spectrum in `self.f['psd']`, or with ``binned=True``
+        the rebinned power spectrum in `self.f['psd_binned']`.
+        """
         
         # The x and y datasets
 
-        y = self.f['psd']
+        self.flush()
+        suffix = '_binned' if binned == True else ''
+        y = self.f['psd' + suffix]
         x = self.f[y.attrs['abscissa']]
 
         # Possibly use tex-formatted axes labels temporarily for this plot
@@ -139,10 +320,10 @@ class PSD(object):
         y = y[()]
         x = x[()]
 
-        if self.fitted:
+        if self.fitted and self.f.__contains__('fit' + suffix) == True:
 
-            yfit = self.f['fit'][()]
-            yerr = y/np.sqrt(self.Navg)
+            yfit = self.f['fit' + suffix][()]
+            yerr = self._psd_err(y, binned)
             resid = (yfit - y) / yerr
 
             fig, axs = plt.subplots(nrows=2, ncols=2, 
@@ -194,14 +375,139 @@ class PSD(object):
         plt.show()
         plt.rcParams['text.usetex'] = old_param
 
-    def fitPx(self, Temp=300):
-        """Fit thermal position fluctuations to theory to obtain the cantilever parameters."""
+    def _psd_err(self, y, binned=False):
+        """
+        The standard error of the averaged power spectrum ``y``: the measured
+        per-bin standard deviation in ``self.f['psd_std']`` divided by
+        :math:`\\sqrt{N_{\\mathrm{avg}}}`.  With a single spectrum, or a
+        bin whose spectra were all the same, fall back on the error
+        :math:`y/\\sqrt{N_{\\mathrm{avg}}}` expected of averaged periodograms.
+        With ``binned=True``, the same for the rebinned spectrum, using its
+        effective number of averages per bin.
+        """
+
+        if binned == True:
+            n = self.f['n_avg_binned'][()]
+            y_std = self.f['psd_binned_std'][()]
+            return np.where(y_std > 0, y_std/np.sqrt(n), y/np.sqrt(n))
+
+        yerr = y/np.sqrt(self.Navg)
+        if self.Navg > 1 and self.f.__contains__('psd_std') == True:
+            y_std = self.f['psd_std'][()]
+            yerr = np.where(y_std > 0, y_std/np.sqrt(self.Navg), yerr)
+        return yerr
+
+    def rebin(self, n_bins=1000, bins=None):
+        """
+        Average the power spectrum into log-spaced frequency bins, for
+        plotting and fitting on far fewer points.
+
+        :param int n_bins: the number of log-spaced bins between the lowest
+            nonzero frequency and the highest frequency (defaults to 1000)
+        :param bins: instead, the increasing bin edges [kHz]
+
+        Each bin's power is the mean of the spectrum's bins falling in it,
+        and its standard error combines theirs in quadrature.  A bin
+        averaging :math:`m` frequencies of a spectrum averaged
+        :math:`N_{\\mathrm{avg}}` times has :math:`m N_{\\mathrm{avg}}`
+        effective averages.  Bins holding no frequency are dropped.  Store
+
+        * ``freq_binned``: the mean frequency of each bin [kHz]
+        * ``psd_binned``: the mean power
+        * ``psd_binned_std``: the standard deviation, such that
+          ``psd_binned_std/sqrt(n_avg_binned)`` is the standard error
+        * ``n_avg_binned``: the effective number of averages of each bin
+        """
+
+        self.flush()
+        x = self.f['freq'][()]
+        y = self.f['psd'][()]
+        yerr = self._psd_err(y)
 
+        if bins is None:
+            edges = np.geomspace(x[x > 0].min(), x.max(), n_bins + 1)
+        else:
+            edges = np.asarray(bins, dtype=float)
+            if edges.ndim != 1 or edges.size < 2 or np.any(np.diff(edges) <= 0):
+                raise ValueError("bins must be at least two increasing edges")
+
+        xb, yb, eb, counts = _bin_average(x, y, yerr, edges)
+        n_avg = self.Navg*counts
+
+        freq_attrs = OrderedDict(self.f['freq'].attrs.items())
+        freq_attrs.pop('initial', None)
+        freq_attrs.pop('step', None)
+        freq_attrs['help'] = 'frequency, binned'
+
+        psd_attrs = OrderedDict(self.f['psd'].attrs.items())
+        psd_attrs['abscissa'] = 'freq_binned'
+        psd_attrs['help'] = psd_attrs.get('help', 'power spectrum') + ', binned'
+
+        datasets = [
+            ('freq_binned', xb, freq_attrs),
+            ('psd_binned', yb, psd_attrs),
+            ('psd_binned_std', eb*np.sqrt(n_avg), OrderedDict([
+                ('name','std({0})'.format(psd_attrs.get('name', 'psd'))),
+                ('unit',psd_attrs.get('unit', '')),
+                ('help','standard deviation of the binned power spectrum'),
+                ('abscissa','freq_binned')])),
+            ('n_avg_binned', n_avg, OrderedDict([
+                ('name','n_avg'),
+                ('unit','unitless'),
+                ('help','effective number of averages per bin'),
+                ('abscissa','freq_binned')]))]
+
+        if self.f.__contains__('fit_binned') == True:
+            del self.f['fit_binned']
+
+        for name, data, attrs in datasets:
+            if self.f.__contains__(name) == True:
+                del self.f[name]
+            self.f[name] = data
+            update_attrs(self.f[name].attrs, attrs)
+
+        new_report = []
+        new_report.append("Average the {0}-point power spectrum".format(x.size))
+        new_report.append("into {0} frequency bins.".format(xb.size))
+        self.report.append(" ".join(new_report))
+
+    def fitPx(self, Temp=300, n_linewidths=None, n_baseline_bins=None,
+              jacobian=True, binned=False):
+        """
+        Fit thermal position fluctuations to theory to obtain the cantilever
+        parameters.
+
+        :param float Temp: the cantilever temperature [K]
+        :param float n_linewidths: if given, fit only the bins within this
+            many linewidths of the peak, the linewidth being estimated from
+            the full width at half maximum of the peak.  By default the
+            whole spectrum is fit.
+        :param int n_baseline_bins: with ``n_linewidths``, also fit the
+            spectrum outside the window averaged into this many
+            log-spaced frequency bins on each side, to pin down the baseline
+        :param bool jacobian: If True (default), give the fit the analytic
+            derivatives of ``brownian`` instead of letting it difference
+            the model numerically
+        :param bool binned: If True, fit the spectrum rebinned by
+            :meth:`rebin` instead, weighting each bin by its effective
+            number of averages
+
+        The best fit, evaluated at every frequency, is stored in
+        ``self.f['fit']``, and if the spectrum has been rebinned, at every
+        binned frequency in ``self.f['fit_binned']``.
+        """
+
+        self.flush()
         gmodel = Model(brownian)
         params = Parameters()
 
-        y = self.f['psd'][()]
-        x = self.f['freq'][()]
+        if binned == True:
+            y = self.f['psd_binned'][()]
+            x = self.f['freq_binned'][()]
+        else:
+            y = self.f['psd'][()]
+            x = self.f['freq'][()]
+        yerr = self._psd_err(y, binned)
 
         # The initial guess for the amplitude is max in the spectrum.
 
@@ -229,12 +535,56 @@ class PSD(object):
         tau0guess = 1/(2 * abs(x[index2] - x[index1]))
         params.add('tau0', value=tau0guess, min=0)
 
-        result = gmodel.fit(data=y[()], 
-            params=params, 
-            f=x[()], 
-            weights=np.sqrt(self.Navg)/y[()])
+        # Restrict the fit to a window around the peak, averaging the
+        # spectrum outside it into log-spaced bins
+
+        x_fit, y_fit, yerr_fit = x, y, yerr
+
+        if n_linewidths is not None:
+
+            below = np.nonzero(y[0:index1] < y.max()/2)[0]
+            above = np.nonzero(y[index1:] < y.max()/2)[0]
+            i_lo = below[-1] if below.size > 0 else 0
+            i_hi = index1 + above[0] if above.size > 0 else x.size - 1
+            f_lo = x[index1] - n_linewidths*(x[i_hi] - x[i_lo])
+            f_hi = x[index1] + n_linewidths*(x[i_hi] - x[i_lo])
+
+            inside = (x >= f_lo) & (x <= f_hi)
+            x_fit, y_fit, yerr_fit = [x[inside]], [y[inside]], [yerr[inside]]
+
+            if n_baseline_bins is not None:
+                for side in [(x > 0) & (x < f_lo), x > f_hi]:
+                    if side.sum() > 0:
+                        edges = np.geomspace(x[side].min(), x[side].max(),
+                                             n_baseline_bins + 1)
+                        xb, yb, eb, _ = _bin_average(x[side], y[side],
+                                                     yerr[side], edges)
+                        x_fit.append(xb)
+                        y_fit.append(yb)
+                        yerr_fit.append(eb)
+
+            order = np.argsort(np.concatenate(x_fit))
+            x_fit = np.concatenate(x_fit)[order]
+            y_fit = np.concatenate(y_fit)[order]
+            yerr_fit = np.concatenate(yerr_fit)[order]
+
+        if jacobian == True:
+            fit_kws = {'Dfun': _brownian_residual_jacobian, 'col_deriv': 1}
+        else:
+            fit_kws = None
 
-        self.f['fit'] = result.best_fit
+        result = gmodel.fit(data=y_fit, 
+            params=params, 
+            f=x_fit, 
+            weights=1/yerr_fit,
+            fit_kws=fit_kws)
+
+        for suffix in ['', '_binned']:
+            if self.f.__contains__('freq' + suffix) == True:
+                if self.f.__contains__('fit' + suffix) == True:
+                    del self.f['fit' + suffix]
+                self.f['fit' + suffix] = gmodel.eval(result.params,
+                    f=self.f['freq' + suffix][()])
         self.fitted = True # for plotting
         
         # Save the fitted parameter values and error bars in a dictionary
@@ -292,13 +642,19 @@ class PSD(object):
             been done to the signal 
         
         It is assumed that `s.f['/workup/freq/freq']` and 
-        `s.f['/workup/freq/FT']` exist.  These dataset and their associated
-        attributes are copied to `self.f['freq']` and `self.s['FT']` respectively.
+        `s.f['/workup/freq/FT']` exist.  The frequency dataset and its
+        attributes are copied to `self.f['freq']`.
         If you try to load another signal into an already existing PSD object,
-        it is assumed you want to signal-average the power spectrum.
+        it is assumed you want to signal-average the power spectrum.  The
+        per-bin mean and variance of the spectra are updated in memory by
+        Welford's algorithm and written to `self.f['psd']` and
+        `self.f['psd_std']` by :meth:`flush`, which :meth:`plot_psd`,
+        :meth:`fitPx`, and :meth:`close` call.
 
         """
    
+        psd = s.f['/workup/freq/FT']
+
         if self.Navg == 0:
 
             # copy everything over from the Signal object
@@ -307,33 +663,208 @@ class PSD(object):
             self.f['freq'] = freq[()]
             update_attrs(self.f['freq'].attrs, OrderedDict(freq.attrs.items()))
 
-            psd = s.f['/workup/freq/FT']
-            self.f['psd'] = psd[()]
-            update_attrs(self.f['psd'].attrs, OrderedDict(psd.attrs.items()))
-            self.f['psd'].attrs['abscissa'] = 'freq' # overwrite
+            self._psd_attrs = OrderedDict(psd.attrs.items())
+            self._psd_attrs['abscissa'] = 'freq' # overwrite
 
             new_report = []
             new_report.append("Add a psd signal of length {}".format(len(self.f['freq'])))
             self.report.append(" ".join(new_report))
 
-            self.Navg += 1
+        # running mean and variance, kept in memory
 
-        else:
+        self._accumulate(psd[()][np.newaxis, :])
+
+    def _accumulate(self, P):
+        """
+        Add the spectra ``P``, of shape (K, n_bins), to the running per-bin
+        mean and sum of squared deviations, merging the K new spectra with
+        the ones seen so far as in Chan et al.'s parallel form of Welford's
+        algorithm.
+        """
 
-            # running average, stored in place
+        K = P.shape[0]
+        if K == 0:
+            return
 
-            psd_old = self.f['psd'][()]
-            psd_current = s.f['/workup/freq/FT'][()]
+        mean_b = P.mean(axis=0)
+        M2_b = ((P - mean_b)**2).sum(axis=0)
 
+        if self.Navg == 0:
+            self._mean = mean_b
+            self._M2 = M2_b
+        else:
             n = self.Navg
-            psd_new = (n / (n + 1)) * psd_old + (1 / (n + 1)) * psd_current
-            self.f['psd'][...] = psd_new
+            delta = mean_b - self._mean
+            self._mean = self._mean + delta*(K/(n + K))
+            self._M2 = self._M2 + M2_b + delta**2*(n*K/(n + K))
+
+        self.Navg += K
+        self._dirty = True
+
+    def setup_welch(self, dt, nperseg, noverlap=None, window='hann',
+                    s_name='x', s_unit='pm'):
+        """
+        Prepare to estimate the power spectrum of a time series by Welch's
+        method, averaging the spectra of overlapping segments.  Feed the
+        time series in with :meth:`update`.
+
+        :param float dt: the time per point [s]
+        :param int nperseg: the number of points per segment
+        :param int noverlap: the number of points shared by neighbouring
+            segments; defaults to ``nperseg//2``
+        :param window: the window applied to each segment; a name or tuple
+            understood by ``scipy.signal.get_window`` (defaults to
+            ``'hann'``), or an array of length ``nperseg``.  Use
+            ``'boxcar'`` for the unwindowed spectrum of ``Signal.fft``.
+        :param str s_name: the signal name
+        :param str s_unit: the signal unit
+
+        Each segment's spectrum is normalized like
+        ``Signal.fft(psd=True)`` -- single sided, not doubled, in
+        units of ``s_unit``:superscript:`2`/Hz vs. frequency in kHz -- with
+        the window's power :math:`\\sum w_k^2 / N` divided out.
+        """
+
+        if self.Navg > 0:
+            raise ValueError("This PSD already holds an average")
+
+        if noverlap is None:
+            noverlap = nperseg//2
+        if not 0 <= noverlap < nperseg:
+            raise ValueError("noverlap must be >= 0 and less than nperseg")
+
+        if isinstance(window, (str, tuple)):
+            w = get_window(window, nperseg)
+        else:
+            w = np.asarray(window, dtype=float)
+            if w.shape != (nperseg,):
+                raise ValueError("window must have length nperseg")
+
+        self._welch = {'dt': dt,
+                       'nperseg': nperseg,
+                       'step': nperseg - noverlap,
+                       'w': w,
+                       'scale': dt/np.sum(w**2),
+                       'n_bins': (nperseg + 1)//2,
+                       'buffer': np.zeros(0)}
+
+        freq = np.fft.rfftfreq(nperseg, dt)[0:(nperseg + 1)//2]
+        self.f['freq'] = freq/1E3
+        update_attrs(self.f['freq'].attrs, OrderedDict([
+            ('name','f'),
+            ('unit','kHz'),
+            ('label','f [kHz]'),
+            ('label_latex','$f \\: [\\mathrm{kHz}]$'),
+            ('help','frequency'),
+            ('initial',freq[0]),
+            ('step',freq[1]-freq[0])
+            ]))
+
+        self._psd_attrs = OrderedDict([
+            ('name','FT({0})'.format(s_name)),
+            ('unit','{0}^2/Hz'.format(s_unit)),
+            ('label','PSD({0}) [{1}^2/Hz]'.format(s_name, s_unit)),
+            ('label_latex','$P_{{{0}}} \\: [\\mathrm{{{1}}}^2/\\mathrm{{Hz}}]$'.format(s_name, s_unit)),
+            ('help','Power spectrum of {0}(t)'.format(s_name)),
+            ('abscissa','freq'),
+            ('layout','rfft'),
+            ('n_fft',nperseg),
+            ('n_overlap',noverlap)
+            ])
+
+        new_report = []
+        new_report.append("Average the power spectra of {0}-point".format(nperseg))
+        new_report.append("segments overlapping by {0} points.".format(noverlap))
+        self.report.append(" ".join(new_report))
+
+    def update(self, block):
+        """
+        Add the next points ``block`` of the time series to the Welch
+        average set up by :meth:`setup_welch`.  Every segment completed is
+        windowed and transformed in one batched real FFT, and its spectrum
+        added to the running per-bin mean and variance; the points of an
+        incomplete segment are held until the next block.  Nothing is
+        written to the file until :meth:`flush`.
+        """
+
+        if self._welch is None:
+            raise ValueError("Call setup_welch() before update()")
+
+        W = self._welch
+        x = np.concatenate([W['buffer'], np.asarray(block, dtype=float)])
+        nperseg, step = W['nperseg'], W['step']
+
+        if x.size < nperseg:
+            W['buffer'] = x
+            return
+
+        n_seg = (x.size - nperseg)//step + 1
+        segments = sliding_window_view(x, nperseg)[::step]
+
+        # Transform a bounded number of segments at a time
+
+        n_batch = max(1, _WELCH_BATCH_POINTS//nperseg)
+        for k in range(0, n_seg, n_batch):
+            P = fftbackend.rfft(W['w']*segments[k:k + n_batch], axis=-1)
+            P = W['scale']*(P.real**2 + P.imag**2)
+            self._accumulate(P[:, 0:W['n_bins']])
+
+        W['buffer'] = x[n_seg*step:].copy()
+
+    def flush(self):
+        """
+        Write the averaged power spectrum to ``self.f['psd']``, with its
+        ``n_avg`` attribute, and the per-bin standard deviation of the
+        individual spectra to ``self.f['psd_std']``.
+        """
+
+        if not self._dirty:
+            return
 
-            self.f['psd'].attrs['n_avg'] += 1
-            self.Navg += 1
+        if self.Navg > 1:
+            psd_std = np.sqrt(self._M2/(self.Navg - 1))
+        else:
+            psd_std = np.zeros_like(self._mean)
+
+        for name, data in [('psd', self._mean), ('psd_std', psd_std)]:
+            if self.f.__contains__(name) == True:
+                self.f[name][...] = data
+            else:
+                self.f[name] = data
+
+        update_attrs(self.f['psd'].attrs, self._psd_attrs)
+        self.f['psd'].attrs['n_avg'] = self.Navg
+
+        attrs = OrderedDict([
+            ('name','std({0})'.format(self._psd_attrs['name'])),
+            ('unit',self._psd_attrs['unit']),
+            ('help','standard deviation of the averaged power spectra'),
+            ('abscissa','freq')
+            ])
+        update_attrs(self.f['psd_std'].attrs, attrs)
+
+        self._dirty = False
+
+    @classmethod
+    def from_timeseries(cls, x, dt, nperseg, noverlap=None, window='hann',
+                        s_name='x', s_unit='pm', **kwargs):
+        """
+        Create a *PSD* holding the Welch estimate of the power spectrum of
+        the time series ``x``, averaged over all its segments, without
+        creating a *Signal* per segment.  See :meth:`setup_welch` for the
+        parameters; the remaining keyword arguments go to ``PSD()``.
+        """
 
-        self.mean =  self.f['psd'][()].mean()
-        self.std = self.f['psd'][()].std()   
+        psd = cls(**kwargs)
+        psd.setup_welch(dt, nperseg, noverlap, window, s_name, s_unit)
+        psd.update(x)
+        psd.flush()
+
+        new_report = []
+        new_report.append("Averaged {0} segments.".format(psd.Navg))
+        psd.report.append(" ".join(new_report))
+
+        return psd
 
 def test_signal_detector_noise(plotme):
     """Obtain a target detector noise floor starting with noisy time-series data."""
@@ -382,25 +913,22 @@ def test_signal_thermal_psd(plotme):
     Na = 128                       # no. signal averages; a small power of two (i.e., 8 to 128)
 
     # Run one large simulation, and break it up into smaller sections
-    # for signal-averaging later.  We'll run the simulation for 10 Q cycles of
-    # burn-in, discarding the burn-in data later.  For each of Na runs, carry the
-    # computation out 16 Q cantilever cycles.  This will give at least 16 independent 
-    # points across the cantilever resonance.
+    # for signal-averaging later.  The simulation starts from the 
+    # steady-state distribution, so no burn-in is needed.  For each of Na
+    # runs, carry the computation out 16 Q cantilever cycles.  This will give
+    # at least 16 independent points across the cantilever resonance.
 
     dtau = 1/Ntau
     xth, pth = thermconstants(T, k, f0, Q, dtau, verbose=True)
-    tstop = 10 * Q + Na * 16 * Q
+    tstop = Na * 16 * Q
 
     # An array of time points with units
 
     tu = (1 / (2 * np.pi * f0.to('Hz'))) * np.arange(start=0., stop=tstop, step=dtau)
     dtu = tu[1] - tu[0]
 
-    F = np.random.normal(0., 1., len(tu))  # random force time-series
-    xi = 0.0/xth.to_base_units().magnitude # initial reduced position
-    pi = 0.0/pth.to_base_units().magnitude # initial reduced momentum
-    X0 = np.array([xi, pi])                # unitless initial conditions
-    xu = xth * solve(X0, dtau, Q, F)[:, 0] # run the simulation, create position time series
+    x, p = simulate(dtau, Q, len(tu))      # exact simulation, reduced units
+    xu = xth * x                           # position time series
 
     if plotme:
         plt.subplots(1, 1, figsize=(8, 5), tight_layout=True)
@@ -409,7 +937,7 @@ def test_signal_thermal_psd(plotme):
         plt.ylabel('position [pm]')
         plt.show()
 
-    # Now discard the burn-in data, reshape the position time-series
+    # Now trim the data to a power of two, reshape the position time-series
     # data so we can pretend we did multiple experiments and average
     # the power spectra over the experiments
 
@@ -422,17 +950,12 @@ def test_signal_thermal_psd(plotme):
     dtsig = dtu.to('s').magnitude
     xn = np.sqrt(Pdet/dtsig) * np.random.normal(0, 1., Na*Nchunk).reshape((Na, Nchunk))
 
-    # Now loop over the experiments and average the power spectra
+    # Now average the power spectra of the experiments, Welch-style with
+    # non-overlapping, unwindowed segments
 
-    psd = PSD()
-    for k in np.arange(Na):
-    
-        s = Signal()
-        xsig = xunew[k,:].to('pm').magnitude + xn[k,:]
-        s.load_nparray(xsig, "x", "pm", dtsig)
-        s.fft(psd=True)
-        psd.load_signal(s)
-        s.close()
+    xsig = (xunew.to('pm').magnitude + xn).ravel()
+    psd = PSD.from_timeseries(xsig, dtsig, Nchunk, noverlap=0,
+                              window='boxcar', s_name='x', s_unit='pm')
     
     if plotme:
         psd.plot_psd(x_scale='log')
@@ -70,4 +70,33 @@ def find_nearest(array, value, verbose=False):
         print('index = {:}'.format(index))
         print('target = {:}'.format(value))
         print('actual = {:}'.format(array[index]))
-    return index, array[index]
\ No newline at end of file
+    return index, array[index]
+
+def _smooth_numbers(limit, smooth=5):
+    """All integers <= limit with no prime factor larger than ``smooth``,
+    in increasing order."""
+    if smooth < 2:
+        raise ValueError("smooth must be at least 2, the smallest prime;"
+                         " got {0}".format(smooth))
+    primes = [p for p in range(2, int(smooth) + 1)
+              if all(p % q != 0 for q in range(2, int(p**0.5) + 1))]
+    numbers = [1]
+    for p in primes:
+        new = []
+        for m in numbers:
+            while m <= limit:
+                new.append(m)
+                m *= p
+        numbers = new
+    return sorted(numbers)
+
+def next_fast_len(n, smooth=5):
+    """Smallest FFT-friendly length >= n: the smallest integer >= n with no
+    prime factor larger than ``smooth`` (5 or 7, typically).  With
+    ``smooth=5`` this is ``scipy.fft.next_fast_len(n, real=True)``."""
+    return min(m for m in _smooth_numbers(2*n, smooth) if m >= n)
+
+def prev_fast_len(n, smooth=5):
+    """Largest FFT-friendly length <= n: the largest integer <= n with no
+    prime factor larger than ``smooth`` (5 or 7, typically)."""
+    return max(_smooth_numbers(n, smooth))